@@ -1,21 +1,36 @@
 # Import necessary libraries
 import os  # For reading environment variables
-import requests  # For sending HTTP requests
 import json  # For handling JSON data
 from configparser import RawConfigParser  # For reading configuration files
 from pathlib import Path  # For handling file paths
-import firebase_admin  # For Firebase
-from firebase_admin import credentials, firestore  # For Firestore
-from typing import List, Dict, Any
+import time  # For measuring time to first token
+import threading  # For per-thread request timing
+import logging  # For reporting errors to the structured log
+import requests  # For network errors raised by the HTTP client
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 
+from activity_cache import get_activity_replica, mirror_activity_replicas  # Live local copy of the Activities collection
+from resilience import get_resilient_client, CircuitOpenError, RateLimitTimeout  # Rate limiting, retries, circuit breaker
+from response_cache import make_cache_key  # Cache keys of ChatGPT replies
+from intent import INTENT_MATCHER  # Precompiled intent and interest extractor
+from streaming import iter_completion_deltas  # Chat-completions SSE parser
+from conversation import ConversationStore  # Per-user multi-turn history
+from singleflight import SingleFlight  # Coalescing of identical in-flight prompts
+from tracing import TRACER  # Per-stage latency spans
+from clients import CLIENTS, load_firebase_config  # Process-wide Firestore client, HTTP session and caches
+from lazy_firestore import LazyFirestore, CONNECTING, FAILED, DISABLED  # Firestore client connected off the startup path
+from storage import create_activity_store, get_sqlite_activity_store  # Firestore or local SQLite activity catalog
 from recommend import (
-    is_recommendation_request,
     extract_interests_from_message,
     search_activities_in_db,
+    search_similar_activities_in_db,
     get_activity_recommendations_from_gpt,
+    get_activity_writer,
     format_activities_for_response
 )
 
+logger = logging.getLogger(__name__)
+
 class HKBU_ChatGPT():
     def __init__(self, use_database: bool = True):
         """
@@ -31,25 +46,86 @@ class HKBU_ChatGPT():
         self.api_version = config['api_version']
         self.access_token = config['access_token']
         
-        # Initialize database if needed
-        self.db = None
-        if use_database:
-            try:
-                # Check if Firebase app is already initialized
-                if not firebase_admin._apps:
-                    # Initialize Firebase app
-                    cred = credentials.Certificate(config['firebase_config'])
-                    firebase_admin.initialize_app(cred)
-                    print("Firebase initialized successfully")
-                
-                # Get Firestore database instance
-                self.db = firestore.client()
-                print("Successfully connected to Firestore")
-                
-            except Exception as e:
-                print(f"Firebase initialization failed: {str(e)}")
-                print("Continuing without database support")
-                self.db = None
+        # Shared HTTP client, so all instances reuse the same connections
+        self.http = CLIENTS.http(**config['http'])
+        # Rate-limited, retrying access to the ChatGPT endpoint, shared like the HTTP client
+        self.upstream = get_resilient_client(self.http, **config['upstream'])
+        # Connect and TTFB timing of the request made last on each scheduler thread
+        self._timing = threading.local()
+        
+        # Cache of ChatGPT replies for repeated prompts
+        self.response_cache = CLIENTS.response_cache(**config['cache'])
+        # Parsed GPT recommendations per interest combination, shared with save_activity_to_db
+        self.recommendation_cache = CLIENTS.recommendation_cache(**config['recommendation_cache'])
+        
+        # Identical prompts arriving together share one upstream call
+        self.single_flight = SingleFlight()
+        
+        # Multi-turn history per user, optionally summarizing turns that no longer fit
+        conversation_config = config['conversation']
+        summarize = conversation_config.pop('summarize')
+        self.conversations = ConversationStore(
+            summarizer=self._summarize_turns if summarize else None,
+            **conversation_config
+        )
+        
+        # Firestore is connected in the background (or on the first recommendation),
+        # so the bot starts polling without waiting for firebase_admin and gRPC.
+        # The client is shared by every instance and reconnected when its credential fails
+        database_config = config['database']
+        storage_config = config['storage']
+        self.database_timeout = database_config['wait_timeout']
+        if use_database and storage_config['backend'] == 'firestore':
+            self.database = CLIENTS.firestore(
+                config['firebase_config'],
+                on_ready=lambda db: get_activity_writer(db, **config['write_behind'])
+            )
+            if not database_config['lazy']:
+                self.database.get()
+            elif database_config['warm_up']:
+                # Seed the local replica in the background too, rather than on the first recommendation
+                self.database.warm_up(then=get_activity_replica)
+            CLIENTS.start_health_checks(database_config['health_check_interval'])
+        else:
+            self.database = LazyFirestore(None, enabled=False)
+        
+        # Where activities are searched and saved; a local SQLite store, kept in sync
+        # from the Firestore replica, can answer searches while Firestore is still
+        # connecting or unavailable. Writes always go to the configured store
+        self.storage_backend = storage_config['backend']
+        if self.storage_backend == 'sqlite':
+            self.store = get_sqlite_activity_store(storage_config['sqlite_path'])
+            self.fallback_store = None
+        else:
+            self.store = create_activity_store('firestore', get_db=lambda: self.db, database=self.database)
+            self.fallback_store = get_sqlite_activity_store(storage_config['sqlite_path']) if storage_config['fallback'] else None
+            if self.fallback_store is not None:
+                mirror_activity_replicas(self.fallback_store)
+    
+    @property
+    def db(self):
+        """
+        Firestore database instance, waiting for the connection if it is still being made
+        :return: Firestore client, or None without database support
+        """
+        return self.database.get(self.database_timeout)
+    
+    @property
+    def activities_enabled(self) -> bool:
+        """
+        Whether recommendations can be served from an activity store, never waits for Firestore
+        """
+        return self.storage_backend == 'sqlite' or self.fallback_store is not None or self.database.enabled
+    
+    def activity_store(self):
+        """
+        Activity store to search now: the configured one, or the local fallback
+        while Firestore is connecting, failed or disabled
+        :return: FirestoreActivityStore or SQLiteActivityStore instance
+        """
+        if self.fallback_store is not None and self.database.status in (CONNECTING, FAILED, DISABLED):
+            return self.fallback_store
+        return self.store
     
     def _load_config(self):
         """
@@ -61,61 +137,231 @@ class HKBU_ChatGPT():
         if config_path.exists():
             config.read('config.ini')
         
-        # Get configuration, prioritize environment variables
-        firebase_config = {
-            "type": "service_account",
-            "project_id": os.getenv('FIREBASE_PROJECT_ID') or config.get('FIREBASE', 'PROJECT_ID', fallback=None),
-            "private_key_id": os.getenv('FIREBASE_PRIVATE_KEY_ID') or config.get('FIREBASE', 'PRIVATE_KEY_ID', fallback=None),
-            "private_key": (os.getenv('FIREBASE_PRIVATE_KEY') or config.get('FIREBASE', 'PRIVATE_KEY', fallback=None)).replace('\\n', '\n'),
-            "client_email": os.getenv('FIREBASE_CLIENT_EMAIL') or config.get('FIREBASE', 'CLIENT_EMAIL', fallback=None),
-            "client_id": os.getenv('FIREBASE_CLIENT_ID') or config.get('FIREBASE', 'CLIENT_ID', fallback=None),
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
-            "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-            "client_x509_cert_url": os.getenv('FIREBASE_CLIENT_CERT_URL') or config.get('FIREBASE', 'CLIENT_CERT_URL', fallback=None)
-        }
-        
         return {
             'basic_url': os.getenv('CHATGPT_BASIC_URL') or config.get('CHATGPT', 'BASICURL', fallback=None),
             'model_name': os.getenv('CHATGPT_MODEL_NAME') or config.get('CHATGPT', 'MODELNAME', fallback=None),
             'api_version': os.getenv('CHATGPT_API_VERSION') or config.get('CHATGPT', 'APIVERSION', fallback=None),
             'access_token': os.getenv('CHATGPT_ACCESS_TOKEN') or config.get('CHATGPT', 'ACCESS_TOKEN', fallback=None),
-            'firebase_config': firebase_config
+            'firebase_config': load_firebase_config(config),
+            'database': {
+                'lazy': (os.getenv('FIREBASE_LAZY') or config.get('FIREBASE', 'LAZY', fallback='true')).lower() in ('1', 'true', 'yes'),
+                'warm_up': (os.getenv('FIREBASE_WARM_UP') or config.get('FIREBASE', 'WARM_UP', fallback='true')).lower() in ('1', 'true', 'yes'),
+                'wait_timeout': float(os.getenv('FIREBASE_WAIT_TIMEOUT') or config.get('FIREBASE', 'WAIT_TIMEOUT', fallback='15')),
+                'health_check_interval': float(os.getenv('FIREBASE_HEALTH_CHECK_INTERVAL') or config.get('FIREBASE', 'HEALTH_CHECK_INTERVAL', fallback='60'))
+            },
+            'storage': {
+                'backend': (os.getenv('STORAGE_BACKEND') or config.get('STORAGE', 'BACKEND', fallback='firestore')).lower(),
+                'sqlite_path': os.getenv('STORAGE_SQLITE_PATH') or config.get('STORAGE', 'SQLITE_PATH', fallback='data/activities.db'),
+                'fallback': (os.getenv('STORAGE_FALLBACK') or config.get('STORAGE', 'FALLBACK', fallback='false')).lower() in ('1', 'true', 'yes')
+            },
+            'http': {
+                'pool_size': int(os.getenv('HTTP_POOL_SIZE') or config.get('HTTP', 'POOL_SIZE', fallback='10')),
+                'connect_timeout': float(os.getenv('HTTP_CONNECT_TIMEOUT') or config.get('HTTP', 'CONNECT_TIMEOUT', fallback='5')),
+                'read_timeout': float(os.getenv('HTTP_READ_TIMEOUT') or config.get('HTTP', 'READ_TIMEOUT', fallback='60')),
+                'keep_alive': (os.getenv('HTTP_KEEP_ALIVE') or config.get('HTTP', 'KEEP_ALIVE', fallback='true')).lower() in ('1', 'true', 'yes')
+            },
+            'upstream': {
+                'rate': float(os.getenv('UPSTREAM_RATE') or config.get('UPSTREAM', 'RATE', fallback='5')),
+                'burst': float(os.getenv('UPSTREAM_BURST') or config.get('UPSTREAM', 'BURST', fallback='10')),
+                'max_retries': int(os.getenv('UPSTREAM_MAX_RETRIES') or config.get('UPSTREAM', 'MAX_RETRIES', fallback='3')),
+                'backoff_base': float(os.getenv('UPSTREAM_BACKOFF_BASE') or config.get('UPSTREAM', 'BACKOFF_BASE', fallback='0.5')),
+                'backoff_max': float(os.getenv('UPSTREAM_BACKOFF_MAX') or config.get('UPSTREAM', 'BACKOFF_MAX', fallback='8')),
+                'failure_threshold': int(os.getenv('UPSTREAM_FAILURE_THRESHOLD') or config.get('UPSTREAM', 'FAILURE_THRESHOLD', fallback='5')),
+                'reset_timeout': float(os.getenv('UPSTREAM_RESET_TIMEOUT') or config.get('UPSTREAM', 'RESET_TIMEOUT', fallback='30'))
+            },
+            'cache': {
+                'ttl': float(os.getenv('CACHE_TTL') or config.get('CACHE', 'TTL', fallback='600')),
+                'max_entries': int(os.getenv('CACHE_MAX_ENTRIES') or config.get('CACHE', 'MAX_ENTRIES', fallback='1024')),
+                'max_bytes': int(os.getenv('CACHE_MAX_BYTES') or config.get('CACHE', 'MAX_BYTES', fallback='4194304')),
+                'redis_url': os.getenv('REDIS_URL') or config.get('CACHE', 'REDIS_URL', fallback=None)
+            },
+            'recommendation_cache': {
+                'ttl': float(os.getenv('RECOMMENDATION_CACHE_TTL') or config.get('RECOMMENDATION_CACHE', 'TTL', fallback='3600')),
+                'negative_ttl': float(os.getenv('RECOMMENDATION_CACHE_NEGATIVE_TTL') or config.get('RECOMMENDATION_CACHE', 'NEGATIVE_TTL', fallback='300')),
+                'max_entries': int(os.getenv('RECOMMENDATION_CACHE_MAX_ENTRIES') or config.get('RECOMMENDATION_CACHE', 'MAX_ENTRIES', fallback='512'))
+            },
+            'write_behind': {
+                'flush_interval': float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL') or config.get('WRITE_BEHIND', 'FLUSH_INTERVAL', fallback='0.5')),
+                'max_attempts': int(os.getenv('WRITE_BEHIND_MAX_ATTEMPTS') or config.get('WRITE_BEHIND', 'MAX_ATTEMPTS', fallback='3'))
+            },
+            'conversation': {
+                'max_turns': int(os.getenv('CONVERSATION_MAX_TURNS') or config.get('CONVERSATION', 'MAX_TURNS', fallback='20')),
+                'token_budget': int(os.getenv('CONVERSATION_TOKEN_BUDGET') or config.get('CONVERSATION', 'TOKEN_BUDGET', fallback='2000')),
+                'idle_ttl': float(os.getenv('CONVERSATION_IDLE_TTL') or config.get('CONVERSATION', 'IDLE_TTL', fallback='1800')),
+                'max_users': int(os.getenv('CONVERSATION_MAX_USERS') or config.get('CONVERSATION', 'MAX_USERS', fallback='50000')),
+                'summarize': (os.getenv('CONVERSATION_SUMMARIZE') or config.get('CONVERSATION', 'SUMMARIZE', fallback='false')).lower() in ('1', 'true', 'yes')
+            }
         }
             
-    def submit(self, message):
+    @property
+    def last_timing(self) -> Optional[Dict[str, float]]:
+        """
+        Timing of the last ChatGPT request made by the calling thread, None if the
+        last message it submitted needed no request (cached, coalesced or failed early)
+        """
+        return getattr(self._timing, 'value', None)
+    
+    @TRACER.traced('chatgpt.submit')
+    def submit(self, message, user_id: Optional[str] = None):
         """
         Submit message to ChatGPT API and get reply
         :param message: User input message
+        :param user_id: Telegram user id; when given, earlier turns of the user's conversation are sent too
         :return: ChatGPT reply or error message
         """
-        # Check if this is a recommendation request
-        if is_recommendation_request(message):
-            return self.handle_recommendation_request(message)
+        self._timing.value = None
+        # Check if this is a recommendation request, extracting interests in the same pass
+        with TRACER.span('intent.analyze'):
+            analysis = INTENT_MATCHER.analyze(message)
+        if analysis['is_recommendation']:
+            reply = self.handle_recommendation_request(message, analysis)
+            self._remember(user_id, message, reply)
+            return reply
+        
+        # Regular ChatGPT response, served from cache when the same prompt was seen recently
+        history, cache_key = self._history_and_cache_key(message, user_id)
+        if cache_key is None:
+            # Follow-up in a conversation, answered on its own
+            reply = self._get_chatgpt_response(message, history)
+            if not reply.startswith('Error:'):
+                self._remember(user_id, message, reply)
+            return reply
+        
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            self._remember(user_id, message, cached)
+            return cached
         
-        # Regular ChatGPT response
-        return self._get_chatgpt_response(message)
+        reply = self.single_flight.do(cache_key, lambda: self._get_chatgpt_response(message, history))
+        if not reply.startswith('Error:'):
+            self.response_cache.set(cache_key, reply)
+            self._remember(user_id, message, reply)
+        return reply
+    
+    @TRACER.traced('chatgpt.submit_stream')
+    def submit_stream(self, message: str, user_id: Optional[str] = None) -> Iterator[str]:
+        """
+        Submit message to ChatGPT API and yield the reply as it is generated
+        :param message: User input message
+        :param user_id: Telegram user id; when given, earlier turns of the user's conversation are sent too
+        :return: Iterator of reply fragments; replies that are not generated
+                 token by token (recommendations, cached replies, errors) come as one fragment
+        """
+        self._timing.value = None
+        with TRACER.span('intent.analyze'):
+            analysis = INTENT_MATCHER.analyze(message)
+        if analysis['is_recommendation']:
+            reply = self.handle_recommendation_request(message, analysis)
+            self._remember(user_id, message, reply)
+            yield reply
+            return
+        
+        history, cache_key = self._history_and_cache_key(message, user_id)
+        if cache_key is None:
+            # Follow-up in a conversation, streamed on its own
+            fragments = []
+            for fragment in self._stream_chatgpt_response(message, history):
+                fragments.append(fragment)
+                yield fragment
+            reply = ''.join(fragments)
+            if reply and not reply.startswith('Error:'):
+                self._remember(user_id, message, reply)
+            return
+        
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            self._remember(user_id, message, cached)
+            yield cached
+            return
+        
+        # Only the first caller streams; identical prompts arriving meanwhile get the full reply
+        call, leader = self.single_flight.acquire(cache_key)
+        if not leader:
+            reply = self.single_flight.wait(call)
+            self._remember(user_id, message, reply)
+            yield reply
+            return
+        
+        fragments = []
+        try:
+            for fragment in self._stream_chatgpt_response(message, history):
+                fragments.append(fragment)
+                yield fragment
+        except BaseException as e:
+            # Also reached when the consumer stops iterating (GeneratorExit)
+            error = e if isinstance(e, Exception) else RuntimeError("Streaming call was abandoned")
+            self.single_flight.release(cache_key, call, error=error)
+            raise
+        
+        reply = ''.join(fragments)
+        self.single_flight.release(cache_key, call, reply)
+        if reply and not reply.startswith('Error:'):
+            self.response_cache.set(cache_key, reply)
+            self._remember(user_id, message, reply)
+    
+    def _history_and_cache_key(self, message: str, user_id: Optional[str]) -> Tuple[List[Dict[str, str]], Optional[str]]:
+        """
+        Get the user's conversation history and the cache key of the message
+        :param message: User input message
+        :param user_id: Telegram user id or None
+        :return: (history messages, cache key or None if the message has history and is not cached)
+        """
+        history = self.conversations.history(user_id) if user_id else []
+        return history, make_cache_key(message, self.model_name, self.api_version, history)
+    
+    def _remember(self, user_id: Optional[str], message: str, reply: str):
+        """
+        Add an exchange to the user's conversation history
+        """
+        if user_id:
+            self.conversations.record_exchange(user_id, message, reply)
     
-    def handle_recommendation_request(self, message: str) -> str:
+    def _summarize_turns(self, previous_summary: str, turns: List[Tuple[str, str]]) -> str:
+        """
+        Fold turns that no longer fit the token budget into the rolling summary
+        :param previous_summary: Current summary, may be empty
+        :param turns: Dropped (role, content) turns, oldest first
+        :return: New summary
+        """
+        transcript = '\n'.join(f"{role}: {content}" for role, content in turns)
+        prompt = (
+            "Update the summary of this conversation in at most three sentences, "
+            "keeping facts about the user and what they asked for.\n"
+            f"Current summary: {previous_summary or '(none)'}\n"
+            f"New turns:\n{transcript}"
+        )
+        reply = self._get_chatgpt_response(prompt)
+        return '' if reply.startswith('Error:') else reply
+    
+    @TRACER.traced('recommend.handle')
+    def handle_recommendation_request(self, message: str, interests_data: Dict[str, Any] = None) -> str:
         """
         Handle activity recommendation requests
         :param message: User input message
+        :param interests_data: Interests already extracted from the message, if any
         :return: Response with activity recommendations
         """
         try:
             # Extract interests from message
-            interests_data = extract_interests_from_message(message)
+            if interests_data is None:
+                interests_data = extract_interests_from_message(message)
             
             # First try to find matching activities in database
-            if self.db:
+            store = self.activity_store()
+            if store.available:
                 matching_activities = search_activities_in_db(
-                    self.db,
+                    store,
                     interests_data['interests'],
                     interests_data['categories']
                 )
                 
                 if matching_activities:
                     return format_activities_for_response(matching_activities)
+                
+                # No term matches, try embedding similarity before the slower GPT fallback
+                similar_activities = search_similar_activities_in_db(store, interests_data)
+                if similar_activities:
+                    return format_activities_for_response(similar_activities)
             
             # If no matches found in database, use ChatGPT
             return get_activity_recommendations_from_gpt(self, interests_data)
@@ -123,14 +369,16 @@ class HKBU_ChatGPT():
             print(f"Error handling recommendation request: {str(e)}")
             return "Sorry, there was an error processing your request. Please try again later."
     
-    def _get_chatgpt_response(self, message: str) -> str:
+    @TRACER.traced('chatgpt.llm')
+    def _get_chatgpt_response(self, message: str, history: Optional[List[Dict[str, str]]] = None) -> str:
         """
         Get response from ChatGPT API
         :param message: User input message
+        :param history: Earlier messages of the conversation, oldest first
         :return: ChatGPT response
         """
         # Build conversation content
-        conversation = [{"role": "user", "content": message}]
+        conversation = (history or []) + [{"role": "user", "content": message}]
         
         # Build API request URL
         url = f"{self.basic_url}/deployments/{self.model_name}/chat/completions/?api-version={self.api_version}"
@@ -144,8 +392,11 @@ class HKBU_ChatGPT():
         # Set request body
         payload = { 'messages': conversation }
         
-        # Send POST request
-        response = requests.post(url, json=payload, headers=headers)
+        # Send POST request over the pooled keep-alive session, with rate limiting and retries
+        response, error = self._post_upstream(url, payload, headers)
+        if error:
+            return error
+        self._timing.value = response.timing
         
         # Handle response
         if response.status_code == 200:
@@ -154,44 +405,99 @@ class HKBU_ChatGPT():
             return data['choices'][0]['message']['content']
         else:
             # If request failed, return error message
-            return f'Error: {response.status_code} - {response.text}'
+            return self._error_reply(response)
+    
+    def _post_upstream(self, url: str, payload: Dict[str, Any], headers: Dict[str, str], stream: bool = False):
+        """
+        Send a request to the ChatGPT endpoint through the resilient client
+        :return: (response, None) or (None, error reply) when no response could be obtained
+        """
+        try:
+            return self.upstream.post(url, json=payload, headers=headers, stream=stream), None
+        except CircuitOpenError as e:
+            logger.warning("ChatGPT request rejected: %s", e)
+            return None, 'Error: The ChatGPT service is currently unavailable, please try again in a little while.'
+        except RateLimitTimeout as e:
+            logger.warning("ChatGPT request rejected: %s", e)
+            return None, 'Error: The ChatGPT service is busy right now, please try again in a moment.'
+        except requests.RequestException as e:
+            logger.error("ChatGPT request failed: %s", e)
+            return None, 'Error: Could not reach the ChatGPT service, please try again later.'
+    
+    def _error_reply(self, response) -> str:
+        """
+        Turn a failed response into the error reply shown to the user
+        :param response: Response with a non-200 status
+        :return: Error reply
+        """
+        logger.error("ChatGPT request failed: %s - %s", response.status_code, response.text)
+        if response.status_code == 429:
+            return 'Error: The ChatGPT service is busy right now, please try again in a moment.'
+        if response.status_code >= 500:
+            return 'Error: The ChatGPT service is currently unavailable, please try again in a little while.'
+        return f'Error: {response.status_code} - {response.text}'
+    
+    @TRACER.traced('chatgpt.llm_stream')
+    def _stream_chatgpt_response(self, message: str, history: Optional[List[Dict[str, str]]] = None) -> Iterator[str]:
+        """
+        Get a streamed response from ChatGPT API
+        :param message: User input message
+        :param history: Earlier messages of the conversation, oldest first
+        :return: Iterator of reply fragments
+        """
+        url = f"{self.basic_url}/deployments/{self.model_name}/chat/completions/?api-version={self.api_version}"
+        headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+            'api-key': self.access_token
+        }
+        conversation = (history or []) + [{"role": "user", "content": message}]
+        payload = {'messages': conversation, 'stream': True}
+        
+        # Only the headers are read here, the body is consumed as it arrives
+        start = time.perf_counter()
+        response, error = self._post_upstream(url, payload, headers, stream=True)
+        if error:
+            yield error
+            return
+        # Consumed on the thread that submitted the message
+        timing = self._timing.value = response.timing
+        
+        try:
+            if response.status_code != 200:
+                yield self._error_reply(response)
+                return
+            
+            if 'text/event-stream' not in response.headers.get('Content-Type', ''):
+                # Server ignored the stream flag and sent a complete reply
+                yield response.json()['choices'][0]['message']['content']
+                return
+            
+            for fragment in iter_completion_deltas(response.iter_lines(chunk_size=None)):
+                if 'first_token' not in timing:
+                    timing['first_token'] = time.perf_counter() - start
+                    TRACER.record('chatgpt.first_token', timing['first_token'])
+                yield fragment
+            timing['total'] = time.perf_counter() - start
+        finally:
+            # Returns the connection to the pool, or drops it if the stream was abandoned
+            response.close()
     
     def search_similar_activities(self, user_interests: List[str], category: str = None) -> List[Dict[str, Any]]:
         """
-        Search for similar activities in Firestore based on user interests
+        Search for similar activities in the activity store based on user interests
         :param user_interests: List of user interests
         :param category: Optional category filter
         :return: List of matching activities
         """
-        if not self.db:
-            print("Firestore database not initialized")
+        store = self.activity_store()
+        if not store.available:
+            logger.warning("Activity database not initialized")
             return []
             
         try:
-            activities_ref = self.db.collection('Activities')
-            
-            # Build query
-            query = activities_ref
-            
-            # Add category filter if provided
-            if category:
-                query = query.where('category', '==', category)
-            
-            # Get all activities
-            activities = query.stream()
-            
-            # Convert to list of dictionaries
-            activities_list = [activity.to_dict() for activity in activities]
-            
-            # Filter activities based on keywords matching user interests
-            matching_activities = []
-            for activity in activities_list:
-                # Check if any keyword matches user interests
-                if any(keyword.lower() in [interest.lower() for interest in user_interests] 
-                      for keyword in activity.get('keywords', [])):
-                    matching_activities.append(activity)
-            
-            return matching_activities
+            # Served locally (Firestore replica or SQLite), no network round trip per request
+            return store.search(user_interests, [category] if category else None)
             
         except Exception as e:
             print(f"Error searching activities: {str(e)}")
@@ -203,7 +509,7 @@ class HKBU_ChatGPT():
         :param user_message: User's message about activities they're interested in
         :return: Formatted response with recommendations
         """
-        if not self.db:
+        if not self.activity_store().available:
             return "Sorry, I cannot access the activity database at the moment."
             
         try:
@@ -301,12 +607,6 @@ class HKBU_ChatGPT():
 if __name__ == '__main__':
     # Test code
     try:
-        # Initialize Firebase for testing
-        if not firebase_admin._apps:
-            cred = credentials.Certificate("serviceAccountKey.json")
-            firebase_admin.initialize_app(cred)
-        test_db = firestore.client()
-        
         # Initialize ChatGPT with database
         ChatGPT_test = HKBU_ChatGPT(True)
         
@@ -0,0 +1,411 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from activity_index import ActivityIndex
+from intent import CATEGORY_KEYWORDS
+
+logger = logging.getLogger(__name__)
+
+# A change event: (change type, document id, document data)
+# Change type is one of 'ADDED', 'MODIFIED' or 'REMOVED', or 'RESET' which
+# starts a batch that resends the whole collection after a restarted listener
+Change = Tuple[str, str, Optional[Dict[str, Any]]]
+RESET = 'RESET'
+
+
+class FirestoreChangeSource:
+    """
+    Change source backed by a Firestore snapshot listener.
+
+    The first snapshot delivers every existing document as ADDED, which
+    seeds the replica; later snapshots only carry the documents that changed.
+    A listener whose stream failed for good is restarted, its first snapshot
+    is delivered behind a RESET so deletions missed meanwhile are dropped.
+    """
+
+    def __init__(self, db, collection: str = 'Activities', check_interval: float = 30.0):
+        """
+        Initialize the change source
+        :param db: Firestore database instance
+        :param collection: Collection to watch
+        :param check_interval: Seconds between checks that the listener is still running
+        """
+        self.db = db
+        self.collection = collection
+        self.check_interval = check_interval
+        self.restarts = 0
+        self._watch = None
+        self._on_changes = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._monitor: Optional[threading.Thread] = None
+
+    def start(self, on_changes: Callable[[List[Change]], None]):
+        """
+        Start listening for changes
+        :param on_changes: Called with a batch of changes for every snapshot
+        """
+        self._on_changes = on_changes
+        self._stop.clear()
+        self._listen(resync=False)
+        self._monitor = threading.Thread(target=self._supervise, name=f'watch-{self.collection}', daemon=True)
+        self._monitor.start()
+
+    def _listen(self, resync: bool):
+        first = [resync]
+
+        def on_snapshot(col_snapshot, changes, read_time):
+            batch = [
+                (change.type.name, change.document.id,
+                 change.document.to_dict() if change.type.name != 'REMOVED' else None)
+                for change in changes
+            ]
+            if first[0]:
+                first[0] = False
+                batch.insert(0, (RESET, '', None))
+            self._on_changes(batch)
+
+        self._watch = self.db.collection(self.collection).on_snapshot(on_snapshot)
+
+    def _supervise(self):
+        # The watch retries transient errors itself but closes on anything else,
+        # without telling the callback; restart it from scratch then
+        while not self._stop.wait(self.check_interval):
+            watch = self._watch
+            if watch is None or watch.is_active:
+                continue
+            with self._lock:
+                # Unless stopped meanwhile
+                if self._stop.is_set():
+                    return
+                logger.warning("Snapshot listener on %s stopped, restarting", self.collection)
+                try:
+                    self._listen(resync=True)
+                    self.restarts += 1
+                except Exception as e:
+                    logger.error("Error restarting snapshot listener on %s: %s", self.collection, e)
+
+    def stop(self):
+        """
+        Stop listening for changes
+        """
+        with self._lock:
+            self._stop.set()
+            if self._watch is not None:
+                self._watch.unsubscribe()
+                self._watch = None
+
+class LocalChangeSource:
+    """
+    In-process change source for tests and offline runs.
+
+    Changes are delivered synchronously from the calling thread.
+    """
+
+    def __init__(self, documents: Iterable[Tuple[str, Dict[str, Any]]] = ()):
+        """
+        Initialize the change source
+        :param documents: Initial (document id, activity data) pairs
+        """
+        self._initial = list(documents)
+        self._on_changes = None
+
+    def start(self, on_changes: Callable[[List[Change]], None]):
+        self._on_changes = on_changes
+        on_changes([('ADDED', doc_id, data) for doc_id, data in self._initial])
+
+    def stop(self):
+        self._on_changes = None
+
+    def emit(self, change_type: str, doc_id: str, data: Optional[Dict[str, Any]] = None):
+        """
+        Deliver a single change
+        :param change_type: 'ADDED', 'MODIFIED' or 'REMOVED'
+        :param doc_id: Document id
+        :param data: Document data, None for removals
+        """
+        if self._on_changes is not None:
+            self._on_changes([(change_type, doc_id, data)])
+
+    def add(self, doc_id: str, data: Dict[str, Any]):
+        self.emit('ADDED', doc_id, data)
+
+    def modify(self, doc_id: str, data: Dict[str, Any]):
+        self.emit('MODIFIED', doc_id, data)
+
+    def remove(self, doc_id: str):
+        self.emit('REMOVED', doc_id)
+
+    def resync(self, documents: Iterable[Tuple[str, Dict[str, Any]]]):
+        """
+        Resend the whole collection, as a restarted listener does
+        :param documents: Current (document id, activity data) pairs
+        """
+        if self._on_changes is not None:
+            self._on_changes([(RESET, '', None)] + [('ADDED', doc_id, data) for doc_id, data in documents])
+
+
+class ActivityReplica:
+    """
+    Local replica of the Activities collection kept current from change events
+    """
+
+    def __init__(self, source, embedder=None):
+        """
+        Initialize the replica
+        :param source: Change source with start(on_changes) and stop() methods
+        :param embedder: Optional embedding backend for similarity search
+        """
+        self.source = source
+        self.index = ActivityIndex()
+        self.embeddings = None
+        if embedder is not None:
+            # Imported here, numpy is only needed once a replica exists
+            from embeddings import EmbeddingStore
+            self.embeddings = EmbeddingStore(embedder)
+        self._ready = threading.Event()
+        # Set once seeded or once starting failed, so waiters need not sit out their timeout
+        self._settled = threading.Event()
+        self._lock = threading.Lock()
+        # Serializes batches with attaching mirrors, so a mirror misses none
+        self._apply_lock = threading.Lock()
+        self._mirrors: List[Any] = []
+        self._stats = {'added': 0, 'modified': 0, 'removed': 0, 'snapshots': 0, 'resyncs': 0}
+
+    def start(self, timeout: Optional[float] = 10.0) -> bool:
+        """
+        Start the change source and wait for the initial snapshot
+        :param timeout: Seconds to wait for the seed, None to wait forever
+        :return: True if the replica was seeded in time
+        """
+        try:
+            self.source.start(self._apply)
+        except Exception:
+            self._settled.set()
+            raise
+        return self.wait(timeout)
+
+    def wait(self, timeout: Optional[float] = 10.0) -> bool:
+        """
+        Wait for the initial snapshot
+        :param timeout: Seconds to wait, None to wait forever
+        :return: True if the replica is seeded
+        """
+        self._settled.wait(timeout)
+        return self.ready
+
+    def stop(self):
+        """
+        Stop receiving changes
+        """
+        self.source.stop()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def upsert(self, doc_id: str, activity: Dict[str, Any]):
+        """
+        Add or replace an activity in the index and embedding store
+        :param doc_id: Document id
+        :param activity: Activity data
+        """
+        self.index.upsert(doc_id, activity)
+        if self.embeddings is not None:
+            self.embeddings.upsert(doc_id, activity)
+
+    def remove(self, doc_id: str):
+        """
+        Remove an activity from the index and embedding store
+        :param doc_id: Document id
+        """
+        self.index.remove(doc_id)
+        if self.embeddings is not None:
+            self.embeddings.remove(doc_id)
+
+    def add_mirror(self, store):
+        """
+        Keep another store in sync with the replica, e.g. the SQLite fallback store
+        :param store: Store with an apply_changes(changes) method, filled with the
+                      current activities first if the replica is seeded
+        """
+        with self._apply_lock:
+            if store in self._mirrors:
+                return
+            if self.ready:
+                self._mirror(store, [(RESET, '', None)] +
+                             [('ADDED', doc_id, self.index.get(doc_id)) for doc_id in self.index.ids()])
+            self._mirrors.append(store)
+
+    @staticmethod
+    def _mirror(store, changes: List[Change]):
+        try:
+            store.apply_changes(changes)
+        except Exception as e:
+            logger.error("Error mirroring activity changes: %s", e)
+
+    def _apply(self, changes: List[Change]):
+        """
+        Apply a batch of changes to the index and its mirrors
+        """
+        with self._apply_lock:
+            self._apply_locked(changes)
+
+    def _apply_locked(self, changes: List[Change]):
+        mirrored = changes
+        if not self.ready and not (changes and changes[0][0] == RESET):
+            # The seed holds the whole collection, mirrors drop anything else they have
+            mirrored = [(RESET, '', None)] + list(changes)
+        for store in self._mirrors:
+            self._mirror(store, mirrored)
+
+        resync = bool(changes) and changes[0][0] == RESET
+        if resync:
+            # The whole collection follows, anything not in it was deleted meanwhile
+            changes = changes[1:]
+            present = {doc_id for change_type, doc_id, _ in changes if change_type != 'REMOVED'}
+            for doc_id in self.index.ids():
+                if doc_id not in present:
+                    self.remove(doc_id)
+
+        for change_type, doc_id, data in changes:
+            if change_type == 'REMOVED':
+                self.remove(doc_id)
+            else:
+                self.upsert(doc_id, data or {})
+
+        with self._lock:
+            self._stats['snapshots'] += 1
+            self._stats['resyncs'] += resync
+            for change_type, _, _ in changes:
+                key = change_type.lower()
+                if key in self._stats:
+                    self._stats[key] += 1
+
+        # The first batch is the full collection
+        self._ready.set()
+        self._settled.set()
+
+    def search(self, interests: List[str], categories: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Find activities with a keyword equal to one of the interests
+        :param interests: List of user interests
+        :param categories: Optional list of categories to filter by
+        :return: Matching activities ordered by document id
+        """
+        return self.index.search(interests, categories)
+
+    def rank(self,
+             interests: List[str],
+             categories: Optional[List[str]] = None,
+             limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        Find the best matching activities by BM25 relevance
+        :param interests: List of user interests
+        :param categories: Optional list of categories, boosts activities in them
+        :param limit: Maximum number of results
+        :return: Up to limit activities, best match first
+        """
+        return self.index.rank(interests, categories, limit)
+
+    def similar(self, query: str, limit: int = 5, min_score: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        Find activities by embedding similarity
+        :param query: Query text
+        :param limit: Maximum number of results
+        :param min_score: Minimum cosine similarity
+        :return: Up to limit activities, most similar first
+        """
+        if self.embeddings is None:
+            return []
+        matches = self.embeddings.search([query], limit, min_score)[0]
+        return [activity for activity in (self.index.get(doc_id) for _, doc_id in matches) if activity]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get replica statistics
+        :return: Document count and applied change counts
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats['documents'] = len(self.index)
+        return stats
+
+
+_replicas: Dict[int, ActivityReplica] = {}
+_replicas_lock = threading.Lock()
+# Stores kept in sync with every replica
+_mirrors: List[Any] = []
+
+
+def get_activity_replica(db, timeout: Optional[float] = 10.0) -> ActivityReplica:
+    """
+    Get the live replica for a Firestore client, starting it on first use
+    :param db: Firestore database instance
+    :param timeout: Seconds to wait for the initial snapshot, 0 to not wait
+    :return: ActivityReplica instance
+    """
+    if db is None:
+        raise RuntimeError("Firestore database not initialized")
+    with _replicas_lock:
+        replica = _replicas.get(id(db))
+        created = replica is None
+        if created:
+            from embeddings import HashingEmbedder
+            embedder = HashingEmbedder(concepts=CATEGORY_KEYWORDS)
+            replica = ActivityReplica(FirestoreChangeSource(db), embedder)
+            for store in _mirrors:
+                replica.add_mirror(store)
+            _replicas[id(db)] = replica
+
+    # Wait for the seed without the lock, other replicas and the stats stay reachable
+    if created:
+        try:
+            seeded = replica.start(timeout)
+        except Exception:
+            # Not kept, the next caller starts a fresh replica
+            with _replicas_lock:
+                if _replicas.get(id(db)) is replica:
+                    del _replicas[id(db)]
+            raise
+        if seeded:
+            logger.info("Activity replica seeded with %d activities", len(replica.index))
+        else:
+            logger.warning("Activity replica not seeded yet, results may be incomplete")
+    elif timeout:
+        replica.wait(timeout)
+    return replica
+
+
+def mirror_activity_replicas(store):
+    """
+    Keep a store in sync with the running replica and any started later
+    :param store: Store with an apply_changes(changes) method
+    """
+    with _replicas_lock:
+        if store in _mirrors:
+            return
+        _mirrors.append(store)
+        replicas = list(_replicas.values())
+    for replica in replicas:
+        replica.add_mirror(store)
+
+
+def stop_activity_replicas():
+    """
+    Stop all running replicas
+    """
+    with _replicas_lock:
+        for replica in _replicas.values():
+            replica.stop()
+        _replicas.clear()
+
+
+def activity_replica_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Get statistics of all running replicas
+    :return: Statistics per replica, keyed by its collection
+    """
+    with _replicas_lock:
+        return {getattr(replica.source, 'collection', 'Activities'): replica.stats() for replica in _replicas.values()}
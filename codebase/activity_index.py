@@ -0,0 +1,165 @@
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from ranking import BM25Ranker, tokenize
+
+
+class ActivityIndex:
+    """
+    In-memory inverted index over the Activities collection.
+
+    Maps each lowercased keyword and each category to the ids of the
+    activities that carry it, so a search only touches matching documents
+    instead of streaming and scanning the whole collection.
+    """
+
+    def __init__(self):
+        self._activities: Dict[str, Dict[str, Any]] = {}
+        self._keyword_index: Dict[str, Set[str]] = {}
+        self._category_index: Dict[str, Set[str]] = {}
+        self._ranker = BM25Ranker()
+        self._lock = threading.RLock()
+
+    def load(self, documents: Iterable[Tuple[str, Dict[str, Any]]]):
+        """
+        Replace the index contents
+        :param documents: Iterable of (document id, activity data) pairs
+        """
+        with self._lock:
+            self._activities.clear()
+            self._keyword_index.clear()
+            self._category_index.clear()
+            self._ranker.clear()
+            for doc_id, activity in documents:
+                self._add(doc_id, activity)
+
+    def upsert(self, doc_id: str, activity: Dict[str, Any]):
+        """
+        Add or replace a single activity
+        :param doc_id: Firestore document id
+        :param activity: Activity data
+        """
+        with self._lock:
+            self._discard(doc_id)
+            self._add(doc_id, activity)
+
+    def remove(self, doc_id: str):
+        """
+        Remove a single activity
+        :param doc_id: Firestore document id
+        """
+        with self._lock:
+            self._discard(doc_id)
+
+    def _add(self, doc_id: str, activity: Dict[str, Any]):
+        self._activities[doc_id] = dict(activity)
+        self._ranker.add(doc_id, activity)
+        for keyword in self._keywords(activity):
+            self._keyword_index.setdefault(keyword, set()).add(doc_id)
+        category = activity.get('category')
+        if category is not None:
+            self._category_index.setdefault(category, set()).add(doc_id)
+
+    def _discard(self, doc_id: str):
+        activity = self._activities.pop(doc_id, None)
+        if activity is None:
+            return
+        self._ranker.remove(doc_id, activity)
+        for keyword in self._keywords(activity):
+            ids = self._keyword_index.get(keyword)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self._keyword_index[keyword]
+        category = activity.get('category')
+        ids = self._category_index.get(category)
+        if ids is not None:
+            ids.discard(doc_id)
+            if not ids:
+                del self._category_index[category]
+
+    @staticmethod
+    def _keywords(activity: Dict[str, Any]) -> Set[str]:
+        return {keyword.lower() for keyword in activity.get('keywords', []) if isinstance(keyword, str)}
+
+    def search(self, interests: List[str], categories: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Find activities with a keyword equal to one of the interests
+        :param interests: List of user interests
+        :param categories: Optional list of categories to filter by
+        :return: Matching activities ordered by document id, like a Firestore stream
+        """
+        with self._lock:
+            matched: Set[str] = set()
+            for interest in interests:
+                matched |= self._keyword_index.get(interest.lower(), set())
+
+            if categories:
+                allowed: Set[str] = set()
+                for category in categories:
+                    allowed |= self._category_index.get(category, set())
+                matched &= allowed
+
+            return [dict(self._activities[doc_id]) for doc_id in sorted(matched)]
+
+    def rank(self,
+             interests: List[str],
+             categories: Optional[List[str]] = None,
+             limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        Find the best matching activities by BM25 relevance
+        :param interests: List of user interests
+        :param categories: Optional list of categories, boosts activities in them
+        :param limit: Maximum number of results
+        :return: Up to limit activities, best match first
+        """
+        terms: List[str] = []
+        for text in list(interests) + list(categories or []):
+            terms.extend(tokenize(text))
+        if not terms or limit <= 0:
+            return []
+
+        with self._lock:
+            best = self._ranker.top_k(
+                terms, limit, categories,
+                lambda doc_id: self._activities[doc_id].get('category')
+            )
+            return [dict(self._activities[doc_id]) for _, doc_id in best]
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a single activity
+        :param doc_id: Document id
+        :return: Activity data or None
+        """
+        with self._lock:
+            activity = self._activities.get(doc_id)
+            return dict(activity) if activity is not None else None
+
+    def ids(self) -> List[str]:
+        """
+        List the ids of all activities
+        :return: Document ids
+        """
+        with self._lock:
+            return list(self._activities)
+
+    def in_categories(self, categories: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        List activities in the given categories
+        :param categories: Optional list of categories, all activities when empty
+        :return: Activities ordered by document id
+        """
+        with self._lock:
+            if categories:
+                ids: Set[str] = set()
+                for category in categories:
+                    ids |= self._category_index.get(category, set())
+            else:
+                ids = set(self._activities)
+
+            return [dict(self._activities[doc_id]) for doc_id in sorted(ids)]
+
+    def __len__(self) -> int:
+        return len(self._activities)
+
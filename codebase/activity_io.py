@@ -0,0 +1,169 @@
+import gzip
+import json
+import logging
+import os
+from typing import Any, Dict, IO, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bytes read at a time when streaming a JSON array
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def open_activity_file(path: str, mode: str = 'r') -> IO[str]:
+    """
+    Open an activity file as text, transparently handling gzip
+    :param path: File path, gzip is used when it ends with .gz
+    :param mode: 'r' or 'w'
+    :return: Text file object
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def detect_format(path: str) -> str:
+    """
+    Detect the file format from its extension
+    :param path: File path
+    :return: 'ndjson' for .ndjson/.jsonl files, otherwise 'json'
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'ndjson' if name.endswith(('.ndjson', '.jsonl')) else 'json'
+
+
+def _iter_ndjson(f: IO[str]) -> Iterator[Dict[str, Any]]:
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _iter_json_array(f: IO[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the items of a top-level JSON array without loading the whole file
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    eof = False
+
+    while True:
+        # Skip whitespace and separators
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            chunk = f.read(READ_CHUNK_SIZE)
+            buffer, position = buffer[position:] + chunk, 0
+            eof = not chunk
+
+        if position >= len(buffer):
+            if started:
+                raise ValueError("Unexpected end of JSON array")
+            return
+
+        if not started:
+            if buffer[position] != '[':
+                raise ValueError("Activity file must contain a JSON array")
+            started = True
+            position += 1
+            continue
+
+        if buffer[position] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # The item continues in the next chunk
+            chunk = f.read(READ_CHUNK_SIZE)
+            buffer, position = buffer[position:] + chunk, 0
+            eof = not chunk
+            continue
+
+        if end == len(buffer) and not eof:
+            # A value ending exactly at the buffer end may be cut short
+            chunk = f.read(READ_CHUNK_SIZE)
+            buffer, position = buffer[position:] + chunk, 0
+            eof = not chunk
+            continue
+
+        yield item
+        position = end
+
+
+def iter_activities(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Stream activities from a JSON array or NDJSON file, optionally gzipped
+    :param path: File path
+    :return: Iterator of activity dictionaries
+    """
+    with open_activity_file(path) as f:
+        if detect_format(path) == 'ndjson':
+            yield from _iter_ndjson(f)
+        else:
+            yield from _iter_json_array(f)
+
+
+def write_activities(path: str, activities: Iterable[Dict[str, Any]]) -> int:
+    """
+    Stream activities to a JSON array or NDJSON file, optionally gzipped
+    :param path: File path
+    :param activities: Iterable of activity dictionaries
+    :return: Number of activities written
+    """
+    count = 0
+    ndjson = detect_format(path) == 'ndjson'
+
+    with open_activity_file(path, 'w') as f:
+        if not ndjson:
+            f.write('[')
+        for activity in activities:
+            if ndjson:
+                f.write(json.dumps(activity, ensure_ascii=False))
+                f.write('\n')
+            else:
+                f.write(',\n  ' if count else '\n  ')
+                f.write(json.dumps(activity, ensure_ascii=False, indent=2).replace('\n', '\n  '))
+            count += 1
+        if not ndjson:
+            f.write('\n]' if count else ']')
+
+    return count
+
+
+def read_checkpoint(path: str, input_file: str) -> int:
+    """
+    Read how many records of an input file were already imported
+    :param path: Checkpoint file path
+    :param input_file: Input file the checkpoint must belong to
+    :return: Number of records to skip
+    """
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('input_file') != os.path.abspath(input_file):
+        logger.warning("Ignoring checkpoint %s: it belongs to %s", path, checkpoint.get('input_file'))
+        return 0
+    return int(checkpoint.get('records_done', 0))
+
+
+def write_checkpoint(path: Optional[str], input_file: str, records_done: int):
+    """
+    Atomically record how many records of an input file were imported
+    :param path: Checkpoint file path
+    :param input_file: Input file being imported
+    :param records_done: Number of leading records fully written
+    """
+    if not path:
+        return
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'input_file': os.path.abspath(input_file), 'records_done': records_done}, f)
+    os.replace(temp_path, path)
@@ -0,0 +1,118 @@
+import random
+import re
+import time
+from typing import Any, Dict
+
+from intent import CATEGORY_KEYWORDS, INTENT_MATCHER, RECOMMENDATION_KEYWORDS
+
+
+def legacy_is_recommendation_request(message: str) -> bool:
+    """
+    Previous implementation: one substring test per keyword
+    """
+    message_lower = message.lower()
+    return any(keyword in message_lower for keyword in RECOMMENDATION_KEYWORDS)
+
+
+def legacy_extract_interests_from_message(message: str) -> Dict[str, Any]:
+    """
+    Previous implementation: substring tests per category keyword and one
+    re.findall per interest pattern
+    """
+    categories = []
+    message_lower = message.lower()
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        if any(keyword in message_lower for keyword in keywords):
+            categories.append(category)
+
+    interest_patterns = [
+        r'i like (.*?)[.,!?]',
+        r'i love (.*?)[.,!?]',
+        r'i enjoy (.*?)[.,!?]',
+        r'i want to (.*?)[.,!?]',
+        r'i am interested in (.*?)[.,!?]'
+    ]
+
+    interests = []
+    for pattern in interest_patterns:
+        matches = re.findall(pattern, message_lower)
+        interests.extend(matches)
+
+    return {
+        'categories': categories,
+        'interests': interests,
+        'raw_message': message
+    }
+
+
+def build_corpus(size: int, seed: int = 7):
+    """
+    Generate a corpus of chat messages
+    """
+    rng = random.Random(seed)
+    openers = [
+        "Hello, how are you?", "Can you recommend some activities?", "What can I do this weekend?",
+        "I'm looking for something fun.", "Tell me a joke.", "What events are on tonight?",
+        "I want to join a club.", "Any suggestions?", "Thanks!"
+    ]
+    interests = [
+        "I like playing games with friends.", "I love virtual reality!", "I enjoy painting and drawing.",
+        "I want to learn guitar, maybe join a band.", "I am interested in fitness and sports.",
+        "I like music, I love concerts, I enjoy dancing.", "I like team sports? I love metaverse stuff."
+    ]
+    filler = [
+        "The weather is nice today.", "My exams finish next week.", "I study computer science at HKBU.",
+        "Yesterday was a long day at work.", "Do you know any good restaurants nearby?"
+    ]
+    corpus = []
+    for _ in range(size):
+        parts = [rng.choice(openers)]
+        parts += rng.sample(interests, rng.randint(0, 2))
+        parts += rng.sample(filler, rng.randint(0, 3))
+        rng.shuffle(parts)
+        corpus.append(' '.join(parts))
+    return corpus
+
+
+def run_legacy(corpus):
+    for message in corpus:
+        legacy_is_recommendation_request(message)
+        legacy_extract_interests_from_message(message)
+
+
+def run_compiled(corpus):
+    for message in corpus:
+        INTENT_MATCHER.analyze(message)
+
+
+def measure(func, corpus, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(corpus)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    corpus = build_corpus(5000)
+
+    # The compiled matcher must give exactly the same answers
+    for message in corpus:
+        analysis = INTENT_MATCHER.analyze(message)
+        expected = legacy_extract_interests_from_message(message)
+        assert analysis['is_recommendation'] == legacy_is_recommendation_request(message), message
+        assert analysis['categories'] == expected['categories'], message
+        assert analysis['interests'] == expected['interests'], message
+    print(f"Results identical on {len(corpus)} messages")
+
+    legacy = measure(run_legacy, corpus)
+    compiled = measure(run_compiled, corpus)
+    per_message = 1e6 / len(corpus)
+    print(f"Legacy functions:  {legacy * per_message:8.2f} us/message")
+    print(f"Compiled matcher:  {compiled * per_message:8.2f} us/message")
+    print(f"Speedup:           {legacy / compiled:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
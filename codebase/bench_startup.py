@@ -0,0 +1,88 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+# Runs in a fresh interpreter, so every measurement is a cold start
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import ChatGPT_HKBU
+imported = time.perf_counter()
+chatgpt = ChatGPT_HKBU.HKBU_ChatGPT(use_database=True)
+constructed = time.perf_counter()
+firebase_imported = 'firebase_admin' in sys.modules
+connected = None
+if WAIT_FOR_DATABASE:
+    chatgpt.database.get(30)
+    connected = time.perf_counter() - start
+print(json.dumps({
+    'import': imported - start,
+    'construct': constructed - imported,
+    'startup': constructed - start,
+    'connected': connected,
+    'database': chatgpt.database.status,
+    'firebase_imported': firebase_imported
+}))
+"""
+
+
+def run_probe(lazy: bool, wait_for_database: bool) -> Dict:
+    """
+    Import and construct HKBU_ChatGPT in a new Python process
+    :param lazy: Whether Firestore is connected lazily
+    :param wait_for_database: Also measure the time until the Firestore client is available
+    :return: Timings in seconds as reported by the process
+    """
+    codebase = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [codebase, env.get('PYTHONPATH')]))
+    env['FIREBASE_LAZY'] = 'true' if lazy else 'false'
+    # The probe exits right away, a background replica seed would only add noise
+    env['FIREBASE_WARM_UP'] = 'true' if wait_for_database else 'false'
+    source = PROBE.replace('WAIT_FOR_DATABASE', str(wait_for_database))
+    result = subprocess.run([sys.executable, '-c', source], env=env, capture_output=True, text=True, check=True)
+    # The last line is the probe output, earlier ones are the bot's own prints
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(lazy: bool, runs: int, wait_for_database: bool = False) -> List[Dict]:
+    return [run_probe(lazy, wait_for_database) for _ in range(runs)]
+
+
+def report(label: str, samples: List[Dict]):
+    for key in ('import', 'construct', 'startup', 'connected'):
+        values = [sample[key] for sample in samples if sample[key] is not None]
+        if values:
+            print(f"{label:6} {key:10} median {statistics.median(values) * 1000:8.1f} ms   "
+                  f"max {max(values) * 1000:8.1f} ms")
+    print(f"{label:6} database status {samples[-1]['database']}, "
+          f"firebase_admin imported at startup: {samples[-1]['firebase_imported']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start time of HKBU_ChatGPT, lazy versus eager Firestore")
+    parser.add_argument('--runs', type=int, default=5, help="Fresh processes per mode")
+    parser.add_argument('--budget', type=float, default=1.0, help="Maximum median lazy startup in seconds")
+    parser.add_argument('--connect', action='store_true', help="Also time the background Firestore connection")
+    args = parser.parse_args()
+
+    lazy = measure(True, args.runs, args.connect)
+    eager = measure(False, args.runs)
+    report('lazy', lazy)
+    report('eager', eager)
+
+    lazy_startup = statistics.median(sample['startup'] for sample in lazy)
+    eager_startup = statistics.median(sample['startup'] for sample in eager)
+    print(f"Speedup:          {eager_startup / lazy_startup:8.2f}x")
+    if lazy_startup > args.budget:
+        print(f"Lazy startup {lazy_startup * 1000:.1f} ms is over the {args.budget * 1000:.0f} ms budget")
+        sys.exit(1)
+    print(f"Lazy startup within the {args.budget * 1000:.0f} ms budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,41 @@
 # Import necessary libraries
 from telegram import Update  # Telegram Bot API
 from telegram.ext import (Updater, CommandHandler, MessageHandler, Filters,
-CallbackContext)  # Telegram Bot extensions
+CallbackContext, TypeHandler)  # Telegram Bot extensions
 import os  # For reading environment variables
 import logging  # For logging
+import signal  # For stopping the bot in webhook mode
+import threading  # For the dispatcher thread in webhook mode
+import queue  # For the worker inbox timeout
+import time  # For worker load reports and queue wait times
 from configparser import RawConfigParser  # For reading configuration files
 from pathlib import Path  # For handling file paths
 
 from ChatGPT_HKBU import HKBU_ChatGPT  # Import custom ChatGPT class
+from scheduler import FairScheduler, FAST_LANE, SLOW_LANE  # Fair, prioritized message scheduling
+from intent import INTENT_MATCHER  # Cheap check for recommendation requests
+from conversation import estimate_tokens  # Cost of a chat message for fair queuing
+from streaming import ProgressiveMessage  # Reply message edited as tokens stream in
+from activity_cache import activity_replica_stats  # Firestore snapshot listeners
+from write_behind import write_behind_stats  # Background Firestore writes
+from clients import CLIENTS  # Shared clients, closed on shutdown
+from webhook_server import WebhookServer  # Webhook, health check and metrics endpoints
+from supervisor import WorkerSupervisor  # Multi-process sharding by chat
+from tracing import TRACER, configure_tracing  # Per-stage latency spans
+from logging_setup import configure_logging, dropped_log_records  # Queued JSON logging with rotation
+from metrics import REGISTRY, CONTENT_TYPE, MetricFamily, render_families  # Prometheus metrics
+
+# Messages received, by kind; rates and the recommendation/chat split come from this
+MESSAGES = REGISTRY.counter('chatbot_messages_total', 'Telegram text messages received', ['kind'])
+# End-to-end reply time including the scheduler queue, by kind
+RESPONSE_TIME = REGISTRY.histogram('chatbot_response_seconds', 'Time from receiving a message to sending the reply',
+                                   [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60], ['kind'])
+
+# Sent when a message could not be answered
+ERROR_REPLY = "Sorry, an error occurred while processing your message. Please try again later."
+
+# HTTP server of this process, None in worker processes
+server = None
 
 def load_config():
     """
@@ -27,12 +55,64 @@ def load_config():
     log_format = os.getenv('LOG_FORMAT') or config.get('LOGGING', 'FORMAT', 
                       fallback='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     log_file = os.getenv('LOG_FILE') or config.get('LOGGING', 'FILE', fallback='logs/app.log')
+    log_max_bytes = int(os.getenv('LOG_MAX_BYTES') or config.get('LOGGING', 'MAX_BYTES', fallback='10485760'))
+    log_backup_count = int(os.getenv('LOG_BACKUP_COUNT') or config.get('LOGGING', 'BACKUP_COUNT', fallback='5'))
+    log_rotate_interval = float(os.getenv('LOG_ROTATE_INTERVAL') or config.get('LOGGING', 'ROTATE_INTERVAL', fallback='86400'))
+    log_max_field_length = int(os.getenv('LOG_MAX_FIELD_LENGTH') or config.get('LOGGING', 'MAX_FIELD_LENGTH', fallback='1000'))
+    log_payload_sample_rate = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE') or config.get('LOGGING', 'PAYLOAD_SAMPLE_RATE', fallback='0.1'))
+    
+    # Pipeline configuration
+    max_in_flight = int(os.getenv('PIPELINE_MAX_IN_FLIGHT') or config.get('PIPELINE', 'MAX_IN_FLIGHT', fallback='8'))
+    
+    # Scheduler configuration
+    scheduler_config = {
+        'quantum': float(os.getenv('SCHEDULER_QUANTUM') or config.get('SCHEDULER', 'QUANTUM', fallback='200')),
+        'fast_weight': int(os.getenv('SCHEDULER_FAST_WEIGHT') or config.get('SCHEDULER', 'FAST_WEIGHT', fallback='3')),
+        'slow_weight': int(os.getenv('SCHEDULER_SLOW_WEIGHT') or config.get('SCHEDULER', 'SLOW_WEIGHT', fallback='1')),
+        'fast_deadline': float(os.getenv('SCHEDULER_FAST_DEADLINE') or config.get('SCHEDULER', 'FAST_DEADLINE', fallback='10')),
+        'slow_deadline': float(os.getenv('SCHEDULER_SLOW_DEADLINE') or config.get('SCHEDULER', 'SLOW_DEADLINE', fallback='45'))
+    }
+    
+    # Number of worker processes, 1 handles everything in this process
+    workers = int(os.getenv('WORKERS') or config.get('SUPERVISOR', 'WORKERS', fallback='1'))
+    
+    # HTTP server and webhook configuration
+    server_host = os.getenv('SERVER_HOST') or config.get('SERVER', 'HOST', fallback='0.0.0.0')
+    server_port = int(os.getenv('SERVER_PORT') or config.get('SERVER', 'PORT', fallback='8080'))
+    webhook_enabled = (os.getenv('WEBHOOK_ENABLED') or config.get('WEBHOOK', 'ENABLED', fallback='false')).lower() in ('1', 'true', 'yes')
+    webhook_url = os.getenv('WEBHOOK_URL') or config.get('WEBHOOK', 'URL', fallback=None)
+    webhook_secret = os.getenv('WEBHOOK_SECRET') or config.get('WEBHOOK', 'SECRET', fallback=None)
+    
+    # Tracing configuration
+    tracing = (os.getenv('TRACING_ENABLED') or config.get('TRACING', 'ENABLED', fallback='true')).lower() in ('1', 'true', 'yes')
+    trace_file = os.getenv('TRACING_EXPORT_FILE') or config.get('TRACING', 'EXPORT_FILE', fallback=None)
+    
+    # Streaming configuration
+    streaming = (os.getenv('STREAMING_ENABLED') or config.get('STREAMING', 'ENABLED', fallback='true')).lower() in ('1', 'true', 'yes')
+    edit_interval = float(os.getenv('STREAMING_EDIT_INTERVAL') or config.get('STREAMING', 'EDIT_INTERVAL', fallback='1.0'))
     
     return {
         'telegram_token': telegram_token,
         'log_level': log_level,
         'log_format': log_format,
-        'log_file': log_file
+        'log_file': log_file,
+        'log_max_bytes': log_max_bytes,
+        'log_backup_count': log_backup_count,
+        'log_rotate_interval': log_rotate_interval,
+        'log_max_field_length': log_max_field_length,
+        'log_payload_sample_rate': log_payload_sample_rate,
+        'max_in_flight': max_in_flight,
+        'scheduler': scheduler_config,
+        'workers': workers,
+        'server_host': server_host,
+        'server_port': server_port,
+        'webhook_enabled': webhook_enabled,
+        'webhook_url': webhook_url,
+        'webhook_secret': webhook_secret,
+        'tracing': tracing,
+        'trace_file': trace_file,
+        'streaming': streaming,
+        'edit_interval': edit_interval
     }
 
 def setup_logging(config):
@@ -43,14 +123,16 @@ def setup_logging(config):
     log_dir = Path(config['log_file']).parent
     log_dir.mkdir(parents=True, exist_ok=True)
     
-    # Configure logging
-    logging.basicConfig(
-        level=getattr(logging, config['log_level']),
-        format=config['log_format'],
-        handlers=[
-            logging.FileHandler(config['log_file']),
-            logging.StreamHandler()
-        ]
+    # Log through a queue, the file and console are written by a background thread
+    configure_logging(
+        level=config['log_level'],
+        log_file=config['log_file'],
+        console_format=config['log_format'],
+        max_bytes=config['log_max_bytes'],
+        backup_count=config['log_backup_count'],
+        rotate_interval=config['log_rotate_interval'],
+        max_field_length=config['log_max_field_length'],
+        payload_sample_rate=config['log_payload_sample_rate']
     )
 
 def main():
@@ -64,44 +146,419 @@ def main():
     if not config['telegram_token']:
         raise ValueError("Telegram access token not configured")
     
+    if config['workers'] > 1:
+        run_supervisor(config)
+        return
+    
     # Create Telegram Bot updater
     updater = Updater(token=config['telegram_token'], use_context=True)
     dispatcher = updater.dispatcher
     
     # Initialize ChatGPT handler
-    global chatgpt
+    setup_handlers(config, dispatcher)
+    
+    # Health check and metrics are served in both modes, updates only in webhook mode
+    global server
+    webhook_path = get_webhook_path(config)
+    server = WebhookServer(
+        host=config['server_host'],
+        port=config['server_port'],
+        webhook_path=webhook_path,
+        on_update=lambda data: updater.update_queue.put(Update.de_json(data, updater.bot)),
+        health=health_status,
+        metrics=collect_metrics
+    )
+    server.start()
+    
+    # Start bot
+    if webhook_path:
+        # Updates are acked by the server and queued for the dispatcher thread
+        threading.Thread(target=dispatcher.start, name='dispatcher', daemon=True).start()
+        updater.bot.set_webhook(url=config['webhook_url'].rstrip('/') + webhook_path)
+        logging.info("Bot started successfully in webhook mode")
+        wait_for_stop_signal()
+        dispatcher.stop()
+    else:
+        logging.info("Bot started successfully")
+        updater.start_polling()
+        updater.idle()
+    
+    # Let queued replies finish before exiting
+    server.stop()
+    scheduler.shutdown(wait=True)
+    chatgpt.conversations.close()
+    # Writes out queued activities, then closes Firestore and the HTTP session
+    CLIENTS.shutdown()
+    TRACER.set_exporter(None)
+
+def setup_handlers(config, dispatcher):
+    """
+    Create the ChatGPT client and scheduler and register the message handler
+    """
+    global chatgpt, scheduler, streaming_config
+    configure_tracing(config['tracing'], config['trace_file'])
+    REGISTRY.register_collector(collect_component_metrics)
     chatgpt = HKBU_ChatGPT(use_database=True)  # Enable database support
+    streaming_config = {'enabled': config['streaming'], 'edit_interval': config['edit_interval']}
+    scheduler = FairScheduler(workers=config['max_in_flight'], **config['scheduler'])
     chatgpt_handler = MessageHandler(Filters.text & (~Filters.command), equiped_chatgpt)
     dispatcher.add_handler(chatgpt_handler)
+
+def get_webhook_path(config):
+    """
+    Path Telegram posts updates to, or None when long polling
+    """
+    if not config['webhook_enabled']:
+        return None
+    if not config['webhook_url']:
+        raise ValueError("Webhook URL not configured")
+    # The secret in the path keeps others from posting fake updates
+    return f"/telegram/{config['webhook_secret']}" if config['webhook_secret'] else "/telegram"
+
+def wait_for_stop_signal():
+    """
+    Block until SIGINT or SIGTERM; Updater.idle() only handles signals while polling
+    """
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+    stop.wait()
+
+def run_supervisor(config):
+    """
+    Receive updates in this process and hand them to worker processes by chat
+    """
+    global supervisor, server
+    supervisor = WorkerSupervisor(config['workers'], run_worker)
+    supervisor.start()
     
-    # Start bot
-    logging.info("Bot started successfully")
-    updater.start_polling()
-    updater.idle()
+    webhook_path = get_webhook_path(config)
+    server = WebhookServer(
+        host=config['server_host'],
+        port=config['server_port'],
+        webhook_path=webhook_path,
+        on_update=supervisor.dispatch,
+        health=lambda: {'status': 'ok' if supervisor.alive() else 'error', 'workers_alive': supervisor.alive()},
+        metrics=lambda: (CONTENT_TYPE, render_families(collect_supervisor_metrics()))
+    )
+    server.start()
+    
+    updater = Updater(token=config['telegram_token'], use_context=True)
+    if webhook_path:
+        updater.bot.set_webhook(url=config['webhook_url'].rstrip('/') + webhook_path)
+        logging.info("Supervisor started in webhook mode with %d workers", config['workers'])
+        wait_for_stop_signal()
+    else:
+        # Poll here and forward every update as a plain dict
+        updater.dispatcher.add_handler(TypeHandler(Update, lambda update, context: supervisor.dispatch(update.to_dict())))
+        logging.info("Supervisor started with %d workers", config['workers'])
+        updater.start_polling()
+        updater.idle()
+    
+    server.stop()
+    supervisor.shutdown()
+
+def run_worker(index, inbox, status_queue):
+    """
+    Worker process: handle the updates the supervisor routes to this worker
+    :param index: Worker index
+    :param inbox: Queue of update dicts, None asks the worker to stop
+    :param status_queue: Queue the worker reports its load on
+    """
+    # The supervisor decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    config = load_config()
+    # One log file per worker, processes must not rotate the same file
+    config['log_file'] = str(Path(config['log_file']).with_suffix(f'.worker{index}.log'))
+    # Likewise one trace file per worker, appends from several processes could interleave
+    if config['trace_file']:
+        trace_file = Path(config['trace_file'])
+        config['trace_file'] = str(trace_file.with_suffix(f'.worker{index}{trace_file.suffix}'))
+    setup_logging(config)
+    
+    updater = Updater(token=config['telegram_token'], use_context=True)
+    dispatcher = updater.dispatcher
+    setup_handlers(config, dispatcher)
+    threading.Thread(target=dispatcher.start, name='dispatcher', daemon=True).start()
+    logging.info("Worker %d ready", index)
+    
+    processed = 0
+    last_report = 0.0
+    while True:
+        try:
+            data = inbox.get(timeout=1)
+        except queue.Empty:
+            data = False
+        
+        if data is None:
+            break
+        if data:
+            updater.update_queue.put(Update.de_json(data, updater.bot))
+            processed += 1
+        
+        # Report load about once a second
+        now = time.monotonic()
+        if now - last_report >= 1.0:
+            status_queue.put((index, {'processed': processed,
+                                      'scheduler': scheduler.stats(),
+                                      'metrics': REGISTRY.collect()}))
+            last_report = now
+    
+    # Let the dispatcher hand the remaining updates to the scheduler
+    while not updater.update_queue.empty():
+        time.sleep(0.05)
+    dispatcher.stop()
+    scheduler.shutdown(wait=True)
+    chatgpt.conversations.close()
+    # Writes out queued activities, then closes Firestore and the HTTP session
+    CLIENTS.shutdown()
+    TRACER.set_exporter(None)
+
+def health_status():
+    """
+    Health details for the /health endpoint
+    """
+    global chatgpt
+    
+    database = CLIENTS.health()['firestore']
+    return {
+        'status': 'ok',
+        'upstream_circuit': chatgpt.upstream.breaker.state,
+        'database': database['status'],
+        'database_reconnects': database.get('reconnects', 0)
+    }
+
+def collect_metrics():
+    """
+    Metrics of this process for the /metrics endpoint
+    """
+    return CONTENT_TYPE, REGISTRY.render()
+
+def collect_component_metrics():
+    """
+    Turn the statistics the components keep into metric families, called on every scrape
+    """
+    global chatgpt, scheduler, server
+    
+    scheduler_stats = scheduler.stats()
+    in_flight = MetricFamily('chatbot_messages_in_flight', 'gauge', 'Messages being handled')
+    in_flight.add(scheduler_stats['in_flight'])
+    
+    queue_depth = MetricFamily('chatbot_queue_depth', 'gauge', 'Items waiting in internal queues')
+    shed = MetricFamily('chatbot_messages_shed_total', 'counter', 'Messages dropped because the bot was overloaded')
+    completed = MetricFamily('chatbot_messages_handled_total', 'counter', 'Messages handled, by scheduler lane')
+    for lane, lane_stats in scheduler_stats['lanes'].items():
+        queue_depth.add(lane_stats['queue_depth'], queue=f'scheduler_{lane}')
+        shed.add(lane_stats['shed'], lane=lane, reason='deadline')
+        shed.add(lane_stats['rejected'], lane=lane, reason='admission')
+        completed.add(lane_stats['completed'], lane=lane)
+    
+    firestore_writes = MetricFamily('chatbot_firestore_document_writes_total', 'counter', 'Documents written by the write-behind queue')
+    flush_latency = MetricFamily('chatbot_write_behind_flush_seconds', 'gauge', 'Moving average of write-behind batch commit time')
+    for collection, writer_stats in write_behind_stats().items():
+        queue_depth.add(writer_stats['queue_depth'], queue=f'write_behind_{collection}')
+        firestore_writes.add(writer_stats['written'], collection=collection)
+        flush_latency.add(writer_stats['avg_flush_latency'], collection=collection)
+    
+    # Requests are served from the live replica, so Firestore reads only come from its listener
+    firestore_reads = MetricFamily('chatbot_firestore_document_reads_total', 'counter', 'Documents read from Firestore by snapshot listeners')
+    for collection, replica_stats in activity_replica_stats().items():
+        firestore_reads.add(replica_stats['added'] + replica_stats['modified'] + replica_stats['removed'], collection=collection)
+    database_stats = CLIENTS.health()['firestore']
+    firestore_ready = MetricFamily('chatbot_firestore_ready', 'gauge', 'Whether the Firestore client is connected')
+    firestore_ready.add(database_stats['status'] == 'ready')
+    firestore_reconnects = MetricFamily('chatbot_firestore_reconnects_total', 'counter', 'Firestore reconnects after credential failures')
+    firestore_reconnects.add(database_stats.get('reconnects', 0))
+    firestore_connect = MetricFamily('chatbot_firestore_connect_seconds', 'gauge', 'Time taken to connect to Firestore')
+    if database_stats.get('connect_seconds') is not None:
+        firestore_connect.add(database_stats['connect_seconds'])
+    
+    cache_requests = MetricFamily('chatbot_cache_requests_total', 'counter', 'Cache lookups by result')
+    hit_ratio = MetricFamily('chatbot_cache_hit_ratio', 'gauge', 'Share of cache lookups answered from the cache')
+    response_stats = chatgpt.response_cache.stats()
+    cache_requests.add(response_stats['hits'], cache='response', result='hit')
+    cache_requests.add(response_stats['misses'], cache='response', result='miss')
+    hit_ratio.add(response_stats['hit_ratio'], cache='response')
+    recommendation_stats = chatgpt.recommendation_cache.stats()
+    recommendation_hits = recommendation_stats['hits'] + recommendation_stats['negative_hits']
+    recommendation_lookups = recommendation_hits + recommendation_stats['misses']
+    cache_requests.add(recommendation_stats['hits'], cache='recommendation', result='hit')
+    cache_requests.add(recommendation_stats['negative_hits'], cache='recommendation', result='negative_hit')
+    cache_requests.add(recommendation_stats['misses'], cache='recommendation', result='miss')
+    hit_ratio.add(recommendation_hits / recommendation_lookups if recommendation_lookups else 0.0, cache='recommendation')
+    single_flight_stats = chatgpt.single_flight.stats()
+    cache_requests.add(single_flight_stats['coalesced'], cache='single_flight', result='hit')
+    cache_requests.add(single_flight_stats['executions'], cache='single_flight', result='miss')
+    hit_ratio.add(single_flight_stats['coalesced_ratio'], cache='single_flight')
+    
+    upstream_stats = chatgpt.upstream.stats()
+    upstream = MetricFamily('chatbot_upstream_events_total', 'counter', 'ChatGPT API calls by outcome')
+    for outcome in ('requests', 'attempts', 'successes', 'client_errors', 'throttled', 'server_errors',
+                    'network_errors', 'retries', 'gave_up', 'circuit_rejected', 'rate_limit_timeouts'):
+        upstream.add(upstream_stats[outcome], outcome=outcome)
+    upstream_rate = MetricFamily('chatbot_upstream_rate_limit', 'gauge', 'Current ChatGPT API request rate limit per second')
+    upstream_rate.add(upstream_stats['rate'])
+    circuit_open = MetricFamily('chatbot_upstream_circuit_open', 'gauge', 'Whether the ChatGPT API circuit breaker is open')
+    circuit_open.add(upstream_stats['circuit'] != 'closed')
+    
+    conversation_stats = chatgpt.conversations.stats()
+    conversations = MetricFamily('chatbot_conversations', 'gauge', 'Conversations held in memory')
+    conversations.add(conversation_stats['conversations'])
+    conversation_tokens = MetricFamily('chatbot_conversation_tokens', 'gauge', 'Estimated tokens of all stored conversation history')
+    conversation_tokens.add(conversation_stats['tokens'])
+    
+    # Stage latencies recorded by the tracer, including the LLM call
+    stages = MetricFamily('chatbot_stage_duration_seconds', 'histogram', 'Time spent per stage of handling a message')
+    for stage, stage_stats in TRACER.stats().items():
+        for bound_ms, count in stage_stats['buckets'].items():
+            stages.add(count, '_bucket', stage=stage, le=repr(bound_ms / 1000))
+        stages.add(stage_stats['count'], '_bucket', stage=stage, le='+Inf')
+        stages.add(stage_stats['sum_ms'] / 1000, '_sum', stage=stage)
+        stages.add(stage_stats['count'], '_count', stage=stage)
+    
+    log_dropped = MetricFamily('chatbot_log_records_dropped_total', 'counter', 'Log records dropped because the log queue was full')
+    log_dropped.add(dropped_log_records())
+    
+    families = [in_flight, queue_depth, shed, completed, firestore_ready, firestore_connect, firestore_reconnects, firestore_reads,
+                firestore_writes, flush_latency,
+                cache_requests, hit_ratio, upstream, upstream_rate, circuit_open, conversations,
+                conversation_tokens, stages, log_dropped]
+    if server is not None:
+        http_requests = MetricFamily('chatbot_http_requests_total', 'counter', 'Requests to the webhook, health and metrics server')
+        for kind, count in server.stats().items():
+            http_requests.add(count, kind=kind)
+        families.append(http_requests)
+    return families
+
+def collect_supervisor_metrics():
+    """
+    Metrics of all workers, labelled by worker, plus the supervisor's own
+    """
+    global supervisor, server
+    
+    stats = supervisor.stats()
+    alive = MetricFamily('chatbot_worker_up', 'gauge', 'Whether the worker process is running')
+    restarts = MetricFamily('chatbot_worker_restarts_total', 'counter', 'Worker restarts after a crash')
+    dispatched = MetricFamily('chatbot_worker_dispatched_total', 'counter', 'Updates routed to the worker')
+    inbox = MetricFamily('chatbot_worker_inbox_depth', 'gauge', 'Updates waiting in the worker inbox')
+    merged = {}
+    for worker in stats['workers']:
+        index = str(worker['index'])
+        alive.add(worker['alive'], worker=index)
+        restarts.add(worker['restarts'], worker=index)
+        dispatched.add(worker['dispatched'], worker=index)
+        inbox.add(worker['inbox_depth'], worker=index)
+        # Each worker reports its own families, merge them into one block per metric
+        for family in worker['status'].get('metrics', ()):
+            target = merged.setdefault(family.name, MetricFamily(family.name, family.type, family.documentation))
+            for suffix, labels, value in family.samples:
+                target.samples.append((suffix, dict(labels, worker=index), value))
+    
+    http_requests = MetricFamily('chatbot_http_requests_total', 'counter', 'Requests to the webhook, health and metrics server')
+    for kind, count in server.stats().items():
+        http_requests.add(count, kind=kind)
+    return [alive, restarts, dispatched, inbox, http_requests] + list(merged.values())
 
 # ChatGPT message handler
 def equiped_chatgpt(update, context):
-    global chatgpt
+    """
+    Queue the message on the scheduler so the dispatcher thread is not blocked
+    by the ChatGPT call
+    """
+    global chatgpt, scheduler
+    
+    user_message = update.message.text
+    user_id = str(update.effective_user.id)
+    
+    # Recommendations are usually answered from the activity index, free-form chats need GPT
+    kind = 'recommendation' if INTENT_MATCHER.is_recommendation(user_message) else 'chat'
+    MESSAGES.inc(kind)
+    # Only checks the connection state, the dispatcher thread never waits for Firestore
+    if chatgpt.activities_enabled and kind == 'recommendation':
+        lane, cost = FAST_LANE, 1
+    else:
+        lane, cost = SLOW_LANE, estimate_tokens(user_message)
+    
+    received_at = time.monotonic()
+    # Keyed by user: a user's messages are answered in the order sent, whichever lane they are in
+    accepted = scheduler.submit(user_id, lambda: process_message(update, context, received_at, kind), lane, cost,
+                                on_shed=lambda: send_busy_reply(update, context))
+    if not accepted:
+        send_busy_reply(update, context)
+    logging.debug("Message from user %s %s in %s lane", user_id, 'queued' if accepted else 'refused', lane)
+
+def send_busy_reply(update, context):
+    """
+    Tell the user their message was dropped because the bot is overloaded
+    """
+    logging.warning("Shedding message from user %s, bot is overloaded", update.effective_user.id)
+    context.bot.send_message(chat_id=update.effective_chat.id,
+                             text="Sorry, I'm getting a lot of messages right now. Please try again in a minute.")
+
+def process_message(update, context, received_at=None, kind='chat'):
+    """
+    Get the ChatGPT reply for a message and send it back to the user
+    """
+    global chatgpt, streaming_config
     
     # Get user message
     user_message = update.message.text
     user_id = str(update.effective_user.id)
     
+    if received_at is not None:
+        TRACER.record('scheduler.wait', time.monotonic() - received_at)
+    with TRACER.span('telegram.message', streaming=streaming_config['enabled']):
+        handle_message(update, context, user_message, user_id)
+    if received_at is not None:
+        RESPONSE_TIME.observe(time.monotonic() - received_at, kind)
+
+def handle_message(update, context, user_message, user_id):
+    """
+    Reply to a message, streaming the reply when enabled
+    """
+    global chatgpt, streaming_config
+    
     try:
+        if streaming_config['enabled']:
+            # Show the reply while it is generated, editing one message as tokens arrive
+            reply = ProgressiveMessage(context.bot, update.effective_chat.id,
+                                       min_interval=streaming_config['edit_interval'])
+            for fragment in chatgpt.submit_stream(user_message, user_id):
+                reply.append(fragment)
+            reply_message = reply.finish()
+            if not reply_message.strip():
+                # The stream ended without content and nothing was shown, answer like the non-streaming path
+                logging.warning("Streamed reply for user %s was empty", user_id)
+                reply_message = ERROR_REPLY
+                with TRACER.span('telegram.send'):
+                    context.bot.send_message(chat_id=update.effective_chat.id, text=reply_message)
+            
+            log_exchange(user_id, user_message, reply_message)
+            logging.debug("Streamed reply in %d message(s) with %d edit(s), timing: %s",
+                          reply.messages_sent, reply.edits, chatgpt.last_timing)
+            return
+        
         # Get ChatGPT reply
-        reply_message = chatgpt.submit(user_message)
+        reply_message = chatgpt.submit(user_message, user_id)
         
         # Log the interaction
-        logging.info(f"User {user_id} sent message: {user_message}")
-        logging.info(f"ChatGPT reply: {reply_message}")
+        log_exchange(user_id, user_message, reply_message)
         
         # Send reply to user
-        context.bot.send_message(chat_id=update.effective_chat.id, text=reply_message)
+        with TRACER.span('telegram.send'):
+            context.bot.send_message(chat_id=update.effective_chat.id, text=reply_message)
         
     except Exception as e:
-        logging.error(f"Error processing message: {str(e)}")
-        context.bot.send_message(chat_id=update.effective_chat.id, 
-                                text="Sorry, an error occurred while processing your message. Please try again later.")
+        logging.exception("Error processing message from user %s", user_id)
+        context.bot.send_message(chat_id=update.effective_chat.id, text=ERROR_REPLY)
         
+def log_exchange(user_id, user_message, reply_message):
+    """
+    Log a handled message; the texts are kept on a sample of records only, truncated
+    """
+    logging.info("Replied to user %s (%d chars in, %d chars out)", user_id, len(user_message), len(reply_message),
+                 extra={'payload': {'message': user_message, 'reply': reply_message}})
+
 if __name__ == '__main__':
     main()
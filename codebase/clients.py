@@ -0,0 +1,266 @@
+import logging
+import os
+import threading
+import time
+from configparser import RawConfigParser
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Union
+
+from activity_cache import stop_activity_replicas
+from http_client import PooledHTTPClient, get_http_client
+from lazy_firestore import READY, LazyFirestore
+from response_cache import RecommendationCache, ResponseCache, create_response_cache, get_recommendation_cache
+from storage import close_sqlite_activity_stores
+from write_behind import close_write_behind, retarget_write_behind
+
+logger = logging.getLogger(__name__)
+
+
+def load_firebase_config(config: Optional[RawConfigParser] = None, config_path: str = 'config.ini') -> Dict[str, Any]:
+    """
+    Build the Firebase service account, prioritize environment variables, fall back to the config file
+    :param config: Already parsed configuration, read from config_path if not given
+    :param config_path: Configuration file path
+    :return: Service account fields for firebase_admin.credentials.Certificate
+    """
+    if config is None:
+        config = RawConfigParser()
+        if Path(config_path).exists():
+            config.read(config_path)
+
+    private_key = os.getenv('FIREBASE_PRIVATE_KEY') or config.get('FIREBASE', 'PRIVATE_KEY', fallback=None)
+    return {
+        "type": "service_account",
+        "project_id": os.getenv('FIREBASE_PROJECT_ID') or config.get('FIREBASE', 'PROJECT_ID', fallback=None),
+        "private_key_id": os.getenv('FIREBASE_PRIVATE_KEY_ID') or config.get('FIREBASE', 'PRIVATE_KEY_ID', fallback=None),
+        "private_key": private_key.replace('\\n', '\n') if private_key else None,
+        "client_email": os.getenv('FIREBASE_CLIENT_EMAIL') or config.get('FIREBASE', 'CLIENT_EMAIL', fallback=None),
+        "client_id": os.getenv('FIREBASE_CLIENT_ID') or config.get('FIREBASE', 'CLIENT_ID', fallback=None),
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
+        "client_x509_cert_url": os.getenv('FIREBASE_CLIENT_CERT_URL') or config.get('FIREBASE', 'CLIENT_CERT_URL', fallback=None)
+    }
+
+
+def is_auth_error(error: BaseException) -> bool:
+    """
+    Whether an exception means the credential can no longer get access tokens
+    :param error: Exception raised by a Firestore call
+    :return: True for token refresh failures such as invalid_grant
+    """
+    # google.auth.exceptions.RefreshError, matched by name so google.auth is not imported here
+    if any(cls.__name__ == 'RefreshError' for cls in type(error).__mro__):
+        return True
+    return 'invalid_grant' in str(error)
+
+
+class ClientRegistry:
+    """
+    Process-wide owner of the clients the bot shares: the Firestore client,
+    the pooled HTTP session and the caches.
+
+    Each client is created by the first caller, later callers get the same
+    instance, so there is one gRPC channel and one credential refreshing
+    tokens per process. Firestore auth failures reported by any user of the
+    client trigger one reconnect with a fresh credential, at most once per
+    ``reconnect_interval`` however many requests fail together.
+    """
+
+    def __init__(self, reconnect_interval: float = 30.0):
+        """
+        Initialize an empty registry
+        :param reconnect_interval: Minimum seconds between two Firestore reconnects
+        """
+        self.reconnect_interval = reconnect_interval
+        self._lock = threading.Lock()
+        self._firestore: Optional[LazyFirestore] = None
+        self._on_ready: Optional[Callable[[Any], None]] = None
+        self._replaced = None
+        self._last_reconnect = float('-inf')
+        self._http: Optional[PooledHTTPClient] = None
+        self._response_cache: Optional[ResponseCache] = None
+        self._recommendation_cache: Optional[RecommendationCache] = None
+        self._health = {'auth_errors': 0, 'checks': 0, 'failed_checks': 0, 'last_check': None, 'last_error': None}
+        self._health_stop = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+
+    def firestore(self,
+                  credential: Union[Dict[str, Any], str, None] = None,
+                  on_ready: Optional[Callable[[Any], None]] = None,
+                  enabled: bool = True) -> LazyFirestore:
+        """
+        Get the Firestore client holder, creating it on first use
+        :param credential: Service account fields or the path of a service account file,
+                           only used on first call; defaults to load_firebase_config()
+        :param on_ready: Called with every new client before it is handed out, only used on first call
+        :param enabled: False to never connect, only used on first call
+        :return: Shared LazyFirestore instance
+        """
+        with self._lock:
+            if self._firestore is None:
+                self._on_ready = on_ready
+                self._firestore = LazyFirestore(credential or load_firebase_config(), self._connected, enabled)
+            return self._firestore
+
+    def _connected(self, client):
+        # A reconnect hands the queued writes to the new client; replicas reseed from it
+        with self._lock:
+            previous, self._replaced = self._replaced, None
+        if previous is not None:
+            retarget_write_behind(previous, client)
+            stop_activity_replicas()
+            previous.close()
+        if self._on_ready is not None:
+            self._on_ready(client)
+
+    def http(self, **settings) -> PooledHTTPClient:
+        """
+        Get the pooled HTTP client
+        :param settings: PooledHTTPClient arguments, only used on first call
+        :return: Shared PooledHTTPClient instance
+        """
+        with self._lock:
+            if self._http is None:
+                self._http = get_http_client(**settings)
+            return self._http
+
+    def response_cache(self, **settings) -> ResponseCache:
+        """
+        Get the ChatGPT reply cache
+        :param settings: create_response_cache arguments, only used on first call
+        :return: Shared ResponseCache instance
+        """
+        with self._lock:
+            if self._response_cache is None:
+                self._response_cache = create_response_cache(**settings)
+            return self._response_cache
+
+    def recommendation_cache(self, **settings) -> RecommendationCache:
+        """
+        Get the recommendation cache
+        :param settings: RecommendationCache arguments, only used on first call
+        :return: Shared RecommendationCache instance
+        """
+        with self._lock:
+            if self._recommendation_cache is None:
+                self._recommendation_cache = get_recommendation_cache(**settings)
+            return self._recommendation_cache
+
+    def report_error(self, error: BaseException) -> bool:
+        """
+        Tell the registry a Firestore call failed; auth failures reconnect the client
+        :param error: Exception raised by the call
+        :return: True if a reconnect was started
+        """
+        if not is_auth_error(error):
+            return False
+        with self._lock:
+            self._health['auth_errors'] += 1
+            self._health['last_error'] = str(error)
+        return self.reconnect_firestore()
+
+    def reconnect_firestore(self, force: bool = False) -> bool:
+        """
+        Replace the Firestore client with one using a fresh credential
+        :param force: Reconnect even if the last reconnect was less than reconnect_interval ago
+        :return: True if a reconnect was started
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._firestore is None or (not force and now - self._last_reconnect < self.reconnect_interval):
+                return False
+            self._last_reconnect = now
+            # Under the lock, so a concurrent reconnect cannot overwrite the client to retarget
+            # and _connected, which takes the lock on the warm-up thread, sees it
+            reconnects = self._firestore.reconnects
+            previous = self._firestore.reconnect()
+            if self._firestore.reconnects == reconnects:
+                # Still connecting or closed
+                return False
+            # None after a failed connection; a client dropped earlier then still awaits retargeting
+            if previous is not None:
+                self._replaced = previous
+        logger.warning("Reconnecting to Firestore with a fresh credential")
+        return True
+
+    def check_firestore(self, timeout: float = 10.0) -> bool:
+        """
+        Read one document to verify the Firestore client works, reconnecting on auth failures
+        :param timeout: Seconds to wait for the read
+        :return: True if the read succeeded
+        """
+        db = self._firestore.client if self._firestore is not None else None
+        if db is None:
+            return False
+        try:
+            db.collection('Activities').limit(1).get(timeout=timeout)
+            healthy = True
+        except Exception as e:
+            logger.error("Firestore health check failed: %s", e)
+            self.report_error(e)
+            healthy = False
+        with self._lock:
+            self._health['checks'] += 1
+            self._health['last_check'] = time.time()
+            if not healthy:
+                self._health['failed_checks'] += 1
+        return healthy
+
+    def start_health_checks(self, interval: float = 60.0):
+        """
+        Check the Firestore client in the background every interval seconds
+        :param interval: Seconds between checks, 0 to disable
+        """
+        if interval <= 0 or self._health_thread is not None:
+            return
+
+        def run():
+            while not self._health_stop.wait(interval):
+                if self._firestore is not None and self._firestore.status == READY:
+                    self.check_firestore(min(interval, 10.0))
+
+        self._health_thread = threading.Thread(target=run, name='client-health', daemon=True)
+        self._health_thread.start()
+
+    def health(self) -> Dict[str, Any]:
+        """
+        Get the state of all clients without touching the network
+        :return: Firestore status and check results, HTTP and cache statistics
+        """
+        with self._lock:
+            firestore, http = self._firestore, self._http
+            response_cache, recommendation_cache = self._response_cache, self._recommendation_cache
+            health = dict(self._health)
+        if firestore is not None:
+            health.update(firestore.stats())
+        else:
+            health['status'] = 'disabled'
+        return {
+            'firestore': health,
+            'http': http.stats() if http is not None else None,
+            'response_cache': response_cache.stats() if response_cache is not None else None,
+            'recommendation_cache': recommendation_cache.stats() if recommendation_cache is not None else None
+        }
+
+    def shutdown(self, timeout: Optional[float] = 30.0):
+        """
+        Write out queued documents and close every client and local store
+        :param timeout: Maximum seconds to wait for queued writes
+        """
+        self._health_stop.set()
+        # Write out queued activities before the replicas they update are stopped
+        close_write_behind(timeout)
+        stop_activity_replicas()
+        close_sqlite_activity_stores()
+        with self._lock:
+            firestore, http = self._firestore, self._http
+            self._firestore = self._http = None
+        if firestore is not None:
+            firestore.close()
+        if http is not None:
+            http.close()
+
+
+# Shared registry of the bot process
+CLIENTS = ClientRegistry()
@@ -0,0 +1,250 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rough token count overhead of each chat message (role and separators)
+MESSAGE_TOKEN_OVERHEAD = 4
+
+# (role, content, estimated tokens)
+Turn = Tuple[str, str, int]
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the token count of a text without a tokenizer
+    :param text: Message text
+    :return: Estimated tokens, about four characters per token for English
+    """
+    # CJK characters are usually a token each
+    wide = sum(1 for char in text if ord(char) > 0x2e80)
+    return math.ceil((len(text) - wide) / 4) + wide + MESSAGE_TOKEN_OVERHEAD
+
+
+class Conversation:
+    """
+    Recent turns of one user's conversation
+    """
+
+    __slots__ = ('turns', 'tokens', 'summary', 'summary_tokens', 'last_active')
+
+    def __init__(self, max_turns: int):
+        self.turns: Deque[Turn] = deque(maxlen=max_turns)
+        self.tokens = 0
+        self.summary = ''
+        self.summary_tokens = 0
+        self.last_active = time.monotonic()
+
+    def append(self, turn: Turn) -> Optional[Turn]:
+        """
+        Add a turn, returning the turn pushed out of the ring buffer, if any
+        """
+        dropped = self.turns[0] if len(self.turns) == self.turns.maxlen else None
+        self.turns.append(turn)
+        self.tokens += turn[2]
+        if dropped is not None:
+            self.tokens -= dropped[2]
+        return dropped
+
+    def pop_oldest(self) -> Turn:
+        turn = self.turns.popleft()
+        self.tokens -= turn[2]
+        return turn
+
+    def size(self) -> Tuple[int, int]:
+        """
+        Stored turns and estimated tokens including the summary
+        """
+        return len(self.turns), self.tokens + self.summary_tokens
+
+
+class ConversationStore:
+    """
+    Multi-turn history per user, bounded in turns, tokens and users.
+
+    Each user keeps at most ``max_turns`` turns in a ring buffer. When the
+    history goes over ``token_budget`` the oldest turns are dropped, or, if
+    a summarizer is given, folded into a rolling summary. Summaries are
+    written on a background thread, off the reply path; until one is done
+    the dropped turns are simply missing from the history. Users idle for
+    ``idle_ttl`` seconds are evicted, and at most ``max_users`` are kept.
+    """
+
+    def __init__(self,
+                 max_turns: int = 20,
+                 token_budget: int = 2000,
+                 idle_ttl: float = 1800,
+                 max_users: int = 50000,
+                 summarizer: Optional[Callable[[str, List[Tuple[str, str]]], str]] = None,
+                 summary_budget: int = 300,
+                 background: bool = True):
+        """
+        Initialize the store
+        :param max_turns: Maximum turns (user and assistant messages) kept per user
+        :param token_budget: Maximum estimated tokens of history sent with a message
+        :param idle_ttl: Seconds without messages after which a conversation is forgotten
+        :param max_users: Maximum number of conversations kept, least recently active go first
+        :param summarizer: Optional callable(previous summary, dropped (role, content) turns) returning a new summary
+        :param summary_budget: Maximum estimated tokens of the rolling summary
+        :param background: Summarize on a background thread, False to summarize inside record_exchange
+        """
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self.summarizer = summarizer
+        self.summary_budget = summary_budget
+        # One thread, so a user's summaries are written in order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='summarizer') \
+            if summarizer and background else None
+
+        # Ordered by last activity, so idle conversations are at the front
+        self._conversations: 'OrderedDict[str, Conversation]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.truncated_turns = 0
+        self.summaries = 0
+        # Running totals, so stats need not walk every conversation
+        self._turns = 0
+        self._tokens = 0
+
+    def _account(self, before: Tuple[int, int], after: Tuple[int, int]):
+        # Caller holds the lock
+        self._turns += after[0] - before[0]
+        self._tokens += after[1] - before[1]
+
+    def _evict(self, now: float):
+        # Caller holds the lock
+        while self._conversations:
+            user_id, conversation = next(iter(self._conversations.items()))
+            if len(self._conversations) <= self.max_users and now - conversation.last_active < self.idle_ttl:
+                break
+            del self._conversations[user_id]
+            self._account(conversation.size(), (0, 0))
+            self.evictions += 1
+
+    def history(self, user_id: str) -> List[Dict[str, str]]:
+        """
+        Get the history to send before a new message
+        :param user_id: Telegram user id
+        :return: Chat messages, oldest first, within the token budget
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            conversation = self._conversations.get(user_id)
+            if conversation is None:
+                return []
+
+            messages = []
+            if conversation.summary:
+                messages.append({'role': 'system',
+                                 'content': f"Summary of the earlier conversation: {conversation.summary}"})
+            messages.extend({'role': role, 'content': content} for role, content, _ in conversation.turns)
+            return messages
+
+    def record_exchange(self, user_id: str, message: str, reply: str):
+        """
+        Add a user message and the reply to the user's history
+        :param user_id: Telegram user id
+        :param message: User message
+        :param reply: Assistant reply
+        """
+        now = time.monotonic()
+        dropped: List[Turn] = []
+        with self._lock:
+            conversation = self._conversations.get(user_id)
+            if conversation is None:
+                conversation = Conversation(self.max_turns)
+                self._conversations[user_id] = conversation
+            else:
+                self._conversations.move_to_end(user_id)
+            conversation.last_active = now
+            before = conversation.size()
+
+            for turn in (('user', message, estimate_tokens(message)),
+                         ('assistant', reply, estimate_tokens(reply))):
+                pushed_out = conversation.append(turn)
+                if pushed_out is not None:
+                    dropped.append(pushed_out)
+
+            # Oldest-first truncation to the token budget
+            while conversation.turns and conversation.tokens + conversation.summary_tokens > self.token_budget:
+                dropped.append(conversation.pop_oldest())
+
+            self.truncated_turns += len(dropped)
+            self._account(before, conversation.size())
+            self._evict(now)
+
+        if dropped and self.summarizer:
+            # Calls the LLM, so done outside the lock and, by default, off the reply path
+            if self._executor is not None:
+                self._executor.submit(self._summarize, user_id, conversation, dropped)
+            else:
+                self._summarize(user_id, conversation, dropped)
+
+    def _summarize(self, user_id: str, conversation: Conversation, dropped: List[Turn]):
+        with self._lock:
+            # Read now rather than when the turns were dropped, an earlier summary may have landed since
+            previous_summary = conversation.summary
+        try:
+            summary = self.summarizer(previous_summary, [(role, content) for role, content, _ in dropped])
+        except Exception as e:
+            logger.error("Error summarizing conversation: %s", e)
+            return
+        if not summary:
+            return
+
+        # Keep the summary within its own budget
+        max_chars = self.summary_budget * 4
+        if len(summary) > max_chars:
+            summary = summary[:max_chars]
+
+        with self._lock:
+            before = conversation.size()
+            conversation.summary = summary
+            conversation.summary_tokens = estimate_tokens(summary)
+            self.summaries += 1
+            while conversation.turns and conversation.tokens + conversation.summary_tokens > self.token_budget:
+                conversation.pop_oldest()
+                self.truncated_turns += 1
+            # An evicted or cleared conversation no longer counts towards the totals
+            if self._conversations.get(user_id) is conversation:
+                self._account(before, conversation.size())
+
+    def clear(self, user_id: str):
+        """
+        Forget a user's conversation
+        :param user_id: Telegram user id
+        """
+        with self._lock:
+            conversation = self._conversations.pop(user_id, None)
+            if conversation is not None:
+                self._account(conversation.size(), (0, 0))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get store statistics
+        :return: Conversation count, stored turns and tokens, eviction and truncation counters
+        """
+        with self._lock:
+            return {
+                'conversations': len(self._conversations),
+                'turns': self._turns,
+                'tokens': self._tokens,
+                'evictions': self.evictions,
+                'truncated_turns': self.truncated_turns,
+                'summaries': self.summaries
+            }
+
+    def close(self):
+        """
+        Stop the summarizer thread, summaries still queued are dropped
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,8 +1,13 @@
 import json
-import firebase_admin
-from firebase_admin import credentials, firestore
+import logging
 import os
 
+from activity_io import iter_activities
+from clients import CLIENTS
+
+# Maximum operations in one Firestore WriteBatch
+FIRESTORE_BATCH_LIMIT = 500
+
 # Initialize Firebase
 def initialize_firebase():
     try:
@@ -20,10 +25,12 @@ def initialize_firebase():
             if field not in service_account:
                 raise ValueError(f"serviceAccountKey.json is missing required field: {field}")
         
-        # Initialize Firebase
-        cred = credentials.Certificate("serviceAccountKey.json")
-        firebase_admin.initialize_app(cred)
-        return firestore.client()
+        # Initialize Firebase through the shared client registry
+        database = CLIENTS.firestore("serviceAccountKey.json")
+        db = database.get()
+        if db is None:
+            raise RuntimeError(database.error)
+        return db
         
     except Exception as e:
         print(f"Firebase initialization failed: {str(e)}")
@@ -37,21 +44,27 @@ def upload_data(db, collection_name, json_file):
         test_doc.set({'test': True})
         test_doc.delete()
         
-        # Read JSON file
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Batch write
-        batch = db.batch()
+        # Stream the file and write in batches of at most 500 operations
         collection_ref = db.collection(collection_name)
+        count = 0
+        batch = db.batch()
+        pending = 0
         
-        for item in data:
+        for item in iter_activities(json_file):
             # Use activity name as document ID
             doc_ref = collection_ref.document(item['name'])
             batch.set(doc_ref, item)
+            pending += 1
+            if pending == FIRESTORE_BATCH_LIMIT:
+                batch.commit()
+                count += pending
+                batch = db.batch()
+                pending = 0
         
-        batch.commit()
-        print(f"Successfully uploaded {len(data)} records to {collection_name} collection")
+        if pending:
+            batch.commit()
+            count += pending
+        print(f"Successfully uploaded {count} records to {collection_name} collection")
         
     except Exception as e:
         print(f"Upload failed: {str(e)}")
@@ -63,6 +76,8 @@ def upload_data(db, collection_name, json_file):
             print("4. Service account may be expired or revoked")
 
 if __name__ == "__main__":
+    # Connection and import messages of the shared modules go through logging
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     try:
         db = initialize_firebase()
         upload_data(db, "Activities", "sample.json")
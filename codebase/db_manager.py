@@ -1,39 +1,54 @@
-import json
-import firebase_admin
-from firebase_admin import credentials, firestore
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Callable
+import logging
 import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from datetime import datetime
 from configparser import RawConfigParser
 from pathlib import Path
 
+from clients import CLIENTS, load_firebase_config
+from storage import FirestoreActivityStore
+from activity_io import iter_activities, write_activities, read_checkpoint, write_checkpoint
+
+logger = logging.getLogger(__name__)
+
+# Firestore 单个 WriteBatch 最多 500 个操作
+FIRESTORE_BATCH_LIMIT = 500
+
 class DatabaseManager:
-    def __init__(self, config_path: str = "config.ini"):
+    def __init__(self, config_path: str = "config.ini", store=None):
         """
         初始化数据库管理器
         :param config_path: 配置文件路径
+        :param store: 活动存储（见 storage.py），默认使用 Firestore；
+                      传入 SQLiteActivityStore 时无需连接 Firebase，可离线使用
         """
         self.config_path = config_path
-        self.db = None
-        self._initialize_firebase()
+        self.database = None
+        if store is None:
+            self._initialize_firebase()
+            store = FirestoreActivityStore(lambda: self.db, database=self.database)
+        self.store = store
+
+    @property
+    def db(self):
+        """
+        Firestore 客户端，与机器人共用同一个连接；使用本地存储时为 None
+        """
+        return self.database.get() if self.database is not None else None
 
     def _initialize_firebase(self):
         """
         初始化 Firebase 连接
         """
-        try:
-            if not firebase_admin._apps:
-                config = self._load_config()
-                cred = credentials.Certificate(config['firebase_config'])
-                firebase_admin.initialize_app(cred)
-                print("Firebase initialized successfully")
-            
-            self.db = firestore.client()
-            print("Successfully connected to Firestore")
-            
-        except Exception as e:
-            print(f"Firebase initialization failed: {str(e)}")
-            raise
+        # 客户端由进程内的 CLIENTS 统一管理，已连接时直接复用
+        self.database = CLIENTS.firestore(self._load_config()['firebase_config'])
+        if self.database.get() is None:
+            raise RuntimeError(f"Firebase initialization failed: {self.database.error}")
 
     def _load_config(self) -> Dict[str, Any]:
         """
@@ -47,18 +62,7 @@ class DatabaseManager:
             config_parser.read(self.config_path)
         
         # 从环境变量或配置文件获取 Firebase 配置
-        firebase_config = {
-            "type": "service_account",
-            "project_id": os.getenv('FIREBASE_PROJECT_ID') or config_parser.get('FIREBASE', 'PROJECT_ID', fallback=None),
-            "private_key_id": os.getenv('FIREBASE_PRIVATE_KEY_ID') or config_parser.get('FIREBASE', 'PRIVATE_KEY_ID', fallback=None),
-            "private_key": (os.getenv('FIREBASE_PRIVATE_KEY') or config_parser.get('FIREBASE', 'PRIVATE_KEY', fallback=None)).replace('\\n', '\n'),
-            "client_email": os.getenv('FIREBASE_CLIENT_EMAIL') or config_parser.get('FIREBASE', 'CLIENT_EMAIL', fallback=None),
-            "client_id": os.getenv('FIREBASE_CLIENT_ID') or config_parser.get('FIREBASE', 'CLIENT_ID', fallback=None),
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
-            "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-            "client_x509_cert_url": os.getenv('FIREBASE_CLIENT_CERT_URL') or config_parser.get('FIREBASE', 'CLIENT_CERT_URL', fallback=None)
-        }
+        firebase_config = load_firebase_config(config_parser)
         
         # 验证必要的配置是否存在
         required_fields = ['project_id', 'private_key', 'client_email']
@@ -80,8 +84,7 @@ class DatabaseManager:
             cleaned_activity = self._clean_activity_data(activity)
             
             # 使用活动名称作为文档ID
-            doc_ref = self.db.collection('Activities').document(cleaned_activity['name'])
-            doc_ref.set(cleaned_activity)
+            self.store.put(cleaned_activity)
             return True
         except Exception as e:
             print(f"Error creating activity: {str(e)}")
@@ -94,11 +97,7 @@ class DatabaseManager:
         :return: 活动数据或None
         """
         try:
-            doc_ref = self.db.collection('Activities').document(activity_name)
-            doc = doc_ref.get()
-            if doc.exists:
-                return doc.to_dict()
-            return None
+            return self.store.get(activity_name)
         except Exception as e:
             print(f"Error reading activity: {str(e)}")
             return None
@@ -114,8 +113,7 @@ class DatabaseManager:
             # 数据清洗
             cleaned_updates = self._clean_activity_data(updates)
             
-            doc_ref = self.db.collection('Activities').document(activity_name)
-            doc_ref.update(cleaned_updates)
+            self.store.update(activity_name, cleaned_updates)
             return True
         except Exception as e:
             print(f"Error updating activity: {str(e)}")
@@ -128,45 +126,245 @@ class DatabaseManager:
         :return: 是否成功
         """
         try:
-            doc_ref = self.db.collection('Activities').document(activity_name)
-            doc_ref.delete()
+            self.store.delete(activity_name)
             return True
         except Exception as e:
             print(f"Error deleting activity: {str(e)}")
             return False
 
-    def merge_activities(self, activities: List[Dict[str, Any]], merge_strategy: str = 'update') -> Dict[str, int]:
+    def merge_activities(self,
+                         activities: Iterable[Dict[str, Any]],
+                         merge_strategy: str = 'update',
+                         batch_size: int = FIRESTORE_BATCH_LIMIT,
+                         commit_workers: int = 4,
+                         max_retries: int = 3,
+                         on_progress: Optional[Callable[[int], None]] = None) -> Dict[str, int]:
         """
-        合并活动数据
-        :param activities: 活动列表
+        合并活动数据（批量读取、分批写入、并行提交）
+        活动按批次从迭代器中读取，内存占用与数据总量无关
+        :param activities: 活动列表或迭代器
         :param merge_strategy: 合并策略 ('update' 或 'skip')
+        :param batch_size: 每个 WriteBatch 的最大操作数（不超过 500）
+        :param commit_workers: 并行提交的线程数
+        :param max_retries: 批次提交失败时的最大重试次数
+        :param on_progress: 回调，参数为已完整处理的前缀记录数（用于断点续传）
         :return: 统计信息
         """
         stats = {'created': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+        batch_size = max(1, min(batch_size, FIRESTORE_BATCH_LIMIT))
+        commit_workers = max(1, commit_workers)
         
-        for activity in activities:
-            try:
-                # 数据清洗
-                cleaned_activity = self._clean_activity_data(activity)
+        if not isinstance(self.store, FirestoreActivityStore):
+            return self._merge_into_store(activities, merge_strategy, batch_size, stats, on_progress)
+        
+        in_flight = deque()  # (future, 记录数, 文档ID集合)，按提交顺序
+        records_done = 0
+        
+        def complete_oldest():
+            nonlocal records_done
+            future, record_count, _ = in_flight.popleft()
+            for key, value in future.result().items():
+                stats[key] += value
+            records_done += record_count
+            if on_progress:
+                on_progress(records_done)
+        
+        with ThreadPoolExecutor(max_workers=commit_workers) as executor:
+            iterator = iter(activities)
+            while True:
+                window = list(islice(iterator, batch_size))
+                if not window:
+                    break
                 
-                doc_ref = self.db.collection('Activities').document(cleaned_activity['name'])
-                doc = doc_ref.get()
+                cleaned_activities = self._clean_window(window, stats)
                 
-                if doc.exists and merge_strategy == 'skip':
-                    stats['skipped'] += 1
-                    continue
+                # 若与尚未提交完成的批次有相同文档，先等待它们完成，保证写入顺序
+                ids = {doc_ref.id for doc_ref, _ in cleaned_activities}
+                while in_flight and any(ids & pending_ids for _, _, pending_ids in in_flight):
+                    complete_oldest()
                 
-                if doc.exists:
-                    doc_ref.update(cleaned_activity)
-                    stats['updated'] += 1
-                else:
-                    doc_ref.set(cleaned_activity)
-                    stats['created'] += 1
-                    
+                operations = self._plan_operations(cleaned_activities, merge_strategy, stats, max_retries)
+                future = executor.submit(self._commit_operations, operations, max_retries)
+                in_flight.append((future, len(window), ids))
+                
+                while len(in_flight) >= commit_workers:
+                    complete_oldest()
+            
+            while in_flight:
+                complete_oldest()
+        
+        return stats
+
+    def _merge_into_store(self,
+                          activities: Iterable[Dict[str, Any]],
+                          merge_strategy: str,
+                          batch_size: int,
+                          stats: Dict[str, int],
+                          on_progress: Optional[Callable[[int], None]]) -> Dict[str, int]:
+        """
+        合并活动到本地存储，每批一个事务，无需并行提交
+        :param activities: 活动列表或迭代器
+        :param merge_strategy: 合并策略
+        :param batch_size: 每批记录数
+        :param stats: 统计信息
+        :param on_progress: 回调，参数为已处理的记录数
+        :return: 统计信息
+        """
+        iterator = iter(activities)
+        records_done = 0
+        while True:
+            window = list(islice(iterator, batch_size))
+            if not window:
+                break
+            
+            cleaned_activities = []
+            for activity in window:
+                try:
+                    cleaned_activities.append(self._clean_activity_data(activity))
+                except Exception as e:
+                    name = activity.get('name', 'unknown') if isinstance(activity, dict) else 'unknown'
+                    logger.error("Error merging activity %s: %s", name, e)
+                    stats['failed'] += 1
+            
+            for key, value in self.store.merge(cleaned_activities, merge_strategy, len(window)).items():
+                stats[key] += value
+            records_done += len(window)
+            if on_progress:
+                on_progress(records_done)
+        
+        return stats
+
+    def _clean_window(self, window: List[Dict[str, Any]], stats: Dict[str, int]) -> List[tuple]:
+        """
+        清洗一批活动数据
+        :param window: 活动列表
+        :param stats: 统计信息，清洗失败计入 failed
+        :return: (文档引用, 清洗后的数据) 列表
+        """
+        collection = self.db.collection('Activities')
+        cleaned_activities = []
+        for activity in window:
+            try:
+                cleaned = self._clean_activity_data(activity)
+                cleaned_activities.append((collection.document(cleaned['name']), cleaned))
             except Exception as e:
-                print(f"Error merging activity {activity.get('name', 'unknown')}: {str(e)}")
+                name = activity.get('name', 'unknown') if isinstance(activity, dict) else 'unknown'
+                logger.error("Error merging activity %s: %s", name, e)
                 stats['failed'] += 1
+        return cleaned_activities
+
+    def _plan_operations(self,
+                         cleaned_activities: List[tuple],
+                         merge_strategy: str,
+                         stats: Dict[str, int],
+                         max_retries: int = 3) -> List[Dict[str, Any]]:
+        """
+        批量检查文档是否存在并生成写操作
+        :param cleaned_activities: (文档引用, 清洗后的数据) 列表
+        :param merge_strategy: 合并策略
+        :param stats: 统计信息，跳过的记录计入 skipped，无法检查时整批计入 failed
+        :param max_retries: 检查失败时的最大重试次数
+        :return: 写操作列表
+        """
+        existing = self._existing_ids([doc_ref for doc_ref, _ in cleaned_activities], max_retries)
+        if existing is None:
+            # 不知道文档是否存在时不写入，否则会覆盖已有文档并忽略 skip 策略
+            stats['failed'] += len(cleaned_activities)
+            return []
+        
+        # 同一批中重复的名称合并为一次写入，
+        # 统计结果与逐条写入一致（首次创建，之后的重复计为更新）
+        operations = {}
+        for doc_ref, cleaned in cleaned_activities:
+            operation = operations.get(doc_ref.id)
+            exists = doc_ref.id in existing or operation is not None
+            
+            if exists and merge_strategy == 'skip':
+                stats['skipped'] += 1
+                continue
+            
+            if operation is not None:
+                operation['data'].update(cleaned)
+                operation['repeats'] += 1
+            else:
+                operations[doc_ref.id] = {
+                    'type': 'update' if exists else 'set',
+                    'ref': doc_ref,
+                    'data': cleaned,
+                    'repeats': 0
+                }
+        
+        return list(operations.values())
+
+    def _existing_ids(self, doc_refs: List[Any], max_retries: int) -> Optional[set]:
+        """
+        批量检查文档是否存在（代替逐条 get()），失败时与提交相同的退避重试
+        :param doc_refs: 文档引用列表
+        :param max_retries: 最大重试次数
+        :return: 已存在的文档ID集合，最终失败时为 None
+        """
+        if not doc_refs:
+            return set()
+        for attempt in range(max_retries + 1):
+            try:
+                return {snapshot.id for snapshot in self.db.get_all(doc_refs) if snapshot.exists}
+            except Exception as e:
+                logger.error("Error checking %d existing activities (attempt %d): %s", len(doc_refs), attempt + 1, e)
+                if attempt < max_retries:
+                    self._backoff(attempt)
+        return None
+
+    @staticmethod
+    def _backoff(attempt: int):
+        # 指数退避加随机抖动
+        time.sleep(min(0.5 * 2 ** attempt, 8) * (0.5 + random.random()))
+
+    def _commit_operations(self, operations: List[Dict[str, Any]], max_retries: int) -> Dict[str, int]:
+        """
+        提交一批写操作，失败时退避重试，最终失败则逐条写入以隔离出错的文档
+        :param operations: 写操作列表
+        :param max_retries: 最大重试次数
+        :return: 统计信息
+        """
+        stats = {'created': 0, 'updated': 0, 'failed': 0}
+        
+        def record(operation, succeeded):
+            if not succeeded:
+                stats['failed'] += 1 + operation['repeats']
+                return
+            stats['updated' if operation['type'] == 'update' else 'created'] += 1
+            stats['updated'] += operation['repeats']
+        
+        for attempt in range(max_retries + 1):
+            try:
+                batch = self.db.batch()
+                for operation in operations:
+                    if operation['type'] == 'update':
+                        batch.update(operation['ref'], operation['data'])
+                    else:
+                        batch.set(operation['ref'], operation['data'])
+                batch.commit()
                 
+                for operation in operations:
+                    record(operation, True)
+                return stats
+            except Exception as e:
+                logger.error("Error committing batch of %d activities (attempt %d): %s", len(operations), attempt + 1, e)
+                if attempt < max_retries:
+                    self._backoff(attempt)
+        
+        # WriteBatch 是原子的，一条坏数据会导致整批失败，这里逐条重试
+        for operation in operations:
+            try:
+                if operation['type'] == 'update':
+                    operation['ref'].update(operation['data'])
+                else:
+                    operation['ref'].set(operation['data'])
+                record(operation, True)
+            except Exception as e:
+                logger.error("Error merging activity %s: %s", operation['ref'].id, e)
+                record(operation, False)
+        
         return stats
 
     def _clean_activity_data(self, activity: Dict[str, Any]) -> Dict[str, Any]:
@@ -220,21 +418,15 @@ class DatabaseManager:
         :return: 匹配的活动列表
         """
         try:
-            query = self.db.collection('Activities')
-            
-            # 添加类别过滤
-            if categories:
-                query = query.where(filter=firestore.FieldFilter('category', 'in', categories))
-            
-            # 获取结果
-            results = query.limit(limit).stream()
-            activities = [doc.to_dict() for doc in results]
+            # 从本地副本或 SQLite 读取，不再每次请求都查询 Firestore
+            activities = self.store.in_categories(categories, limit)
             
             # 如果提供了兴趣关键词，进行过滤
             if interests:
+                interest_set = {interest.lower() for interest in interests}
                 activities = [
                     activity for activity in activities
-                    if any(keyword.lower() in [interest.lower() for interest in interests]
+                    if any(keyword.lower() in interest_set
                           for keyword in activity.get('keywords', []))
                 ]
             
@@ -246,43 +438,52 @@ class DatabaseManager:
 
     def export_activities(self, output_file: str) -> bool:
         """
-        导出所有活动数据
-        :param output_file: 输出文件路径
+        导出所有活动数据，边读取边写入，内存占用恒定
+        :param output_file: 输出文件路径（.json 或 .ndjson/.jsonl，可加 .gz 压缩）
         :return: 是否成功
         """
         try:
-            activities = []
-            docs = self.db.collection('Activities').stream()
-            
-            for doc in docs:
-                activities.append(doc.to_dict())
-            
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(activities, f, ensure_ascii=False, indent=2)
-            
+            count = write_activities(output_file, self.store.iter_all())
+            print(f"Exported {count} activities to {output_file}")
             return True
         except Exception as e:
             print(f"Error exporting activities: {str(e)}")
             return False
 
-    def import_activities(self, input_file: str, merge_strategy: str = 'update') -> Dict[str, int]:
+    def import_activities(self,
+                          input_file: str,
+                          merge_strategy: str = 'update',
+                          checkpoint_file: Optional[str] = None) -> Dict[str, int]:
         """
-        导入活动数据
-        :param input_file: 输入文件路径
+        导入活动数据，流式读取文件并分批写入
+        :param input_file: 输入文件路径（.json 或 .ndjson/.jsonl，可加 .gz 压缩）
         :param merge_strategy: 合并策略
-        :return: 统计信息
+        :param checkpoint_file: 断点文件路径；导入中断后再次调用会从断点继续
+        :return: 统计信息（仅包含本次运行处理的记录）
         """
         try:
-            with open(input_file, 'r', encoding='utf-8') as f:
-                activities = json.load(f)
+            records_done = read_checkpoint(checkpoint_file, input_file)
+            if records_done:
+                print(f"Resuming import of {input_file} after {records_done} records")
+            
+            activities = islice(iter_activities(input_file), records_done, None)
+            stats = self.merge_activities(
+                activities,
+                merge_strategy,
+                on_progress=lambda done: write_checkpoint(checkpoint_file, input_file, records_done + done)
+            )
             
-            return self.merge_activities(activities, merge_strategy)
+            # 导入完成，删除断点文件
+            if checkpoint_file and os.path.exists(checkpoint_file):
+                os.remove(checkpoint_file)
+            return stats
         except Exception as e:
             print(f"Error importing activities: {str(e)}")
             return {'created': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
 
 if __name__ == "__main__":
-    # 测试代码
+    # 测试代码，日志直接输出到终端
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     try:
         # 初始化数据库管理器
         db_manager = DatabaseManager()
@@ -0,0 +1,185 @@
+import re
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def activity_text(activity: Dict[str, Any]) -> str:
+    """
+    Build the text an activity is embedded from
+    :param activity: Activity data
+    :return: Name, description, keywords and category joined together
+    """
+    keywords = activity.get('keywords', [])
+    if isinstance(keywords, list):
+        keywords = ' '.join(str(keyword) for keyword in keywords)
+    parts = [activity.get('name'), activity.get('description'), keywords, activity.get('category')]
+    return ' '.join(part for part in parts if isinstance(part, str))
+
+
+class HashingEmbedder:
+    """
+    Offline embedding backend based on hashed character n-grams.
+
+    Character n-grams make "game", "games" and "gaming" land close together.
+    Optional concept lists map different surface forms to one shared feature,
+    e.g. "vr" and "virtual reality", which n-grams alone cannot relate.
+    """
+
+    def __init__(self,
+                 dim: int = 512,
+                 ngram_sizes: Tuple[int, ...] = (3, 4),
+                 concepts: Optional[Dict[str, List[str]]] = None,
+                 concept_weight: float = 0.5):
+        """
+        Initialize the embedder
+        :param dim: Embedding dimension
+        :param ngram_sizes: Character n-gram sizes to hash
+        :param concepts: Optional mapping of concept name to phrases expressing it
+        :param concept_weight: Share of the squared norm given to concept features (0-1)
+        """
+        self.dim = dim
+        self.ngram_sizes = ngram_sizes
+        self.concept_weight = concept_weight
+        self._concepts = []
+        for name, phrases in (concepts or {}).items():
+            pattern = re.compile(r'\b(?:' + '|'.join(re.escape(p) for p in phrases) + r')')
+            self._concepts.append((self._bucket('concept:' + name), pattern))
+
+    def _bucket(self, feature: str) -> Tuple[int, float]:
+        # crc32 is stable across processes, unlike hash()
+        h = zlib.crc32(feature.encode('utf-8'))
+        return h % self.dim, (1.0 if (h >> 31) & 1 else -1.0)
+
+    def embed(self, text: str) -> np.ndarray:
+        """
+        Embed one text
+        :param text: Input text
+        :return: L2-normalized float32 vector
+        """
+        lowered = text.lower()
+
+        ngrams = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r'[a-z0-9]+', lowered):
+            padded = f"<{word}>"
+            for size in self.ngram_sizes:
+                for i in range(max(1, len(padded) - size + 1)):
+                    index, sign = self._bucket(padded[i:i + size])
+                    ngrams[index] += sign
+
+        concepts = np.zeros(self.dim, dtype=np.float32)
+        for (index, sign), pattern in self._concepts:
+            if pattern.search(lowered):
+                concepts[index] += sign
+
+        # Normalize each part separately so long descriptions do not drown
+        # out the concept features, then mix them by concept_weight
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for part, weight in ((ngrams, 1.0 - self.concept_weight), (concepts, self.concept_weight)):
+            norm = np.linalg.norm(part)
+            if norm > 0:
+                vector += part * (np.sqrt(weight) / norm)
+
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed several texts
+        :param texts: Input texts
+        :return: float32 matrix with one normalized row per text
+        """
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            matrix[row] = self.embed(text)
+        return matrix
+
+
+class EmbeddingStore:
+    """
+    Normalized float32 embedding matrix with cosine top-k search.
+
+    Rows are kept packed: removing a document moves the last row into its slot.
+    """
+
+    def __init__(self, embedder):
+        """
+        Initialize the store
+        :param embedder: Backend with embed(text) and embed_batch(texts) methods
+        """
+        self.embedder = embedder
+        self._matrix = np.zeros((64, embedder.dim), dtype=np.float32)
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, doc_id: str, activity: Dict[str, Any]):
+        """
+        Add or replace the embedding of an activity
+        :param doc_id: Document id
+        :param activity: Activity data
+        """
+        vector = self.embedder.embed(activity_text(activity))
+        with self._lock:
+            row = self._rows.get(doc_id)
+            if row is None:
+                row = len(self._ids)
+                if row == len(self._matrix):
+                    grown = np.zeros((len(self._matrix) * 2, self.embedder.dim), dtype=np.float32)
+                    grown[:row] = self._matrix
+                    self._matrix = grown
+                self._ids.append(doc_id)
+                self._rows[doc_id] = row
+            self._matrix[row] = vector
+
+    def remove(self, doc_id: str):
+        """
+        Remove the embedding of an activity
+        :param doc_id: Document id
+        """
+        with self._lock:
+            row = self._rows.pop(doc_id, None)
+            if row is None:
+                return
+            last = len(self._ids) - 1
+            if row != last:
+                moved_id = self._ids[last]
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = moved_id
+                self._rows[moved_id] = row
+            self._ids.pop()
+
+    def search(self, queries: List[str], limit: int = 5, min_score: float = 0.0) -> List[List[Tuple[float, str]]]:
+        """
+        Find the most similar documents for a batch of queries
+        :param queries: Query texts
+        :param limit: Maximum results per query
+        :param min_score: Minimum cosine similarity to include
+        :return: For each query, a list of (similarity, document id), best first
+        """
+        query_matrix = self.embedder.embed_batch(queries)
+
+        with self._lock:
+            count = len(self._ids)
+            if count == 0 or limit <= 0:
+                return [[] for _ in queries]
+            # Rows are normalized, so one matmul gives every cosine similarity
+            scores = query_matrix @ self._matrix[:count].T
+            ids = list(self._ids)
+
+        k = min(limit, count)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+        results = []
+        for row, candidates in enumerate(top):
+            ranked = sorted(candidates, key=lambda col: -scores[row, col])
+            results.append([(float(scores[row, col]), ids[col])
+                            for col in ranked if scores[row, col] >= min_score])
+        return results
+
+    def __len__(self) -> int:
+        return len(self._ids)
@@ -0,0 +1,170 @@
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Connect time of the last connection opened by the current thread
+_connect_timing = threading.local()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _connect_timing.seconds = time.perf_counter() - start
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        # Includes DNS lookup, TCP handshake and TLS handshake
+        start = time.perf_counter()
+        super().connect()
+        _connect_timing.seconds = time.perf_counter() - start
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter whose connections record how long connect() took
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool
+        }
+
+
+class PooledHTTPClient:
+    """
+    Connection-pooled HTTP client with per-request timing.
+
+    Every response returned by ``post`` carries a ``timing`` dict with the
+    connect time (0 when a pooled connection was reused), time to first
+    byte and total time, all in seconds.
+    """
+
+    def __init__(self,
+                 pool_size: int = 10,
+                 connect_timeout: float = 5.0,
+                 read_timeout: float = 60.0,
+                 keep_alive: bool = True):
+        """
+        Initialize the HTTP client
+        :param pool_size: Maximum number of connections kept per host
+        :param connect_timeout: Seconds to wait for the connection to be established
+        :param read_timeout: Seconds to wait between bytes from the server
+        :param keep_alive: Whether to reuse connections between requests
+        """
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+
+        self.session = requests.Session()
+        adapter = _TimedHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'new_connections': 0,
+            'connect_seconds': 0.0,
+            'ttfb_seconds': 0.0,
+            'total_seconds': 0.0
+        }
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request through the pooled session
+        :param method: HTTP method
+        :param url: Request URL
+        :param kwargs: Extra arguments passed to requests
+        :return: Response with a ``timing`` attribute
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        stream = kwargs.pop('stream', False)
+
+        _connect_timing.seconds = 0.0
+        start = time.perf_counter()
+
+        # With stream=True the call returns as soon as the headers are in
+        response = self.session.request(method, url, stream=True, **kwargs)
+        ttfb = time.perf_counter() - start
+        connect = _connect_timing.seconds
+
+        if not stream:
+            # Read the body now so the connection goes back to the pool
+            response.content
+        total = time.perf_counter() - start
+
+        response.timing = {
+            'connect': connect,
+            'ttfb': ttfb,
+            'total': total,
+            'reused_connection': connect == 0.0
+        }
+
+        with self._lock:
+            self._stats['requests'] += 1
+            if connect:
+                self._stats['new_connections'] += 1
+            self._stats['connect_seconds'] += connect
+            self._stats['ttfb_seconds'] += ttfb
+            self._stats['total_seconds'] += total
+
+        return response
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """
+        Send a POST request through the pooled session
+        :param url: Request URL
+        :param kwargs: Extra arguments passed to requests
+        :return: Response with a ``timing`` attribute
+        """
+        return self.request('POST', url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cumulative request statistics
+        :return: Request count, new connection count and summed timings
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self):
+        """
+        Close all pooled connections
+        """
+        self.session.close()
+
+
+_shared_client: Optional[PooledHTTPClient] = None
+_shared_lock = threading.Lock()
+
+
+def get_http_client(**settings) -> PooledHTTPClient:
+    """
+    Get the process-wide HTTP client, creating it on first use
+    :param settings: PooledHTTPClient arguments, only used on first call
+    :return: Shared PooledHTTPClient instance
+    """
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = PooledHTTPClient(**settings)
+        return _shared_client
@@ -0,0 +1,158 @@
+import re
+from typing import Any, Dict, Iterable, List, Set
+
+# Phrases that mark a message as a request for activity recommendations
+RECOMMENDATION_KEYWORDS = [
+    'recommend', 'suggest', 'find', 'look for', 'search for',
+    'what activities', 'what events', 'what to do', 'what can i do',
+    'interested in', 'looking for', 'want to join', 'want to participate'
+]
+
+# Basic keyword matching for categories
+CATEGORY_KEYWORDS = {
+    'gaming': ['game', 'gaming', 'play', 'player', 'gamer'],
+    'vr': ['vr', 'virtual reality', 'virtual', 'metaverse'],
+    'social': ['social', 'community', 'group', 'team', 'together'],
+    'learning': ['learn', 'study', 'education', 'course', 'class'],
+    'fitness': ['fitness', 'exercise', 'workout', 'sport', 'health'],
+    'art': ['art', 'creative', 'design', 'draw', 'paint'],
+    'music': ['music', 'song', 'concert', 'band', 'dance']
+}
+
+# "i <verb> <interest>" phrasings, matched up to the next punctuation mark
+INTEREST_VERBS = ['like', 'love', 'enjoy', 'want to', 'am interested in']
+
+
+def trie_regex(words: Iterable[str]) -> str:
+    """
+    Build a regex matching any of the words, factored by common prefixes.
+
+    At any position it matches the longest word starting there, and the
+    regex engine only follows branches whose next character fits.
+    :param words: Literal words
+    :return: Regex source
+    """
+    trie: Dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node: Dict[str, Any]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            # A word ends here; longer words are tried first
+            return '(?:' + body + ')?'
+        return body
+
+    return build(trie)
+
+
+class IntentMatcher:
+    """
+    Precompiled extractor for the recommendation flag, categories and
+    interests of a message.
+
+    All keywords are compiled into one prefix-factored regex and all
+    interest patterns into another, so the message is scanned once by
+    each instead of once per keyword and once per pattern. Results are
+    identical to substring tests per keyword and one ``re.findall`` per
+    interest pattern.
+    """
+
+    def __init__(self,
+                 recommendation_keywords: List[str] = RECOMMENDATION_KEYWORDS,
+                 category_keywords: Dict[str, List[str]] = CATEGORY_KEYWORDS,
+                 interest_verbs: List[str] = INTEREST_VERBS):
+        """
+        Compile the matcher
+        :param recommendation_keywords: Phrases marking a recommendation request
+        :param category_keywords: Mapping of category to keywords
+        :param interest_verbs: Verbs of the "i <verb> <interest>" patterns
+        """
+        self.category_keywords = {category: list(keywords) for category, keywords in category_keywords.items()}
+        self.recommendation_keywords = list(recommendation_keywords)
+        self.interest_verbs = list(interest_verbs)
+
+        phrases = set(self.recommendation_keywords)
+        for keywords in self.category_keywords.values():
+            phrases.update(keywords)
+
+        # The scan reports only the longest phrase at each position; every
+        # shorter phrase that is a prefix of it occurs there too
+        self._phrase_info = {}
+        for phrase in phrases:
+            prefixes = [other for other in phrases if phrase.startswith(other)]
+            self._phrase_info[phrase] = (
+                any(p in self.recommendation_keywords for p in prefixes),
+                {category for category, keywords in self.category_keywords.items()
+                 if any(p in keywords for p in prefixes)}
+            )
+
+        # Zero-width lookahead, so phrases overlapping an earlier match
+        # (e.g. "exercise" in "gamexercise") are still found
+        self._phrase_pattern = re.compile('(?=(' + trie_regex(phrases) + '))')
+        self._recommendation_pattern = re.compile(trie_regex(self.recommendation_keywords))
+
+        verbs = '|'.join(re.escape(verb) for verb in self.interest_verbs)
+        self._interest_pattern = re.compile(r'i (' + verbs + r') (.*?)[.,!?]')
+        # Marks an interest that may hide another pattern's match inside it
+        self._nested_interest = re.compile(r'i (?:' + verbs + r') ')
+        self._verb_patterns = [re.compile(r'i ' + re.escape(verb) + r' (.*?)[.,!?]')
+                               for verb in self.interest_verbs]
+        # If an "i <verb> " prefix itself contained "i ", a match could start
+        # inside another match's prefix and the combined scan would not be exact
+        self._verbs_overlap = any('i ' in f"i {verb} "[1:] for verb in self.interest_verbs)
+
+    def is_recommendation(self, message: str) -> bool:
+        """
+        Check if the message is requesting activity recommendations
+        :param message: User input message
+        :return: True if any recommendation keyword occurs in the message
+        """
+        return self._recommendation_pattern.search(message.lower()) is not None
+
+    def _categories_and_intent(self, message_lower: str):
+        is_recommendation = False
+        categories: Set[str] = set()
+        for phrase in set(self._phrase_pattern.findall(message_lower)):
+            phrase_recommendation, phrase_categories = self._phrase_info[phrase]
+            is_recommendation = is_recommendation or phrase_recommendation
+            categories |= phrase_categories
+
+        return is_recommendation, [category for category in self.category_keywords if category in categories]
+
+    def _interests(self, message_lower: str) -> List[str]:
+        matches = self._interest_pattern.findall(message_lower)
+        if self._verbs_overlap or any(self._nested_interest.search(interest) for _, interest in matches):
+            # Patterns overlap here, so run them one by one like re.findall would
+            return [interest for pattern in self._verb_patterns for interest in pattern.findall(message_lower)]
+
+        # Group by pattern, in pattern order
+        by_verb: Dict[str, List[str]] = {verb: [] for verb in self.interest_verbs}
+        for verb, interest in matches:
+            by_verb[verb].append(interest)
+        return [interest for verb in self.interest_verbs for interest in by_verb[verb]]
+
+    def analyze(self, message: str) -> Dict[str, Any]:
+        """
+        Extract intent, categories and interests from a message
+        :param message: User input message
+        :return: Dictionary with is_recommendation, categories, interests and raw_message
+        """
+        message_lower = message.lower()
+        is_recommendation, categories = self._categories_and_intent(message_lower)
+        return {
+            'is_recommendation': is_recommendation,
+            'categories': categories,
+            'interests': self._interests(message_lower),
+            'raw_message': message
+        }
+
+
+# Shared matcher compiled at import
+INTENT_MATCHER = IntentMatcher()
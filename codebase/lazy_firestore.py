@@ -0,0 +1,178 @@
+import logging
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DISABLED = 'disabled'
+PENDING = 'pending'
+CONNECTING = 'connecting'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class LazyFirestore:
+    """
+    Firestore client created off the startup path.
+
+    Importing firebase_admin and creating the client takes the better
+    part of a second, so neither happens until ``warm_up`` starts them on
+    a background thread or the first caller of ``get`` needs the client.
+    Concurrent callers share the one connection attempt.
+    """
+
+    def __init__(self,
+                 credential_config: Dict[str, Any],
+                 on_ready: Optional[Callable[[Any], None]] = None,
+                 enabled: bool = True):
+        """
+        Initialize without connecting
+        :param credential_config: Service account fields for firebase_admin.credentials.Certificate
+        :param on_ready: Called with the client once connected and before it is handed out, on the connecting thread
+        :param enabled: False to never connect, e.g. when the bot runs without a database
+        """
+        self.credential_config = credential_config
+        self.on_ready = on_ready
+        self.status = PENDING if enabled else DISABLED
+        self.error: Optional[str] = None
+        self.connect_seconds: Optional[float] = None
+        self.reconnects = 0
+        self._client = None
+        self._then: Optional[Callable[[Any], None]] = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        if not enabled:
+            self._done.set()
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Whether a client is or may become available
+        """
+        return self.status not in (DISABLED, FAILED)
+
+    @property
+    def client(self):
+        """
+        The client if connected, never starts or waits for a connection
+        """
+        return self._client
+
+    def warm_up(self, then: Optional[Callable[[Any], None]] = None):
+        """
+        Start connecting in the background, returns immediately
+        :param then: Called with the client on the background thread once it is available to callers,
+                     for slower preparation that requests need not wait for
+        """
+        self._then = then
+        if self._claim():
+            threading.Thread(target=self._warm_up, args=(then,), name='firestore-warm-up', daemon=True).start()
+
+    def _warm_up(self, then: Optional[Callable[[Any], None]]):
+        self._connect()
+        if then is not None and self._client is not None:
+            try:
+                then(self._client)
+            except Exception as e:
+                logger.error("Firestore warm-up failed: %s", e)
+
+    def get(self, timeout: Optional[float] = None):
+        """
+        Get the client, connecting on this thread if nobody started yet
+        :param timeout: Seconds to wait for a connection attempt already running, None to wait indefinitely
+        :return: Firestore client, or None if disabled, failed or not ready in time
+        """
+        if self._client is not None:
+            return self._client
+        if self._claim():
+            self._connect()
+        else:
+            self._done.wait(timeout)
+        return self._client
+
+    def reconnect(self) -> Any:
+        """
+        Drop the client and connect again in the background with a fresh credential,
+        e.g. after its token refresh failed with invalid_grant
+        :return: The dropped client, or None if there was no connection to replace
+        """
+        with self._lock:
+            if self.status not in (READY, FAILED):
+                return None
+            previous = self._client
+            self._client = None
+            self._done = threading.Event()
+            self.status = PENDING
+            self.error = None
+            self.reconnects += 1
+        # firebase_admin caches one client per app, a new app gets a new client and credential
+        self._delete_app()
+        self.warm_up(self._then)
+        return previous
+
+    def close(self):
+        """
+        Drop the client for good; callers of get receive None from now on
+        """
+        with self._lock:
+            previous = self._client
+            self._client = None
+            self.status = DISABLED
+            self._done.set()
+        if previous is not None:
+            previous.close()
+        self._delete_app()
+
+    def _delete_app(self):
+        # Nothing to delete if firebase_admin was never imported
+        firebase_admin = sys.modules.get('firebase_admin')
+        if firebase_admin is not None and firebase_admin._apps:
+            firebase_admin.delete_app(firebase_admin.get_app())
+
+    def _claim(self) -> bool:
+        with self._lock:
+            if self.status != PENDING:
+                return False
+            self.status = CONNECTING
+            return True
+
+    def _connect(self):
+        start = time.perf_counter()
+        try:
+            # Imported here, firebase_admin and gRPC dominate the import time of the bot
+            import firebase_admin
+            from firebase_admin import credentials, firestore
+
+            # Check if Firebase app is already initialized
+            if not firebase_admin._apps:
+                firebase_admin.initialize_app(credentials.Certificate(self.credential_config))
+                logger.info("Firebase initialized successfully")
+            client = firestore.client()
+            logger.info("Successfully connected to Firestore")
+
+            if self.on_ready is not None:
+                self.on_ready(client)
+            with self._lock:
+                # Unless closed meanwhile
+                if self.status == CONNECTING:
+                    self._client = client
+                    self.status = READY
+        except Exception as e:
+            logger.error("Firebase initialization failed, continuing without database support: %s", e)
+            with self._lock:
+                self.error = str(e)
+                if self.status == CONNECTING:
+                    self.status = FAILED
+        finally:
+            self.connect_seconds = time.perf_counter() - start
+            self._done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the connection state
+        :return: Status, connection time in seconds, the last error and the number of reconnects
+        """
+        return {'status': self.status, 'connect_seconds': self.connect_seconds, 'error': self.error,
+                'reconnects': self.reconnects}
@@ -0,0 +1,203 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+# Attributes every LogRecord has; anything else was passed in extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+def _truncate(value: str, limit: int) -> str:
+    if limit and len(value) > limit:
+        return f"{value[:limit]}...[{len(value) - limit} more chars]"
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as compact single-line JSON.
+
+    Long messages, tracebacks and string fields passed in ``extra`` are
+    truncated so one huge GPT reply or traceback cannot bloat the log.
+    """
+
+    def __init__(self, max_field_length: int = 1000, max_traceback_length: int = 4000):
+        """
+        Initialize the formatter
+        :param max_field_length: Longest message or extra field kept, 0 for no limit
+        :param max_traceback_length: Longest traceback kept, 0 for no limit
+        """
+        super().__init__()
+        self.max_field_length = max_field_length
+        self.max_traceback_length = max_traceback_length
+
+    def _clip(self, value: Any) -> Any:
+        if isinstance(value, str):
+            return _truncate(value, self.max_field_length)
+        if isinstance(value, dict):
+            return {key: self._clip(item) for key, item in value.items()}
+        return value
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': _truncate(record.getMessage(), self.max_field_length)
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and value is not None:
+                entry[key] = self._clip(value)
+        if record.exc_info:
+            entry['exc'] = _truncate(self.formatException(record.exc_info), self.max_traceback_length)
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class PayloadSampler(logging.Filter):
+    """
+    Keep the ``payload`` extra (user message, GPT reply) on a sample of records only.
+
+    The record itself is always logged, so counts stay exact.
+    """
+
+    def __init__(self, sample_rate: float):
+        """
+        Initialize the filter
+        :param sample_rate: Share of records that keep their payload, 0 to 1
+        """
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, 'payload', None) is not None and random.random() >= self.sample_rate:
+            record.payload = None
+        return True
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Rotating file handler that rolls over at a size limit or after a time interval, whichever comes first
+    """
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int, interval: float):
+        """
+        Initialize the handler
+        :param filename: Log file path
+        :param max_bytes: Size at which the file is rotated, 0 to disable
+        :param backup_count: Rotated files kept
+        :param interval: Seconds after which the file is rotated, 0 to disable
+        """
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.interval = interval
+        self._rollover_at = time.time() + interval
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.interval and time.time() >= self._rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self._rollover_at = time.time() + self.interval
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that leaves formatting to the listener thread and never blocks.
+
+    The standard QueueHandler formats each record before queueing it; here
+    the record is queued as is, so the message is only built if a handler
+    actually writes it. When the queue is full the record is dropped and
+    counted instead of stalling the caller.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+
+
+def configure_logging(level: str = 'INFO',
+                      log_file: str = 'logs/app.log',
+                      console_format: str = '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                      max_bytes: int = 10 * 1024 * 1024,
+                      backup_count: int = 5,
+                      rotate_interval: float = 86400,
+                      max_field_length: int = 1000,
+                      payload_sample_rate: float = 0.1,
+                      queue_size: int = 10000) -> DroppingQueueHandler:
+    """
+    Route all logging through a queue to a JSON file and the console, written by a background thread
+    :param level: Root log level name
+    :param log_file: JSON log file, rotated by size and time
+    :param console_format: Format of console lines
+    :param max_bytes: Size at which the log file is rotated
+    :param backup_count: Rotated log files kept
+    :param rotate_interval: Seconds after which the log file is rotated
+    :param max_field_length: Longest message or payload field written to the file
+    :param payload_sample_rate: Share of records that keep their payload
+    :param queue_size: Records buffered before new ones are dropped
+    :return: The queue handler installed on the root logger
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+
+    file_handler = SizeAndTimeRotatingFileHandler(log_file, max_bytes, backup_count, rotate_interval)
+    file_handler.setFormatter(JsonFormatter(max_field_length))
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(console_format))
+
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(PayloadSampler(payload_sample_rate))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    _queue_handler = queue_handler
+    root.setLevel(getattr(logging, level.upper(), logging.INFO))
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    return queue_handler
+
+
+def dropped_log_records() -> int:
+    """
+    Number of records dropped because the log queue was full
+    """
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def stop_logging():
+    """
+    Write out queued records and stop the listener thread
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# Flush on interpreter exit, whichever way the bot stops
+atexit.register(stop_logging)
@@ -0,0 +1,249 @@
+import bisect
+import logging
+import math
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# A sample: (name suffix, labels, value), e.g. ('_bucket', {'le': '0.5'}, 3)
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class _ShardedValues:
+    """
+    Numbers summed across per-thread shards.
+
+    Each thread only ever updates its own dict, so an increment takes no
+    lock; readers copy every shard and add them up.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[Dict[Any, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, key: Any, amount: float):
+        shard = getattr(self._local, 'values', None)
+        if shard is None:
+            shard = self._local.values = {}
+            with self._lock:
+                self._shards.append(shard)
+        shard[key] = shard.get(key, 0) + amount
+
+    def totals(self) -> Dict[Any, float]:
+        with self._lock:
+            shards = list(self._shards)
+        totals: Dict[Any, float] = {}
+        for shard in shards:
+            # dict.copy is atomic, the owning thread may be adding keys meanwhile
+            for key, value in shard.copy().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+
+class MetricFamily:
+    """
+    All samples of one metric, as rendered in one # HELP / # TYPE block
+    """
+
+    __slots__ = ('name', 'type', 'documentation', 'samples')
+
+    def __init__(self, name: str, metric_type: str, documentation: str, samples: Iterable[Sample] = ()):
+        self.name = name
+        self.type = metric_type
+        self.documentation = documentation
+        self.samples: List[Sample] = list(samples)
+
+    def add(self, value: float, suffix: str = '', **labels):
+        self.samples.append((suffix, {key: str(label) for key, label in labels.items()}, value))
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """
+        Initialize the counter
+        :param name: Metric name, conventionally ending in _total
+        :param documentation: Help text
+        :param labelnames: Names of the labels, values are given to inc()
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = _ShardedValues()
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        """
+        Increase the counter
+        :param labelvalues: One value per label name, in order
+        :param amount: Non-negative increment
+        """
+        self._values.add(labelvalues, amount)
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, 'counter', self.documentation)
+        for labelvalues, value in sorted(self._values.totals().items()):
+            family.add(value, **dict(zip(self.labelnames, labelvalues)))
+        return family
+
+
+class Histogram:
+    """
+    Distribution of observed values with fixed buckets and optional labels
+    """
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        """
+        Initialize the histogram
+        :param name: Metric name, e.g. ending in _seconds
+        :param documentation: Help text
+        :param buckets: Bucket upper bounds in ascending order, +Inf is added
+        :param labelnames: Names of the labels, values are given to observe()
+        """
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._values = _ShardedValues()
+
+    def observe(self, value: float, *labelvalues: str):
+        """
+        Record a value
+        :param value: Observed value
+        :param labelvalues: One value per label name, in order
+        """
+        self._values.add((labelvalues, bisect.bisect_left(self.buckets, value)), 1)
+        self._values.add((labelvalues, 'sum'), value)
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, 'histogram', self.documentation)
+        series: Dict[Tuple, Dict[Any, float]] = {}
+        for (labelvalues, slot), value in self._values.totals().items():
+            series.setdefault(labelvalues, {})[slot] = value
+        for labelvalues, slots in sorted(series.items()):
+            labels = dict(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for index, bound in enumerate(self.buckets):
+                cumulative += slots.get(index, 0)
+                family.add(cumulative, '_bucket', le=_format_value(bound), **labels)
+            cumulative += slots.get(len(self.buckets), 0)
+            family.add(cumulative, '_bucket', le='+Inf', **labels)
+            family.add(slots.get('sum', 0), '_sum', **labels)
+            family.add(cumulative, '_count', **labels)
+        return family
+
+
+class MetricsRegistry:
+    """
+    Set of metrics rendered together in the Prometheus text format.
+
+    Counters and histograms are updated by the code they measure.
+    Collectors are called at scrape time and turn statistics that
+    components already keep (queue depths, cache counters) into metric
+    families, so the hot path pays nothing for them.
+    """
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """
+        Create and register a counter
+        """
+        metric = Counter(name, documentation, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()) -> Histogram:
+        """
+        Create and register a histogram
+        """
+        metric = Histogram(name, documentation, buckets, labelnames)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[MetricFamily]]):
+        """
+        Add a function called on every scrape
+        :param collector: Returns the metric families to include
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> List[MetricFamily]:
+        """
+        Gather all metric families
+        :return: Families of registered metrics, then those of collectors
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        families = [metric.collect() for metric in metrics]
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                # One broken component should not hide all other metrics
+                logger.error("Error collecting metrics: %s", e)
+        return families
+
+    def render(self) -> str:
+        """
+        Render all metrics
+        :return: Prometheus text exposition format
+        """
+        return render_families(self.collect())
+
+
+def _format_value(value: float) -> str:
+    if value is None:
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_families(families: Iterable[MetricFamily]) -> str:
+    """
+    Render metric families in the Prometheus text exposition format
+    :param families: Metric families
+    :return: Exposition text
+    """
+    lines = []
+    for family in families:
+        if not family.samples:
+            continue
+        documentation = family.documentation.replace('\\', '\\\\').replace('\n', '\\n')
+        lines.append(f"# HELP {family.name} {documentation}")
+        lines.append(f"# TYPE {family.name} {family.type}")
+        for suffix, labels, value in family.samples:
+            if labels:
+                label_text = ','.join(f'{key}="{_escape_label(str(label))}"' for key, label in labels.items())
+                lines.append(f"{family.name}{suffix}{{{label_text}}} {_format_value(value)}")
+            else:
+                lines.append(f"{family.name}{suffix} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+# Shared registry of the bot process
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,164 @@
+import heapq
+import math
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Words too common to say anything about an activity
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'i', 'in',
+    'is', 'it', 'me', 'my', 'of', 'on', 'or', 'some', 'that', 'the', 'to',
+    'with', 'you', 'your'
+}
+
+# How much each field contributes to a term's frequency
+FIELD_WEIGHTS = {
+    'name': 2,
+    'keywords': 2,
+    'description': 1
+}
+
+
+def _stem(token: str) -> str:
+    # Fold simple plurals so "games" matches "game"
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase terms without stopwords
+    :param text: Input text
+    :return: List of terms
+    """
+    return [_stem(token) for token in re.findall(r'[a-z0-9]+', text.lower()) if token not in STOPWORDS]
+
+
+def activity_terms(activity: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Get the weighted term frequencies of an activity
+    :param activity: Activity data
+    :return: Dictionary of term to weighted frequency
+    """
+    frequencies: Dict[str, int] = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        value = activity.get(field, '')
+        if isinstance(value, list):
+            value = ' '.join(str(item) for item in value)
+        elif not isinstance(value, str):
+            continue
+        for term in tokenize(value):
+            frequencies[term] = frequencies.get(term, 0) + weight
+    return frequencies
+
+
+def category_matches(category: Optional[str], requested: List[str]) -> bool:
+    """
+    Check whether an activity category matches one of the requested categories
+    :param category: Category of the activity
+    :param requested: Categories mentioned by the user
+    :return: True if either contains the other, ignoring case
+    """
+    category = (category or '').lower()
+    return bool(category) and any(r.lower() in category or category in r.lower() for r in requested)
+
+
+class BM25Ranker:
+    """
+    Incrementally maintained BM25 index over activity name, description and keywords
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, category_boost: float = 0.5):
+        """
+        Initialize the ranker
+        :param k1: BM25 term frequency saturation
+        :param b: BM25 document length normalization
+        :param category_boost: Extra score fraction for activities in a requested category
+        """
+        self.k1 = k1
+        self.b = b
+        self.category_boost = category_boost
+        self._postings: Dict[str, Dict[str, int]] = {}  # term -> {doc id: frequency}
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+
+    def add(self, doc_id: str, activity: Dict[str, Any]):
+        """
+        Index an activity, the caller must remove any previous version first
+        :param doc_id: Document id
+        :param activity: Activity data
+        """
+        frequencies = activity_terms(activity)
+        for term, frequency in frequencies.items():
+            self._postings.setdefault(term, {})[doc_id] = frequency
+        length = sum(frequencies.values())
+        self._lengths[doc_id] = length
+        self._total_length += length
+
+    def remove(self, doc_id: str, activity: Dict[str, Any]):
+        """
+        Remove an indexed activity
+        :param doc_id: Document id
+        :param activity: Activity data the document was indexed with
+        """
+        if doc_id not in self._lengths:
+            return
+        for term in activity_terms(activity):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(doc_id)
+
+    def clear(self):
+        self._postings.clear()
+        self._lengths.clear()
+        self._total_length = 0
+
+    def score(self, terms: Iterable[str]) -> Dict[str, float]:
+        """
+        Score every document containing at least one query term
+        :param terms: Query terms
+        :return: Dictionary of document id to BM25 score
+        """
+        count = len(self._lengths)
+        if not count:
+            return {}
+        average_length = self._total_length / count
+
+        scores: Dict[str, float] = {}
+        for term in set(terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log((count - df + 0.5) / (df + 0.5) + 1)
+            for doc_id, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores
+
+    def top_k(self,
+              terms: Iterable[str],
+              limit: int,
+              requested_categories: Optional[List[str]] = None,
+              category_of: Optional[Callable[[str], Optional[str]]] = None) -> List[Tuple[float, str]]:
+        """
+        Select the best scoring documents
+        :param terms: Query terms
+        :param limit: Maximum number of results
+        :param requested_categories: Categories mentioned by the user
+        :param category_of: Returns the category of a document id, used for the category boost
+        :return: List of (score, document id), best first
+        """
+        scores = self.score(terms)
+
+        if requested_categories and category_of:
+            for doc_id in scores:
+                if category_matches(category_of(doc_id), requested_categories):
+                    scores[doc_id] *= 1 + self.category_boost
+
+        # Heap selection instead of sorting all candidates; ties go to the lower id
+        best = heapq.nsmallest(limit, ((-score, doc_id) for doc_id, score in scores.items()))
+        return [(-score, doc_id) for score, doc_id in best]
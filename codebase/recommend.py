@@ -1,8 +1,25 @@
 import json
-from typing import Dict, List, Any
-import firebase_admin
-from firebase_admin import firestore
-import re
+import logging
+from typing import TYPE_CHECKING, Dict, List, Any, Optional
+
+if TYPE_CHECKING:
+    # Only for annotations, firebase_admin is imported when Firestore is first connected
+    from firebase_admin import firestore
+
+from activity_cache import get_activity_replica
+from clients import CLIENTS
+from intent import INTENT_MATCHER
+from response_cache import get_recommendation_cache, make_recommendation_key
+from write_behind import WriteBehindQueue, get_write_behind
+from tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of activities returned in one reply
+DEFAULT_RECOMMENDATION_LIMIT = 5
+
+# Minimum cosine similarity for an embedding match to be recommended
+MIN_SIMILARITY = 0.25
 
 def is_recommendation_request(message: str) -> bool:
     """
@@ -10,14 +27,7 @@ def is_recommendation_request(message: str) -> bool:
     :param message: User input message
     :return: True if the message is requesting recommendations
     """
-    recommendation_keywords = [
-        'recommend', 'suggest', 'find', 'look for', 'search for',
-        'what activities', 'what events', 'what to do', 'what can i do',
-        'interested in', 'looking for', 'want to join', 'want to participate'
-    ]
-    
-    message_lower = message.lower()
-    return any(keyword in message_lower for keyword in recommendation_keywords)
+    return INTENT_MATCHER.is_recommendation(message)
 
 def extract_interests_from_message(message: str) -> Dict[str, Any]:
     """
@@ -25,42 +35,12 @@ def extract_interests_from_message(message: str) -> Dict[str, Any]:
     :param message: User input message
     :return: Dictionary containing extracted interests and preferences
     """
-    # Basic keyword matching for categories
-    category_keywords = {
-        'gaming': ['game', 'gaming', 'play', 'player', 'gamer'],
-        'vr': ['vr', 'virtual reality', 'virtual', 'metaverse'],
-        'social': ['social', 'community', 'group', 'team', 'together'],
-        'learning': ['learn', 'study', 'education', 'course', 'class'],
-        'fitness': ['fitness', 'exercise', 'workout', 'sport', 'health'],
-        'art': ['art', 'creative', 'design', 'draw', 'paint'],
-        'music': ['music', 'song', 'concert', 'band', 'dance']
-    }
-    
-    # Extract mentioned categories
-    categories = []
-    message_lower = message.lower()
-    for category, keywords in category_keywords.items():
-        if any(keyword in message_lower for keyword in keywords):
-            categories.append(category)
-    
-    # Extract specific interests using regex
-    interest_patterns = [
-        r'i like (.*?)[.,!?]',
-        r'i love (.*?)[.,!?]',
-        r'i enjoy (.*?)[.,!?]',
-        r'i want to (.*?)[.,!?]',
-        r'i am interested in (.*?)[.,!?]'
-    ]
-    
-    interests = []
-    for pattern in interest_patterns:
-        matches = re.findall(pattern, message_lower)
-        interests.extend(matches)
-    
+    # Single pass over the message with the precompiled matcher
+    analysis = INTENT_MATCHER.analyze(message)
     return {
-        'categories': categories,
-        'interests': interests,
-        'raw_message': message
+        'categories': analysis['categories'],
+        'interests': analysis['interests'],
+        'raw_message': analysis['raw_message']
     }
 
 def format_activity_for_db(activity: Dict[str, Any]) -> Dict[str, Any]:
@@ -82,7 +62,7 @@ def format_activity_for_db(activity: Dict[str, Any]) -> Dict[str, Any]:
     
     return activity
 
-def save_activity_to_db(db: firestore.Client, activity: Dict[str, Any]) -> bool:
+def save_activity_to_db(db: 'firestore.Client', activity: Dict[str, Any]) -> bool:
     """
     Save activity to Firestore database
     :param db: Firestore database instance
@@ -93,131 +73,196 @@ def save_activity_to_db(db: firestore.Client, activity: Dict[str, Any]) -> bool:
         # Use activity name as document ID
         doc_ref = db.collection('Activities').document(activity['name'])
         doc_ref.set(activity)
+        
+        # Update the local replica now rather than waiting for the change event
+        get_activity_replica(db, timeout=0).upsert(activity['name'], activity)
+        # Cached GPT answers may now be stale or, if empty, have a match
+        get_recommendation_cache().invalidate_activity(activity)
         return True
     except Exception as e:
-        print(f"Error saving activity to database: {str(e)}")
+        logger.error("Error saving activity to database: %s", e)
+        # Reconnects if the credential stopped working
+        CLIENTS.report_error(e)
         return False
 
-def search_activities_in_db(db: firestore.Client, 
+def get_activity_writer(db: 'firestore.Client', **settings) -> WriteBehindQueue:
+    """
+    Get the background writer for the Activities collection
+    :param db: Firestore database instance
+    :param settings: WriteBehindQueue arguments, only used on first call
+    :return: WriteBehindQueue instance
+    """
+    def persisted(doc_id: str, activity: Dict[str, Any]):
+        # Same follow-up as save_activity_to_db, once the write is committed;
+        # writer.db rather than db, the queue moves to the new client on a reconnect
+        get_activity_replica(writer.db, timeout=0).upsert(doc_id, activity)
+        get_recommendation_cache().invalidate_activity(activity)
+
+    writer = get_write_behind(db, 'Activities', on_persisted=persisted, on_error=CLIENTS.report_error, **settings)
+    return writer
+
+def queue_activity_for_db(db: 'firestore.Client', activity: Dict[str, Any]):
+    """
+    Save activity to Firestore in the background, without waiting for the write
+    :param db: Firestore database instance
+    :param activity: Activity data to save
+    """
+    # Use activity name as document ID
+    get_activity_writer(db).put(activity['name'], activity)
+
+@TRACER.traced('recommend.search')
+def search_activities_in_db(store, 
                           interests: List[str], 
-                          categories: List[str] = None) -> List[Dict[str, Any]]:
+                          categories: List[str] = None,
+                          limit: int = DEFAULT_RECOMMENDATION_LIMIT) -> List[Dict[str, Any]]:
     """
     Search for activities in database based on interests and categories
-    :param db: Firestore database instance
+    :param store: Activity store (see storage.py)
     :param interests: List of user interests
-    :param categories: Optional list of categories to filter by
-    :return: List of matching activities
+    :param categories: Optional list of categories, matching activities rank higher
+    :param limit: Maximum number of activities to return
+    :return: List of matching activities, best match first
     """
-    if not db:
+    if not store:
         return []
     
     try:
-        activities_ref = db.collection('Activities')
-        
-        # Build query
-        query = activities_ref
-        
-        # Add category filter if provided
-        if categories:
-            query = query.where(filter=firestore.FieldFilter('category', 'in', categories))
+        # Ranked by BM25 locally (Firestore replica or SQLite FTS5), no network round trip per request
+        return store.search(interests, categories, limit)
         
-        # Get all activities
-        activities = query.stream()
-        
-        # Convert to list of dictionaries
-        activities_list = [activity.to_dict() for activity in activities]
-        
-        # Filter activities based on keywords matching user interests
-        matching_activities = []
-        for activity in activities_list:
-            # Check if any keyword matches user interests
-            if any(keyword.lower() in [interest.lower() for interest in interests] 
-                  for keyword in activity.get('keywords', [])):
-                matching_activities.append(activity)
+    except Exception as e:
+        logger.error("Error searching activities: %s", e)
+        return []
+
+@TRACER.traced('recommend.search_similar')
+def search_similar_activities_in_db(store,
+                                   interests_data: Dict[str, Any],
+                                   limit: int = DEFAULT_RECOMMENDATION_LIMIT,
+                                   min_similarity: float = MIN_SIMILARITY) -> List[Dict[str, Any]]:
+    """
+    Search for activities by embedding similarity, catching matches that
+    share no exact terms with the interests (e.g. "VR games" and "virtual reality")
+    :param store: Activity store (see storage.py)
+    :param interests_data: Dictionary from extract_interests_from_message
+    :param limit: Maximum number of activities to return
+    :param min_similarity: Minimum cosine similarity to include an activity
+    :return: List of similar activities, most similar first
+    """
+    if not store:
+        return []
+    
+    try:
+        query = ' '.join(interests_data['interests'] + interests_data['categories'])
+        if not query.strip():
+            query = interests_data['raw_message']
         
-        return matching_activities
+        return store.similar(query, limit, min_similarity)
         
     except Exception as e:
-        print(f"Error searching activities: {str(e)}")
+        logger.error("Error searching similar activities: %s", e)
         return []
 
-def format_activities_for_response(activities: List[Dict[str, Any]]) -> str:
+def format_activities_for_response(activities: List[Dict[str, Any]],
+                                   limit: int = DEFAULT_RECOMMENDATION_LIMIT) -> str:
     """
     Format activities for response message
     :param activities: List of activities
+    :param limit: Maximum number of activities to include
     :return: Formatted response string
     """
     if not activities:
         return "Sorry, I couldn't find any matching activities."
     
     response = "Here are some activities that might interest you:\n\n"
-    for activity in activities:
+    for activity in activities[:limit]:
         response += f"📌 {activity['name']}\n"
         response += f"📝 {activity['description']}\n"
         response += f"🔗 {activity['link']}\n\n"
     
     return response
 
+@TRACER.traced('recommend.gpt_fallback')
 def get_activity_recommendations_from_gpt(chatgpt, interests_data: Dict[str, Any]) -> str:
     """
-    Get activity recommendations from ChatGPT
+    Get activity recommendations from ChatGPT, reusing earlier answers for the same interests
     :param chatgpt: HKBU_ChatGPT instance
     :param interests_data: Dictionary containing user interests and categories
     :return: Formatted response with recommendations
     """
     try:
-        prompt = f"""
-        Based on the following user interests and categories, recommend some activities:
-        Interests: {', '.join(interests_data['interests'])}
-        Categories: {', '.join(interests_data['categories']) if interests_data['categories'] else 'Any category'}
+        cache = get_recommendation_cache()
+        cache_key = make_recommendation_key(interests_data['interests'], interests_data['categories'])
+        activities = cache.get(cache_key)
         
-        Please provide the response in JSON format with the following structure:
-        {{
-            "activities": [
-                {{
-                    "name": "Activity Name",
-                    "description": "Activity Description",
-                    "keywords": ["keyword1", "keyword2", ...],
-                    "link": "Activity Link",
-                    "category": "Activity Category"
-                }},
-                ...
-            ]
-        }}
-        """
-        
-        response = chatgpt._get_chatgpt_response(prompt)
-        # print(f"GPT Response: {response}")  # Add logging
-        
-        try:
-            # Clean the response before parsing
-            # Remove markdown code block markers if present
-            response = response.replace('```json', '').replace('```', '').strip()
-            
-            # Parse GPT response
-            recommendations = json.loads(response)
-            activities = recommendations.get('activities', [])
-            
-            if not activities:
-                print("No activities found in GPT response")  # Add logging
-                return "Sorry, I couldn't find any matching activities. Please try providing more specific interests or categories."
+        if activities is None:
+            activities = fetch_activities_from_gpt(chatgpt, interests_data)
+            if activities is None:
+                return "Sorry, there was an error processing the response. Please try again later."
             
-            # Save new activities to database
-            if chatgpt.db and activities:
+            # Save new activities to database in the background, the reply does not wait for it;
+            # the fallback store only mirrors Firestore, so writes go to the configured store
+            store = chatgpt.store
+            if activities and store.available:
                 for activity in activities:
                     formatted_activity = format_activity_for_db(activity)
                     if formatted_activity:
-                        save_activity_to_db(chatgpt.db, formatted_activity)
+                        store.queue(formatted_activity)
             
-            # Format response
-            return format_activities_for_response(activities)
-            
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {str(e)}")  # Add logging
-            print(f"Original response: {response}")  # Add logging
-            print(f"Cleaned response: {response}")  # Add logging
-            return "Sorry, there was an error processing the response. Please try again later."
+            # Dropped once the activities are persisted, the catalog answers from then on
+            cache.set(cache_key, activities)
+        
+        if not activities:
+            return "Sorry, I couldn't find any matching activities. Please try providing more specific interests or categories."
+        
+        # Format response
+        return format_activities_for_response(activities)
             
     except Exception as e:
-        print(f"Error getting activity recommendations: {str(e)}")  # Add logging
-        return "Sorry, there was an error processing your request. Please try again later." 
\ No newline at end of file
+        logger.exception("Error getting activity recommendations: %s", e)
+        return "Sorry, there was an error processing your request. Please try again later."
+
+def fetch_activities_from_gpt(chatgpt, interests_data: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Ask ChatGPT for activities matching the user's interests
+    :param chatgpt: HKBU_ChatGPT instance
+    :param interests_data: Dictionary containing user interests and categories
+    :return: Parsed activities, empty if GPT found none, None if the reply could not be parsed
+    """
+    prompt = f"""
+    Based on the following user interests and categories, recommend some activities:
+    Interests: {', '.join(interests_data['interests'])}
+    Categories: {', '.join(interests_data['categories']) if interests_data['categories'] else 'Any category'}
+    
+    Please provide the response in JSON format with the following structure:
+    {{
+        "activities": [
+            {{
+                "name": "Activity Name",
+                "description": "Activity Description",
+                "keywords": ["keyword1", "keyword2", ...],
+                "link": "Activity Link",
+                "category": "Activity Category"
+            }},
+            ...
+        ]
+    }}
+    """
+    
+    response = chatgpt._get_chatgpt_response(prompt)
+    
+    try:
+        # Clean the response before parsing
+        # Remove markdown code block markers if present
+        response = response.replace('```json', '').replace('```', '').strip()
+        
+        # Parse GPT response
+        recommendations = json.loads(response)
+        activities = recommendations.get('activities', [])
+        
+        if not activities:
+            logger.info("No activities found in GPT response")
+        return activities
+        
+    except json.JSONDecodeError as e:
+        logger.warning("JSON parsing error: %s", e, extra={'payload': {'response': response}})
+        return None
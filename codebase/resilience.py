@@ -0,0 +1,349 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+import requests
+
+from http_client import PooledHTTPClient
+
+# Status codes worth retrying: throttling and server-side failures
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an endpoint that is known to be down
+    """
+
+
+class RateLimitTimeout(Exception):
+    """
+    Raised when no request slot became free within the wait limit
+    """
+
+
+class TokenBucket:
+    """
+    Token bucket whose refill rate adapts to throttling.
+
+    On a 429 the rate is halved, each success raises it a little again until
+    it is back at the configured quota (additive increase, multiplicative
+    decrease), so the client settles just below what the server accepts.
+    """
+
+    def __init__(self, rate: float, capacity: float, min_rate: Optional[float] = None):
+        """
+        Initialize the bucket
+        :param rate: Tokens added per second, i.e. the request quota
+        :param capacity: Maximum tokens, i.e. the allowed burst
+        :param min_rate: Lowest rate the bucket backs off to
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 10
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """
+        Take one token, waiting for it if needed
+        :param timeout: Maximum seconds to wait, None to wait indefinitely
+        :return: True if a token was taken
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def throttled(self):
+        """
+        Back off after the server rejected a request for exceeding its quota
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0)
+
+    def succeeded(self):
+        """
+        Recover the rate after a successful request
+        """
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class CircuitBreaker:
+    """
+    Fail fast while an endpoint is down.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls are rejected for ``reset_timeout`` seconds. Then a single probe is
+    let through: success closes the circuit, failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Initialize the breaker
+        :param failure_threshold: Consecutive failures that open the circuit
+        :param reset_timeout: Seconds to stay open before probing again
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Check whether a call may go through
+        :return: False while the circuit is open
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def cancel(self):
+        """
+        Give back a call allowed by allow() that was never made
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def retry_in(self) -> float:
+        """
+        Seconds until the open circuit lets a probe through
+        """
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header
+    :param value: Header value, either seconds or an HTTP date
+    :return: Seconds to wait, or None if missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ResilientClient:
+    """
+    Rate-limited, retrying client for one upstream API.
+
+    Requests wait for a token-bucket slot, 429 and 5xx responses and network
+    errors are retried with exponential backoff and full jitter (or after
+    the server's Retry-After), and a circuit breaker rejects calls while
+    the endpoint keeps failing. Every outcome is counted.
+    """
+
+    def __init__(self,
+                 http: PooledHTTPClient,
+                 rate: float = 5.0,
+                 burst: float = 10.0,
+                 max_retries: int = 3,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 8.0,
+                 max_retry_after: float = 30.0,
+                 acquire_timeout: float = 10.0,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 30.0):
+        """
+        Initialize the client
+        :param http: Pooled HTTP client to send requests with
+        :param rate: Requests per second allowed by the API quota
+        :param burst: Requests that may be sent at once after an idle period
+        :param max_retries: Retries after the first attempt
+        :param backoff_base: Backoff before the first retry, doubled for each further retry
+        :param backoff_max: Upper bound of the backoff
+        :param max_retry_after: Longest Retry-After honoured; longer waits give up instead
+        :param acquire_timeout: Seconds to wait for a rate limit slot
+        :param failure_threshold: Consecutive failures that open the circuit
+        :param reset_timeout: Seconds the circuit stays open
+        """
+        self.http = http
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.acquire_timeout = acquire_timeout
+
+        self._lock = threading.Lock()
+        self._counters = {
+            'requests': 0,
+            'attempts': 0,
+            'successes': 0,
+            'client_errors': 0,
+            'throttled': 0,
+            'server_errors': 0,
+            'network_errors': 0,
+            'retries': 0,
+            'gave_up': 0,
+            'circuit_rejected': 0,
+            'rate_limit_timeouts': 0
+        }
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter spreads retries out so clients do not retry in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """
+        Send a POST request with rate limiting, retries and the circuit breaker
+        :param url: Request URL
+        :param kwargs: Extra arguments passed to the HTTP client
+        :return: Final response, possibly still a 429/5xx once retries are used up
+        :raises CircuitOpenError: The endpoint is failing and the circuit is open
+        :raises RateLimitTimeout: No rate limit slot became free in time
+        :raises requests.RequestException: Network error on the last attempt
+        """
+        self._count('requests')
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count('circuit_rejected')
+                raise CircuitOpenError(f"Upstream unavailable, retry in {self.breaker.retry_in():.0f}s")
+            if not self.bucket.acquire(self.acquire_timeout):
+                self.breaker.cancel()
+                self._count('rate_limit_timeouts')
+                raise RateLimitTimeout("Timed out waiting for the upstream rate limit")
+
+            self._count('attempts')
+            try:
+                response = self.http.post(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._count('network_errors')
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    self._count('gave_up')
+                    raise
+                delay = self._backoff(attempt)
+            except Exception:
+                # Not an endpoint failure, e.g. an invalid request
+                self.breaker.cancel()
+                raise
+            else:
+                status = response.status_code
+                if status not in RETRY_STATUS_CODES:
+                    # A 4xx other than 429 is our fault, the endpoint itself is healthy
+                    self.breaker.record_success()
+                    self.bucket.succeeded()
+                    self._count('successes' if status < 400 else 'client_errors')
+                    return response
+
+                if status == 429:
+                    self._count('throttled')
+                    self.bucket.throttled()
+                    # Throttling means the endpoint is up, so it does not count against the circuit
+                    self.breaker.record_success()
+                else:
+                    self._count('server_errors')
+                    self.breaker.record_failure()
+
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if attempt >= self.max_retries or (retry_after is not None and retry_after > self.max_retry_after):
+                    self._count('gave_up')
+                    return response
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+                # Free the connection before sleeping
+                response.close()
+
+            self._count('retries')
+            attempt += 1
+            time.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get outcome counters and limiter state
+        :return: Counters, current request rate and circuit state
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats['rate'] = self.bucket.rate
+        stats['circuit'] = self.breaker.state
+        return stats
+
+
+_shared_client: Optional[ResilientClient] = None
+_shared_lock = threading.Lock()
+
+
+def get_resilient_client(http: PooledHTTPClient, **settings) -> ResilientClient:
+    """
+    Get the process-wide upstream client; the API quota is shared by the whole process
+    :param http: Pooled HTTP client, only used on first call
+    :param settings: ResilientClient arguments, only used on first call
+    :return: Shared ResilientClient instance
+    """
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = ResilientClient(http, **settings)
+        return _shared_client
@@ -0,0 +1,364 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Normalize a prompt so trivially different messages share a cache entry
+    :param prompt: User input message
+    :return: Lowercased prompt with collapsed whitespace and no trailing punctuation
+    """
+    normalized = re.sub(r'\s+', ' ', prompt.lower()).strip()
+    return normalized.rstrip('.!?~ ')
+
+
+def make_cache_key(prompt: str, model_name: str, api_version: str,
+                   context: Optional[List[Dict[str, str]]] = None) -> Optional[str]:
+    """
+    Build the cache key for a prompt. Only prompts sent without conversation history
+    are cached and coalesced: replies depend on the history, and as histories hardly
+    ever repeat between users, keys including them would almost never be shared.
+    So a user's first message (or the first after /clear) can be answered from the
+    cache, while follow-ups always reach ChatGPT.
+    :param prompt: User input message
+    :param model_name: ChatGPT model name
+    :param api_version: ChatGPT API version
+    :param context: Conversation history sent before the prompt
+    :return: Cache key string, or None if the prompt has history and must not be cached
+    """
+    if context:
+        return None
+    raw = f"{model_name}\n{api_version}\n{normalize_prompt(prompt)}"
+    return 'chatgpt:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class MemoryCacheBackend:
+    """
+    In-process LRU cache with per-entry expiry and a total size limit in bytes
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 4 * 1024 * 1024):
+        """
+        Initialize the backend
+        :param max_entries: Maximum number of entries kept
+        :param max_bytes: Maximum total size of cached values in bytes
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at, size = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                return None
+
+            # Mark as most recently used
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: float):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+            self._entries[key] = (value, time.monotonic() + ttl, size)
+            self._bytes += size
+
+            # Evict least recently used entries until within limits
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'evictions': self.evictions
+            }
+
+
+class RedisCacheBackend:
+    """
+    Redis-backed cache shared between bot replicas.
+
+    Expiry uses Redis TTLs; eviction is left to the server's maxmemory policy
+    (allkeys-lru is recommended).
+    """
+
+    def __init__(self, url: str, max_value_bytes: int = 64 * 1024):
+        """
+        Initialize the backend
+        :param url: Redis connection URL, e.g. redis://localhost:6379/0
+        :param max_value_bytes: Values larger than this are not cached
+        """
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.max_value_bytes = max_value_bytes
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: str, ttl: float):
+        if len(value.encode('utf-8')) > self.max_value_bytes:
+            return
+        self.client.set(key, value, ex=max(1, int(ttl)))
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+    def clear(self):
+        for key in self.client.scan_iter('chatgpt:*'):
+            self.client.delete(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': 'redis'}
+
+
+class ResponseCache:
+    """
+    Cache of ChatGPT replies keyed by normalized prompt, model and API version
+    """
+
+    def __init__(self, backend=None, ttl: float = 600):
+        """
+        Initialize the cache
+        :param backend: Storage backend, defaults to an in-memory LRU
+        :param ttl: Seconds a cached reply stays valid
+        """
+        self.backend = backend or MemoryCacheBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached reply
+        :param key: Key from make_cache_key
+        :return: Cached reply or None
+        """
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            # A cache outage should never break the bot
+            logger.error("Error reading response cache: %s", e)
+            value = None
+            with self._lock:
+                self.errors += 1
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: str):
+        """
+        Store a reply
+        :param key: Key from make_cache_key
+        :param value: ChatGPT reply
+        """
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            logger.error("Error writing response cache: %s", e)
+            with self._lock:
+                self.errors += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics
+        :return: Hit/miss counters and backend statistics
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+        stats.update(self.backend.stats())
+        return stats
+
+
+def create_response_cache(ttl: float = 600,
+                          max_entries: int = 1024,
+                          max_bytes: int = 4 * 1024 * 1024,
+                          redis_url: Optional[str] = None) -> ResponseCache:
+    """
+    Create a response cache, using Redis when configured and reachable
+    :param ttl: Seconds a cached reply stays valid
+    :param max_entries: Maximum entries for the in-memory backend
+    :param max_bytes: Maximum total bytes for the in-memory backend
+    :param redis_url: Optional Redis URL for a shared cache
+    :return: ResponseCache instance
+    """
+    if redis_url:
+        try:
+            backend = RedisCacheBackend(redis_url)
+            backend.client.ping()
+            logger.info("Using Redis response cache")
+            return ResponseCache(backend, ttl)
+        except Exception as e:
+            logger.warning("Redis cache unavailable, falling back to in-memory response cache: %s", e)
+
+    return ResponseCache(MemoryCacheBackend(max_entries, max_bytes), ttl)
+
+
+def make_recommendation_key(interests: List[str], categories: Optional[List[str]] = None) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """
+    Build the cache key for a recommendation request
+    :param interests: User interests
+    :param categories: User categories
+    :return: Sorted, lowercased and deduplicated (interests, categories)
+    """
+    def canonical(values):
+        return tuple(sorted({value.strip().lower() for value in values or () if value.strip()}))
+
+    return canonical(interests), canonical(categories)
+
+
+class RecommendationCache:
+    """
+    Cache of parsed ChatGPT activity recommendations.
+
+    Keyed by the canonical (interests, categories) of the request, so the
+    slow GPT fallback runs once per combination instead of once per message.
+    Empty answers are cached too, for a shorter time. Entries holding an
+    activity are dropped once it is persisted to the catalog, so later
+    requests are answered from the catalog; empty answers are dropped
+    whenever any activity is persisted, since it may now match.
+    """
+
+    def __init__(self, ttl: float = 3600, negative_ttl: float = 300, max_entries: int = 512):
+        """
+        Initialize the cache
+        :param ttl: Seconds a list of recommendations stays valid
+        :param negative_ttl: Seconds an empty answer stays valid
+        :param max_entries: Maximum number of entries kept
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (activities, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key: Tuple) -> Optional[List[Dict[str, Any]]]:
+        """
+        Look up cached recommendations
+        :param key: Key from make_recommendation_key
+        :return: Activities, an empty list for a cached empty answer, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats['hits' if entry[0] else 'negative_hits'] += 1
+            return list(entry[0])
+
+    def set(self, key: Tuple, activities: List[Dict[str, Any]]):
+        """
+        Store recommendations
+        :param key: Key from make_recommendation_key
+        :param activities: Parsed activities, empty if GPT found none
+        """
+        ttl = self.ttl if activities else self.negative_ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (tuple(activities), time.monotonic() + ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate_activity(self, activity: Dict[str, Any]):
+        """
+        Drop the entries holding an activity written to the catalog, and the empty answers
+        :param activity: Activity data as persisted
+        """
+        name = activity.get('name')
+        with self._lock:
+            stale = [
+                key for key, (activities, _) in self._entries.items()
+                if not activities or any(cached.get('name') == name for cached in activities)
+            ]
+            for key in stale:
+                del self._entries[key]
+            self._stats['invalidations'] += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache statistics
+        :return: Hit, miss, eviction and invalidation counters and the entry count
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
+
+_recommendation_cache: Optional[RecommendationCache] = None
+_recommendation_lock = threading.Lock()
+
+
+def get_recommendation_cache(**settings) -> RecommendationCache:
+    """
+    Get the process-wide recommendation cache, shared with the code that persists activities
+    :param settings: RecommendationCache arguments, only used on first call
+    :return: Shared RecommendationCache instance
+    """
+    global _recommendation_cache
+    with _recommendation_lock:
+        if _recommendation_cache is None:
+            _recommendation_cache = RecommendationCache(**settings)
+        return _recommendation_cache
@@ -0,0 +1,288 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional
+
+# Lanes: cheap replies served from the activity index, and free-form GPT chats
+FAST_LANE = 'fast'
+SLOW_LANE = 'slow'
+
+
+class _Job:
+    __slots__ = ('key', 'func', 'cost', 'on_shed', 'enqueued_at')
+
+    def __init__(self, key: Hashable, func: Callable[[], Any], cost: float, on_shed: Optional[Callable[[], Any]]):
+        self.key = key
+        self.func = func
+        self.cost = cost
+        self.on_shed = on_shed
+        self.enqueued_at = time.monotonic()
+
+
+class _Lane:
+    """
+    Per-user queues of one lane, served by deficit round-robin
+    """
+
+    def __init__(self, name: str, weight: int, deadline: float, quantum: float):
+        self.name = name
+        self.weight = weight
+        self.deadline = deadline
+        self.quantum = quantum
+        self.queues: Dict[Hashable, Deque[_Job]] = {}
+        self.deficits: Dict[Hashable, float] = {}
+        self.rotation: 'OrderedDict[Hashable, None]' = OrderedDict()  # Users with queued jobs, in turn order
+        self.pending = 0
+        # Moving averages in seconds, used for admission control
+        self.avg_service: Optional[float] = None  # Unknown until the first job finishes
+        self.avg_wait = 0.0
+        self.shed = 0
+        self.rejected = 0
+        self.completed = 0
+
+    def push(self, job: _Job):
+        queue = self.queues.get(job.key)
+        if queue is None:
+            queue = self.queues[job.key] = deque()
+            self.deficits[job.key] = 0.0
+            self.rotation[job.key] = None
+        queue.append(job)
+        self.pending += 1
+
+    def pop(self, busy: Dict[Hashable, int], queued: Dict[Hashable, Deque[_Job]]) -> Optional[_Job]:
+        """
+        Take the next job by deficit round-robin, skipping users with a running job
+        or with an older job waiting in another lane
+        """
+        # Gives up only after every user in turn was blocked; a top-up is progress,
+        # credit keeps growing until the head job fits
+        blocked = 0
+        while self.rotation and blocked < len(self.rotation):
+            key = next(iter(self.rotation))
+            queue = self.queues[key]
+            if busy.get(key) or queued[key][0] is not queue[0]:
+                # Keep the user's turn order but let others go first
+                self.rotation.move_to_end(key)
+                blocked += 1
+                continue
+
+            if self.deficits[key] < queue[0].cost:
+                # Not enough credit left this round, top up and pass the turn on
+                self.deficits[key] += self.quantum
+                self.rotation.move_to_end(key)
+                blocked = 0
+                continue
+
+            job = queue.popleft()
+            self.deficits[key] -= job.cost
+            self.pending -= 1
+            if not queue:
+                # Idle users do not bank credit
+                del self.queues[key]
+                del self.deficits[key]
+                del self.rotation[key]
+            return job
+        return None
+
+    def clear(self):
+        self.queues.clear()
+        self.deficits.clear()
+        self.rotation.clear()
+        self.pending = 0
+
+
+class FairScheduler:
+    """
+    Fair, prioritized execution of message handlers.
+
+    Each user has their own queue inside each lane and users take turns by
+    deficit round-robin, so one chatty user cannot starve the others. The
+    fast lane gets ``fast_weight`` turns for every ``slow_weight`` turns of
+    the slow lane. At most one job per user runs at a time and a user's jobs
+    start in submission order across both lanes, so a user's messages are
+    answered in order; priority applies between users, not within one.
+
+    Jobs that would wait longer than their lane's deadline are shed: they
+    are refused at submission when the estimated wait is already too long,
+    or skipped when they have waited too long by the time a worker is free.
+    """
+
+    def __init__(self,
+                 workers: int = 8,
+                 quantum: float = 200,
+                 fast_weight: int = 3,
+                 slow_weight: int = 1,
+                 fast_deadline: float = 10.0,
+                 slow_deadline: float = 45.0):
+        """
+        Initialize the scheduler
+        :param workers: Number of worker threads, i.e. concurrent jobs
+        :param quantum: Credit a user receives per round, in job cost units
+        :param fast_weight: Turns of the fast lane per scheduling cycle
+        :param slow_weight: Turns of the slow lane per scheduling cycle
+        :param fast_deadline: Longest acceptable wait in seconds for fast jobs
+        :param slow_deadline: Longest acceptable wait in seconds for slow jobs
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+
+        self.workers = workers
+        self._lanes = {
+            FAST_LANE: _Lane(FAST_LANE, fast_weight, fast_deadline, quantum),
+            SLOW_LANE: _Lane(SLOW_LANE, slow_weight, slow_deadline, quantum)
+        }
+        # Weighted round-robin over lanes, e.g. fast, fast, fast, slow
+        self._cycle: List[_Lane] = [lane for lane in self._lanes.values() for _ in range(max(1, lane.weight))]
+        self._cursor = 0
+
+        self._busy: Dict[Hashable, int] = {}
+        # Each user's queued jobs across lanes, in submission order
+        self._queued: Dict[Hashable, Deque[_Job]] = {}
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._failed = 0
+        self._closed = False
+        self._threads = [threading.Thread(target=self._worker, name=f'scheduler-{i}', daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self,
+               key: Hashable,
+               job: Callable[[], Any],
+               lane: str = SLOW_LANE,
+               cost: float = 1,
+               on_shed: Optional[Callable[[], Any]] = None) -> bool:
+        """
+        Queue a job for a user
+        :param key: User the job belongs to, used for fairness and ordering
+        :param job: Callable taking no arguments
+        :param lane: FAST_LANE or SLOW_LANE
+        :param cost: Relative cost of the job, e.g. estimated prompt tokens
+        :param on_shed: Called instead of the job if it waited past the lane deadline
+        :return: False if the job was refused because the lane is overloaded
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Scheduler is shut down")
+
+            target = self._lanes[lane]
+            # Jobs ahead of this one, served by all workers at the lane's average pace
+            estimated_wait = target.pending * (target.avg_service or 0.0) / self.workers
+            if estimated_wait > target.deadline:
+                target.rejected += 1
+                return False
+
+            queued = _Job(key, job, cost, on_shed)
+            target.push(queued)
+            self._queued.setdefault(key, deque()).append(queued)
+            self._condition.notify()
+            return True
+
+    def _next_job(self):
+        """
+        Pick the next job, visiting lanes in weighted round-robin order
+        :return: (job, lane) or (None, None) when nothing is runnable
+        """
+        # Caller holds the condition lock
+        for offset in range(len(self._cycle)):
+            lane = self._cycle[(self._cursor + offset) % len(self._cycle)]
+            job = lane.pop(self._busy, self._queued)
+            if job is not None:
+                user_jobs = self._queued[job.key]
+                user_jobs.popleft()
+                if not user_jobs:
+                    del self._queued[job.key]
+                self._cursor = (self._cursor + offset + 1) % len(self._cycle)
+                return job, lane
+        return None, None
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while True:
+                    job, lane = self._next_job()
+                    if job is not None:
+                        break
+                    if self._closed and not any(l.pending for l in self._lanes.values()):
+                        return
+                    self._condition.wait()
+
+                waited = time.monotonic() - job.enqueued_at
+                lane.avg_wait += 0.1 * (waited - lane.avg_wait)
+                shed = waited > lane.deadline
+                if shed:
+                    lane.shed += 1
+                self._busy[job.key] = self._busy.get(job.key, 0) + 1
+                self._in_flight += 1
+
+            start = time.monotonic()
+            failed = False
+            try:
+                if shed:
+                    if job.on_shed:
+                        job.on_shed()
+                else:
+                    job.func()
+            except Exception:
+                logging.exception("Scheduled job for %s failed", job.key)
+                failed = True
+
+            with self._condition:
+                if not shed:
+                    service = time.monotonic() - start
+                    if lane.avg_service is None:
+                        lane.avg_service = service
+                    else:
+                        lane.avg_service += 0.1 * (service - lane.avg_service)
+                    lane.completed += 1
+                if failed:
+                    self._failed += 1
+                self._in_flight -= 1
+                self._busy[job.key] -= 1
+                if not self._busy[job.key]:
+                    del self._busy[job.key]
+                # The user's next job may have become runnable
+                self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get scheduler statistics
+        :return: Per-lane depth, wait, service time, shed and refused counts, plus totals
+        """
+        with self._condition:
+            return {
+                'in_flight': self._in_flight,
+                'workers': self.workers,
+                'failed': self._failed,
+                'lanes': {
+                    lane.name: {
+                        'queue_depth': lane.pending,
+                        'users': len(lane.rotation),
+                        'avg_wait': lane.avg_wait,
+                        'avg_service': lane.avg_service,
+                        'completed': lane.completed,
+                        'shed': lane.shed,
+                        'rejected': lane.rejected
+                    }
+                    for lane in self._lanes.values()
+                }
+            }
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop accepting jobs and optionally wait for queued jobs to finish
+        :param wait: Whether to block until all jobs are done
+        """
+        with self._condition:
+            self._closed = True
+            if not wait:
+                for lane in self._lanes.values():
+                    lane.clear()
+                self._queued.clear()
+            self._condition.notify_all()
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,117 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Call:
+    """
+    One in-flight call shared by every caller with the same key
+    """
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for it and receive the same result or exception. Nothing is
+    kept after the call finishes, so later callers always trigger a fresh
+    call and never get a stale result.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def acquire(self, key: Hashable) -> Tuple[_Call, bool]:
+        """
+        Join the in-flight call for a key or become its leader
+        :param key: Call key
+        :return: (call, True if the caller must run the call and release it)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                return call, False
+
+            call = _Call()
+            self._calls[key] = call
+            self.executions += 1
+            return call, True
+
+    def release(self, key: Hashable, call: _Call, result: Any = None, error: Optional[BaseException] = None):
+        """
+        Publish the leader's outcome to the waiting callers
+        :param key: Call key
+        :param call: Call returned by acquire
+        :param result: Result of the call
+        :param error: Exception raised by the call, if any
+        """
+        call.result = result
+        call.error = error
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            if error is not None:
+                self.errors += 1
+        call.done.set()
+
+    @staticmethod
+    def wait(call: _Call, timeout: Optional[float] = None) -> Any:
+        """
+        Wait for a call led by another caller
+        :param call: Call returned by acquire
+        :param timeout: Maximum seconds to wait, None to wait indefinitely
+        :return: The leader's result, its exception is re-raised
+        """
+        if not call.done.wait(timeout):
+            raise TimeoutError("Timed out waiting for coalesced call")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """
+        Run a function, sharing the execution with concurrent callers of the same key
+        :param key: Call key
+        :param func: Function taking no arguments
+        :return: Result of the function
+        """
+        call, leader = self.acquire(key)
+        if not leader:
+            return self.wait(call)
+
+        try:
+            result = func()
+        except BaseException as e:
+            self.release(key, call, error=e)
+            raise
+        self.release(key, call, result)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get coalescing statistics
+        :return: Executions, coalesced calls, failed executions and calls now in flight
+        """
+        with self._lock:
+            total = self.executions + self.coalesced
+            return {
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'in_flight': len(self._calls),
+                'coalesced_ratio': self.coalesced / total if total else 0.0
+            }
@@ -0,0 +1,105 @@
+import argparse
+import json
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = ("Hello! This reply comes from the local SSE stub server. "
+                 "It is streamed word by word so the bot's progressive message edits can be tested "
+                 "without calling the real ChatGPT API.")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers POST .../chat/completions like the HKBU ChatGPT API.
+
+    With ``"stream": true`` in the body the reply is sent as server-sent
+    events, one word per chunk, otherwise as a single JSON completion.
+    """
+
+    # Chunked transfer encoding, as real SSE endpoints use, needs HTTP/1.1
+    protocol_version = 'HTTP/1.1'
+    reply = DEFAULT_REPLY
+    token_delay = 0.05
+    first_token_delay = 0.3
+
+    def do_POST(self):
+        if not re.search(r'/chat/completions/?$', self.path.split('?')[0]):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+
+        if payload.get('stream'):
+            self._stream()
+        else:
+            self._complete()
+
+    def _complete(self):
+        time.sleep(self.first_token_delay + self.token_delay * len(self.reply.split()))
+        body = json.dumps({
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': self.reply}, 'finish_reason': 'stop'}]
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        time.sleep(self.first_token_delay)
+        self._event({'choices': [{'index': 0, 'delta': {'role': 'assistant'}}]})
+        for i, word in enumerate(self.reply.split(' ')):
+            self._event({'choices': [{'index': 0, 'delta': {'content': word if i == 0 else ' ' + word}}]})
+            time.sleep(self.token_delay)
+        self._event({'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+        self._write_chunk(b'data: [DONE]\n\n')
+        self._write_chunk(b'')
+
+    def _event(self, chunk):
+        self._write_chunk(b'data: ' + json.dumps(chunk).encode('utf-8') + b'\n\n')
+
+    def _write_chunk(self, data: bytes):
+        # An empty chunk ends the response
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the ChatGPT chat-completions API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--token-delay', type=float, default=StubHandler.token_delay,
+                        help="Seconds between streamed words")
+    parser.add_argument('--first-token-delay', type=float, default=StubHandler.first_token_delay,
+                        help="Seconds before the first word")
+    parser.add_argument('--reply', default=DEFAULT_REPLY, help="Reply text to send")
+    args = parser.parse_args()
+
+    StubHandler.reply = args.reply
+    StubHandler.token_delay = args.token_delay
+    StubHandler.first_token_delay = args.first_token_delay
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"SSE stub listening on http://{args.host}:{args.port}, "
+          f"set CHATGPT_BASIC_URL=http://{args.host}:{args.port} to use it")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,553 @@
+import json
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from activity_cache import RESET, Change, get_activity_replica
+from intent import CATEGORY_KEYWORDS
+from ranking import activity_terms, category_matches, tokenize
+from response_cache import get_recommendation_cache
+
+logger = logging.getLogger(__name__)
+
+# Activity stores share one interface: available, get, put, queue, update,
+# delete, iter_all, search, similar, in_categories, stats and close.
+# SQLiteActivityStore adds merge for bulk writes; DatabaseManager batches
+# Firestore writes itself. Activities are keyed by name, as in the
+# Activities collection.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    category TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    keywords TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS activities_category ON activities (category COLLATE NOCASE);
+CREATE VIRTUAL TABLE IF NOT EXISTS activities_fts USING fts5(terms, tokenize='unicode61');
+PRAGMA user_version = 1;
+"""
+
+_UPSERT = """
+INSERT INTO activities (name, category, description, keywords, data) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (name) DO UPDATE SET
+    category = excluded.category, description = excluded.description,
+    keywords = excluded.keywords, data = excluded.data
+"""
+
+
+def _fts_terms(activity: Dict[str, Any]) -> str:
+    """
+    Text indexed for an activity: its terms as ranking.tokenize produces them, each
+    repeated by its field-weighted frequency, so FTS5 sees the same term frequencies
+    and document lengths as the in-memory BM25 index
+    """
+    return ' '.join(' '.join([term] * frequency) for term, frequency in activity_terms(activity).items())
+
+
+class FirestoreActivityStore:
+    """
+    Activity store backed by a Firestore collection.
+
+    Reads for recommendations come from the live local replica, writes go
+    to Firestore directly or through the write-behind queue.
+    """
+
+    def __init__(self, get_db: Callable[[], Any], collection: str = 'Activities', database=None):
+        """
+        Initialize the store
+        :param get_db: Returns the current Firestore client, or None without database support;
+                       called per operation so a reconnected client is picked up
+        :param collection: Collection holding the activities
+        :param database: Optional LazyFirestore behind get_db, lets available and queue
+                         go without waiting for a connection still being made
+        """
+        self.get_db = get_db
+        self.collection = collection
+        self.database = database
+        # Activities queued before the client was connected
+        self._waiting: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._waiting_lock = threading.Lock()
+        self._drainer: Optional[threading.Thread] = None
+
+    @property
+    def available(self) -> bool:
+        """
+        Whether the store can serve requests; only with a LazyFirestore given this
+        never waits, a connection still being made then counts as available
+        """
+        if self.database is not None:
+            return self.database.enabled
+        return self.get_db() is not None
+
+    def _collection(self):
+        db = self.get_db()
+        if db is None:
+            raise RuntimeError("Firestore database not initialized")
+        return db.collection(self.collection)
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Get an activity
+        :param name: Activity name
+        :return: Activity data or None
+        """
+        doc = self._collection().document(name).get()
+        return doc.to_dict() if doc.exists else None
+
+    def put(self, activity: Dict[str, Any]):
+        """
+        Create or replace an activity and wait for the write
+        :param activity: Activity data, keyed by its name
+        """
+        # The replica picks the change up from its snapshot listener
+        self._collection().document(activity['name']).set(activity)
+        get_recommendation_cache().invalidate_activity(activity)
+
+    def queue(self, activity: Dict[str, Any]):
+        """
+        Create or replace an activity without making the caller wait for the write
+        or for the connection
+        :param activity: Activity data, keyed by its name
+        """
+        db = self.database.client if self.database is not None else self.get_db()
+        if db is not None:
+            self._writer(db).put(activity['name'], activity)
+            return
+
+        # Not connected yet, a background thread hands these to the writer once it is
+        with self._waiting_lock:
+            self._waiting[activity['name']] = activity
+            if self._drainer is None:
+                self._drainer = threading.Thread(target=self._drain, name='activity-store-wait', daemon=True)
+                self._drainer.start()
+
+    @staticmethod
+    def _writer(db):
+        # Imported here, recommend builds on the stores
+        from recommend import get_activity_writer
+        return get_activity_writer(db)
+
+    def _drain(self):
+        db = None
+        while db is None and self.available:
+            db = self.get_db()
+        with self._waiting_lock:
+            waiting, self._waiting = self._waiting, OrderedDict()
+            self._drainer = None
+        if db is None:
+            logger.error("Firestore unavailable, %d queued activities not saved", len(waiting))
+            return
+        writer = self._writer(db)
+        for name, activity in waiting.items():
+            writer.put(name, activity)
+
+    def update(self, name: str, updates: Dict[str, Any]):
+        """
+        Change fields of an existing activity
+        :param name: Activity name
+        :param updates: Fields to change
+        """
+        self._collection().document(name).update(updates)
+
+    def delete(self, name: str):
+        """
+        Delete an activity
+        :param name: Activity name
+        """
+        self._collection().document(name).delete()
+
+    def iter_all(self) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over all activities
+        """
+        return (doc.to_dict() for doc in self._collection().stream())
+
+    def _replica(self):
+        # None while Firestore is unreachable, searches then find nothing rather than fail
+        db = self.get_db()
+        return get_activity_replica(db) if db is not None else None
+
+    def search(self, interests: List[str], categories: Optional[List[str]] = None, limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        Rank activities by BM25 relevance over the local replica
+        """
+        replica = self._replica()
+        return replica.rank(interests, categories, limit) if replica is not None else []
+
+    def similar(self, query: str, limit: int = 5, min_score: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        Find activities by embedding similarity over the local replica
+        """
+        replica = self._replica()
+        return replica.similar(query, limit, min_score) if replica is not None else []
+
+    def in_categories(self, categories: Optional[List[str]] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        List activities in the given categories from the local replica
+        """
+        replica = self._replica()
+        return replica.index.in_categories(categories)[:limit] if replica is not None else []
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the backend and its size where known
+        """
+        return {'backend': 'firestore', 'collection': self.collection}
+
+    def close(self):
+        # The client belongs to the client registry
+        pass
+
+
+class SQLiteActivityStore:
+    """
+    Activity store in a local SQLite database.
+
+    An FTS5 index ranks searches by BM25. It indexes the terms of
+    ranking.tokenize with the field weights of the in-memory index and
+    boosts requested categories by the same rule, so both backends find
+    the same activities; FTS5 computes IDF without the +1 smoothing, which
+    can order multi-term matches differently. A separate index on category
+    serves category listings. Reads and writes take well under a
+    millisecond and need no network, so the store works as an offline test
+    bed and, kept in sync by apply_changes, as a fallback while Firestore
+    is unavailable.
+    """
+
+    def __init__(self, path: str = ':memory:', category_boost: float = 0.5):
+        """
+        Open or create the database
+        :param path: Database file, ':memory:' for a throwaway store
+        :param category_boost: Extra score fraction for activities in a requested category
+        """
+        if path != ':memory:':
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.category_boost = category_boost
+        # One connection shared by the scheduler threads, serialized by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._embeddings = None
+        # Ranks with the same category rule as the in-memory index
+        self._conn.create_function('category_matches', 2,
+                                   lambda category, requested: category_matches(category, json.loads(requested)),
+                                   deterministic=True)
+        with self._lock:
+            if path != ':memory:':
+                self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+
+    def _write(self, activity: Dict[str, Any]):
+        # Caller holds the lock inside a transaction
+        self._conn.execute(_UPSERT, self._row(activity))
+        rowid = self._conn.execute('SELECT id FROM activities WHERE name = ?', (activity['name'],)).fetchone()[0]
+        self._conn.execute('DELETE FROM activities_fts WHERE rowid = ?', (rowid,))
+        self._conn.execute('INSERT INTO activities_fts (rowid, terms) VALUES (?, ?)', (rowid, _fts_terms(activity)))
+
+    def _remove(self, name: str):
+        # Caller holds the lock inside a transaction
+        row = self._conn.execute('SELECT id FROM activities WHERE name = ?', (name,)).fetchone()
+        if row is not None:
+            self._conn.execute('DELETE FROM activities_fts WHERE rowid = ?', row)
+            self._conn.execute('DELETE FROM activities WHERE id = ?', row)
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    @staticmethod
+    def _row(activity: Dict[str, Any]) -> tuple:
+        keywords = activity.get('keywords', [])
+        if isinstance(keywords, list):
+            keywords = ' '.join(str(keyword) for keyword in keywords)
+        return (
+            activity['name'],
+            str(activity.get('category') or ''),
+            str(activity.get('description') or ''),
+            str(keywords or ''),
+            json.dumps(activity, ensure_ascii=False, default=str)
+        )
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Get an activity
+        :param name: Activity name
+        :return: Activity data or None
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM activities WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, activity: Dict[str, Any]):
+        """
+        Create or replace an activity and wait for the write
+        :param activity: Activity data, keyed by its name
+        """
+        with self._lock, self._conn:
+            self._write(activity)
+        self._embed(activity)
+        get_recommendation_cache().invalidate_activity(activity)
+
+    def queue(self, activity: Dict[str, Any]):
+        """
+        Create or replace an activity without making the caller wait for the write
+        :param activity: Activity data, keyed by its name
+        """
+        # A local write is as cheap as queueing it
+        self.put(activity)
+
+    def update(self, name: str, updates: Dict[str, Any]):
+        """
+        Change fields of an existing activity
+        :param name: Activity name
+        :param updates: Fields to change
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute('SELECT data FROM activities WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                raise KeyError(f"No activity named {name}")
+            activity = json.loads(row[0])
+            activity.update(updates)
+            activity['name'] = name
+            self._write(activity)
+        self._embed(activity)
+
+    def delete(self, name: str):
+        """
+        Delete an activity
+        :param name: Activity name
+        """
+        with self._lock, self._conn:
+            self._remove(name)
+            if self._embeddings is not None:
+                self._embeddings.remove(name)
+
+    def merge(self,
+              activities: Iterable[Dict[str, Any]],
+              merge_strategy: str = 'update',
+              batch_size: int = 500,
+              on_progress: Optional[Callable[[int], None]] = None) -> Dict[str, int]:
+        """
+        Write many activities, one transaction per batch
+        :param activities: Activities or an iterator of them
+        :param merge_strategy: 'update' merges into existing activities, 'skip' leaves them unchanged
+        :param batch_size: Activities per transaction
+        :param on_progress: Called with the number of activities processed after each batch
+        :return: Counts of created, updated, skipped and failed activities
+        """
+        stats = {'created': 0, 'updated': 0, 'skipped': 0, 'failed': 0}
+        iterator = iter(activities)
+        done = 0
+        while True:
+            window = list(islice(iterator, batch_size))
+            if not window:
+                break
+            written = []
+            with self._lock, self._conn:
+                for activity in window:
+                    try:
+                        row = self._conn.execute('SELECT data FROM activities WHERE name = ?',
+                                                 (activity['name'],)).fetchone()
+                        if row is not None and merge_strategy == 'skip':
+                            stats['skipped'] += 1
+                            continue
+                        if row is not None:
+                            merged = json.loads(row[0])
+                            merged.update(activity)
+                            activity = merged
+                        self._write(activity)
+                        stats['updated' if row is not None else 'created'] += 1
+                        written.append(activity)
+                    except Exception as e:
+                        logger.error("Error merging activity %s: %s", activity.get('name', 'unknown'), e)
+                        stats['failed'] += 1
+            for activity in written:
+                self._embed(activity)
+            done += len(window)
+            if on_progress:
+                on_progress(done)
+        return stats
+
+    def apply_changes(self, changes: List[Change]):
+        """
+        Mirror a batch of change events from a replica of the Firestore collection
+        :param changes: (change type, document id, data) tuples; a leading RESET means
+                        the batch holds the whole collection and anything else is deleted
+        """
+        full = bool(changes) and changes[0][0] == RESET
+        upserts = [dict(data, name=doc_id) for change_type, doc_id, data in changes
+                   if change_type in ('ADDED', 'MODIFIED') and data is not None]
+        removed = {doc_id for change_type, doc_id, _ in changes if change_type == 'REMOVED'}
+        with self._lock, self._conn:
+            if full:
+                present = {activity['name'] for activity in upserts}
+                removed |= {name for (name,) in self._conn.execute('SELECT name FROM activities')} - present
+            for name in removed:
+                self._remove(name)
+            for activity in upserts:
+                self._write(activity)
+            if self._embeddings is not None:
+                for name in removed:
+                    self._embeddings.remove(name)
+        for activity in upserts:
+            self._embed(activity)
+
+    def iter_all(self) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over all activities
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT data FROM activities ORDER BY name').fetchall()
+        return (json.loads(row[0]) for row in rows)
+
+    def search(self, interests: List[str], categories: Optional[List[str]] = None, limit: int = 5) -> List[Dict[str, Any]]:
+        """
+        Find the best matching activities by BM25 relevance
+        :param interests: List of user interests
+        :param categories: Optional list of categories, boosts activities in them
+        :param limit: Maximum number of results
+        :return: Up to limit activities, best match first
+        """
+        terms: List[str] = []
+        for text in list(interests) + list(categories or []):
+            terms.extend(tokenize(text))
+        if not terms or limit <= 0:
+            return []
+
+        # Quoted, so user text is never read as FTS5 query syntax
+        match = ' OR '.join(f'"{term}"' for term in dict.fromkeys(terms))
+        # bm25() is lower for better matches, scaling it up by the boost ranks the category first
+        boost = f"CASE WHEN category_matches(a.category, ?) THEN {1 + self.category_boost} ELSE 1 END" \
+            if categories else '1'
+        query = (
+            f"SELECT a.data FROM activities_fts f JOIN activities a ON a.id = f.rowid "
+            f"WHERE activities_fts MATCH ? "
+            f"ORDER BY bm25(activities_fts) * {boost}, a.name LIMIT ?"
+        )
+        params = [match] + ([json.dumps(categories)] if categories else []) + [limit]
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def similar(self, query: str, limit: int = 5, min_score: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        Find activities by embedding similarity, embedding the catalog on first use
+        :param query: Query text
+        :param limit: Maximum number of results
+        :param min_score: Minimum cosine similarity
+        :return: Up to limit activities, most similar first
+        """
+        embeddings = self._embedding_store()
+        matches = embeddings.search([query], limit, min_score)[0]
+        return [activity for activity in (self.get(name) for _, name in matches) if activity]
+
+    def _embedding_store(self):
+        with self._lock:
+            if self._embeddings is None:
+                # Imported here, numpy is only needed for similarity search
+                from embeddings import EmbeddingStore, HashingEmbedder
+                embeddings = EmbeddingStore(HashingEmbedder(concepts=CATEGORY_KEYWORDS))
+                for (data,) in self._conn.execute('SELECT data FROM activities'):
+                    activity = json.loads(data)
+                    embeddings.upsert(activity['name'], activity)
+                self._embeddings = embeddings
+            return self._embeddings
+
+    def _embed(self, activity: Dict[str, Any]):
+        if self._embeddings is not None:
+            self._embeddings.upsert(activity['name'], activity)
+
+    def in_categories(self, categories: Optional[List[str]] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        List activities in the given categories
+        :param categories: Optional list of categories, all activities when empty
+        :param limit: Maximum number of results, None for all
+        :return: Activities ordered by name
+        """
+        query = 'SELECT data FROM activities'
+        params: List[Any] = []
+        if categories:
+            query += f" WHERE category COLLATE NOCASE IN ({','.join('?' * len(categories))})"
+            params.extend(categories)
+        query += ' ORDER BY name LIMIT ?'
+        params.append(-1 if limit is None else limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the backend and its size where known
+        """
+        with self._lock:
+            count = self._conn.execute('SELECT count(*) FROM activities').fetchone()[0]
+        return {'backend': 'sqlite', 'path': self.path, 'activities': count}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_activity_store(backend: str = 'firestore',
+                          get_db: Optional[Callable[[], Any]] = None,
+                          sqlite_path: str = 'data/activities.db',
+                          database=None):
+    """
+    Create an activity store
+    :param backend: 'firestore' or 'sqlite'
+    :param get_db: Returns the Firestore client, required for the firestore backend
+    :param sqlite_path: Database file of the sqlite backend
+    :param database: LazyFirestore behind get_db, see FirestoreActivityStore
+    :return: FirestoreActivityStore or SQLiteActivityStore instance
+    """
+    if backend == 'sqlite':
+        return SQLiteActivityStore(sqlite_path)
+    if backend != 'firestore':
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return FirestoreActivityStore(get_db, database=database)
+
+
+_sqlite_stores: Dict[str, SQLiteActivityStore] = {}
+_sqlite_lock = threading.Lock()
+
+
+def get_sqlite_activity_store(path: str = 'data/activities.db') -> SQLiteActivityStore:
+    """
+    Get the SQLite store of a database file, opening it on first use
+    :param path: Database file
+    :return: Shared SQLiteActivityStore instance
+    """
+    with _sqlite_lock:
+        store = _sqlite_stores.get(path)
+        if store is None:
+            store = _sqlite_stores[path] = SQLiteActivityStore(path)
+        return store
+
+
+def close_sqlite_activity_stores():
+    """
+    Close all shared SQLite stores
+    """
+    with _sqlite_lock:
+        for store in _sqlite_stores.values():
+            store.close()
+        _sqlite_stores.clear()
+
+
+def copy_activities(source, target, merge_strategy: str = 'update') -> Dict[str, int]:
+    """
+    Copy every activity of one store into another, e.g. to fill a SQLite store for offline use;
+    the bot keeps its fallback store in sync from the Firestore replica instead
+    :param source: Store to read from
+    :param target: SQLiteActivityStore to write to
+    :param merge_strategy: 'update' or 'skip' for activities the target already has
+    :return: Counts of created, updated, skipped and failed activities
+    """
+    return target.merge(source.iter_all(), merge_strategy)
@@ -0,0 +1,188 @@
+import json
+import logging
+import time
+from typing import Callable, Iterable, Iterator, Optional
+
+from tracing import TRACER
+
+# Telegram rejects messages longer than this
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+
+def iter_sse_data(lines: Iterable[bytes]) -> Iterator[str]:
+    """
+    Parse a server-sent events stream into event payloads
+    :param lines: Raw lines of the stream, e.g. from response.iter_lines()
+    :return: Iterator of the data field of each event
+    """
+    data = []
+    for raw in lines:
+        line = raw.decode('utf-8') if isinstance(raw, bytes) else raw
+        line = line.rstrip('\r')
+
+        if not line:
+            # A blank line ends the event
+            if data:
+                yield '\n'.join(data)
+                data = []
+            continue
+
+        if line.startswith(':'):
+            # Comment, used as keep-alive
+            continue
+
+        field, _, value = line.partition(':')
+        if field == 'data':
+            data.append(value[1:] if value.startswith(' ') else value)
+
+    if data:
+        yield '\n'.join(data)
+
+
+def iter_completion_deltas(lines: Iterable[bytes]) -> Iterator[str]:
+    """
+    Extract the content deltas from a chat-completions SSE stream
+    :param lines: Raw lines of the stream
+    :return: Iterator of text fragments, in order
+    """
+    for data in iter_sse_data(lines):
+        if data.strip() == '[DONE]':
+            return
+
+        chunk = json.loads(data)
+        if 'error' in chunk:
+            raise RuntimeError(f"Stream error: {chunk['error']}")
+
+        for choice in chunk.get('choices', []):
+            content = (choice.get('delta') or {}).get('content')
+            if content:
+                yield content
+
+
+class ProgressiveMessage:
+    """
+    Telegram message that grows as text streams in.
+
+    The first fragment is sent right away so the user sees the reply start,
+    later fragments are shown by editing the message at most once per
+    ``min_interval`` seconds, which keeps within Telegram's per-chat edit
+    limits. Text longer than one message continues in a new message.
+    """
+
+    def __init__(self,
+                 bot,
+                 chat_id: int,
+                 min_interval: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        """
+        Initialize the message
+        :param bot: Telegram bot with send_message and edit_message_text
+        :param chat_id: Chat to send the message to
+        :param min_interval: Minimum seconds between two edits of the message
+        :param clock: Monotonic clock, replaceable for tests
+        :param sleep: Sleep function, replaceable for tests
+        """
+        self.bot = bot
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self._clock = clock
+        self._sleep = sleep
+
+        self._text = ''
+        self._offset = 0  # Start of the current message within the full text
+        self._message = None
+        self._shown = ''
+        self._next_edit = 0.0
+
+        self.first_sent_at: Optional[float] = None
+        self.messages_sent = 0
+        self.edits = 0
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def append(self, fragment: str):
+        """
+        Add streamed text, updating the message when the rate limit allows
+        :param fragment: New text fragment
+        """
+        self._text += fragment
+        self._flush(final=False)
+
+    def finish(self) -> str:
+        """
+        Show the complete text, waiting for the rate limit if needed
+        :return: The full text
+        """
+        self._flush(final=True)
+        return self._text
+
+    def _flush(self, final: bool):
+        # Move whole messages out of the way first
+        while len(self._text) - self._offset > TELEGRAM_MAX_MESSAGE_LENGTH:
+            end = self._offset + TELEGRAM_MAX_MESSAGE_LENGTH
+            self._show(self._text[self._offset:end], final=True)
+            self._offset = end
+            self._message = None
+            self._shown = ''
+
+        current = self._text[self._offset:]
+        if current.strip():
+            self._show(current, final)
+
+    def _show(self, text: str, final: bool):
+        while True:
+            if self._message is None:
+                # No rate limit before the first send, that is what the user waits for
+                if self._call(self.bot.send_message, final, chat_id=self.chat_id, text=text):
+                    return
+                continue
+
+            if text == self._shown:
+                return
+
+            wait = self._next_edit - self._clock()
+            if wait > 0:
+                if not final:
+                    return
+                self._sleep(wait)
+
+            if self._call(self.bot.edit_message_text, final, text=text,
+                          chat_id=self.chat_id, message_id=self._message.message_id):
+                return
+
+    def _call(self, method, final: bool, text: str, **kwargs) -> bool:
+        """
+        Send or edit the message
+        :return: True when done, False when it should be retried
+        """
+        try:
+            with TRACER.span('telegram.send' if self._message is None else 'telegram.edit'):
+                result = method(text=text, **kwargs)
+        except Exception as e:
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is not None:
+                # Flood control: hold off all edits for as long as Telegram asks
+                logging.warning("Telegram rate limit hit for chat %s, retrying in %ss", self.chat_id, retry_after)
+                self._next_edit = self._clock() + float(retry_after)
+                if self._message is None:
+                    self._sleep(float(retry_after))
+                    return False
+                return not final
+            if 'not modified' in str(e).lower():
+                self._shown = text
+                return True
+            raise
+
+        if self._message is None:
+            self._message = result
+            self.messages_sent += 1
+            if self.first_sent_at is None:
+                self.first_sent_at = self._clock()
+        else:
+            self.edits += 1
+        self._shown = text
+        self._next_edit = self._clock() + self.min_interval
+        return True
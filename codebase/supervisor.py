@@ -0,0 +1,228 @@
+import bisect
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping keys to worker indexes.
+
+    Each worker owns ``replicas`` points on the ring, so keys spread evenly
+    and changing the worker count only moves about 1/N of the keys.
+    """
+
+    def __init__(self, nodes: List[int], replicas: int = 64):
+        """
+        Build the ring
+        :param nodes: Worker indexes
+        :param replicas: Virtual points per worker
+        """
+        points = sorted((self._hash(f"{node}:{i}"), node) for node in nodes for i in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # crc32 is stable across processes, unlike hash()
+        return zlib.crc32(key.encode('utf-8'))
+
+    def node_for(self, key: Hashable) -> int:
+        """
+        Find the worker owning a key
+        :param key: Key, e.g. a chat id
+        :return: Worker index
+        """
+        index = bisect.bisect(self._hashes, self._hash(str(key))) % len(self._hashes)
+        return self._nodes[index]
+
+
+def update_chat_id(update: Dict[str, Any]) -> Optional[int]:
+    """
+    Find the chat an update belongs to
+    :param update: Telegram update as a dict
+    :return: Chat id, or the sender id for updates without a chat, or None
+    """
+    for key, value in update.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat and 'id' in chat:
+            return chat['id']
+        sender = value.get('from')
+        if sender and 'id' in sender:
+            return sender['id']
+    return None
+
+
+class _Worker:
+    __slots__ = ('index', 'inbox', 'process', 'dispatched', 'restarts', 'started_at', 'status')
+
+    def __init__(self, index: int, inbox):
+        self.index = index
+        self.inbox = inbox
+        self.process = None
+        self.dispatched = 0
+        self.restarts = 0
+        self.started_at = 0.0
+        self.status: Dict[str, Any] = {}
+
+
+class WorkerSupervisor:
+    """
+    Run message handling in several worker processes.
+
+    Updates are routed by a consistent hash of their chat id, so all
+    messages of a chat go to the same worker and stay in order. Crashed
+    workers are restarted with the same inbox, so queued updates are kept.
+    Workers report their load on a shared status queue.
+    """
+
+    def __init__(self,
+                 workers: int,
+                 target: Callable[[int, Any, Any], None],
+                 restart_delay: float = 1.0,
+                 max_restart_delay: float = 30.0):
+        """
+        Initialize the supervisor
+        :param workers: Number of worker processes
+        :param target: Worker entry point, called as target(index, inbox, status_queue) in the child
+        :param restart_delay: Delay before restarting a worker that crashed quickly
+        :param max_restart_delay: Upper bound of the restart delay for repeatedly crashing workers
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+
+        # spawn, because gRPC (Firestore) and threads do not survive fork
+        self._context = multiprocessing.get_context('spawn')
+        self.target = target
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.ring = HashRing(list(range(workers)))
+        self.status_queue = self._context.Queue()
+        self._workers = [_Worker(i, self._context.Queue()) for i in range(workers)]
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+        self.unrouted = 0
+
+    def _spawn(self, worker: _Worker):
+        worker.process = self._context.Process(
+            target=self.target,
+            args=(worker.index, worker.inbox, self.status_queue),
+            name=f'worker-{worker.index}',
+            daemon=True
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        logging.info("Started worker %d (pid %d)", worker.index, worker.process.pid)
+
+    def start(self):
+        """
+        Start all workers and the monitor thread
+        """
+        for worker in self._workers:
+            self._spawn(worker)
+        self._monitor = threading.Thread(target=self._watch, name='supervisor', daemon=True)
+        self._monitor.start()
+
+    def _watch(self):
+        while not self._stopping.is_set():
+            self._drain_status()
+            for worker in self._workers:
+                if worker.process.is_alive() or self._stopping.is_set():
+                    continue
+
+                uptime = time.monotonic() - worker.started_at
+                logging.error("Worker %d exited with code %s after %.0fs, restarting",
+                              worker.index, worker.process.exitcode, uptime)
+                # Back off when a worker keeps crashing right after start
+                if uptime < self.max_restart_delay:
+                    delay = min(self.max_restart_delay, self.restart_delay * (2 ** min(worker.restarts, 5)))
+                    if self._stopping.wait(delay):
+                        return
+                else:
+                    worker.restarts = 0
+                with self._lock:
+                    worker.restarts += 1
+                self._spawn(worker)
+            self._stopping.wait(1.0)
+
+    def _drain_status(self):
+        while True:
+            try:
+                index, status = self.status_queue.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self._workers[index].status = status
+
+    def dispatch(self, update: Dict[str, Any]) -> int:
+        """
+        Route an update to the worker owning its chat
+        :param update: Telegram update as a dict
+        :return: Index of the worker it was sent to
+        """
+        chat_id = update_chat_id(update)
+        if chat_id is None:
+            # No chat to keep in order, any worker will do
+            with self._lock:
+                self.unrouted += 1
+            chat_id = update.get('update_id', 0)
+        worker = self._workers[self.ring.node_for(chat_id)]
+        worker.inbox.put(update)
+        with self._lock:
+            worker.dispatched += 1
+        return worker.index
+
+    def alive(self) -> int:
+        """
+        Number of worker processes currently running
+        """
+        return sum(1 for worker in self._workers if worker.process is not None and worker.process.is_alive())
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get per-worker load
+        :return: For each worker its pid, liveness, restarts, dispatched updates,
+                 inbox depth and the last status it reported
+        """
+        self._drain_status()
+        workers = []
+        with self._lock:
+            for worker in self._workers:
+                try:
+                    depth = worker.inbox.qsize()
+                except NotImplementedError:
+                    depth = None
+                workers.append({
+                    'index': worker.index,
+                    'pid': worker.process.pid if worker.process else None,
+                    'alive': bool(worker.process and worker.process.is_alive()),
+                    'restarts': worker.restarts,
+                    'dispatched': worker.dispatched,
+                    'inbox_depth': depth,
+                    'status': worker.status
+                })
+            return {'workers': workers, 'unrouted': self.unrouted}
+
+    def shutdown(self, timeout: float = 30.0):
+        """
+        Ask workers to finish their queued updates and exit
+        :param timeout: Seconds to wait for each worker before terminating it
+        """
+        self._stopping.set()
+        for worker in self._workers:
+            # Sentinel: everything queued before it is still handled
+            worker.inbox.put(None)
+        for worker in self._workers:
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                logging.warning("Worker %d did not stop in time, terminating", worker.index)
+                worker.process.terminate()
+        if self._monitor is not None:
+            self._monitor.join()
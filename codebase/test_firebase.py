@@ -1,22 +1,20 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 import os
 import json
 
+from clients import CLIENTS
+
 def initialize_firebase():
     """Initialize Firebase connection"""
     try:
-        if not firebase_admin._apps:
-            # Check if service account file exists
-            if not os.path.exists("serviceAccountKey.json"):
-                raise FileNotFoundError("serviceAccountKey.json file does not exist")
-            
-            # Initialize Firebase with service account
-            cred = credentials.Certificate("serviceAccountKey.json")
-            firebase_admin.initialize_app(cred)
+        # Check if service account file exists
+        if not os.path.exists("serviceAccountKey.json"):
+            raise FileNotFoundError("serviceAccountKey.json file does not exist")
         
-        # Get Firestore client
-        db = firestore.client()
+        # Get Firestore client from the shared client registry
+        database = CLIENTS.firestore("serviceAccountKey.json")
+        db = database.get()
+        if db is None:
+            raise RuntimeError(database.error)
         print("Successfully connected to Firebase.")
         return db
         
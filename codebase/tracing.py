@@ -0,0 +1,396 @@
+import bisect
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in milliseconds, from an index lookup to a slow LLM reply
+DEFAULT_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# Span currently open in this thread, parent of spans started inside it
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """
+    One timed stage of handling a message.
+
+    Timestamps come from the monotonic clock; they are converted to wall
+    clock time only when exported. Ids are only generated when an
+    exporter is set, since the histograms do not need them.
+    """
+
+    __slots__ = ('tracer', 'name', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns',
+                 'attributes', 'error', '_token')
+
+    def __init__(self, tracer: 'Tracer', name: str, parent: Optional['Span'], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.end_ns: Optional[int] = None
+        self._token = None
+        if tracer.exporter is not None:
+            self.trace_id = parent.trace_id if parent is not None and parent.trace_id else '%032x' % random.getrandbits(128)
+            self.span_id = '%016x' % random.getrandbits(64)
+            self.parent_id = parent.span_id if parent is not None else None
+        else:
+            self.trace_id = self.span_id = self.parent_id = None
+        self.start_ns = time.monotonic_ns()
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self, error: Optional[BaseException] = None):
+        """
+        Finish the span and record its duration
+        :param error: Exception that ended the stage, if any
+        """
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.monotonic_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.tracer._finish(self)
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return None if self.end_ns is None else (self.end_ns - self.start_ns) / 1e6
+
+    def __enter__(self) -> 'Span':
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.end(exc)
+        return False
+
+
+class _NoopSpan:
+    """
+    Stand-in returned while tracing is disabled
+    """
+
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def end(self, error: Optional[BaseException] = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max', 'errors')
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+
+class Tracer:
+    """
+    Lightweight span tracer with per-stage latency histograms.
+
+    ``span`` opens a span that becomes the parent of spans opened inside
+    it on the same thread; ``start_span`` opens one without that, for
+    generators whose body runs interleaved with the caller's code, which
+    ``traced`` makes current only while the generator body runs. Every
+    finished span is added to the histogram of its name and, when an
+    exporter is set, handed to it.
+    """
+
+    def __init__(self, enabled: bool = True, exporter=None, buckets_ms=DEFAULT_BUCKETS_MS):
+        """
+        Initialize the tracer
+        :param enabled: Whether spans are recorded at all
+        :param exporter: Optional object with export(span) and close() methods
+        :param buckets_ms: Histogram bucket upper bounds in milliseconds
+        """
+        self.enabled = enabled
+        self.exporter = exporter
+        self.buckets_ms = tuple(buckets_ms)
+        self._histograms: Dict[str, _Histogram] = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str, **attributes) -> Span:
+        """
+        Open a span as the current span, use as a context manager
+        :param name: Stage name, spans of the same name share a histogram
+        :param attributes: Extra details exported with the span
+        :return: Span
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, _current_span.get(), attributes)
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """
+        Open a span without making it current; call end() on it when done
+        :param name: Stage name
+        :param attributes: Extra details exported with the span
+        :return: Span
+        """
+        return self.span(name, **attributes)
+
+    def traced(self, name: str) -> Callable:
+        """
+        Decorator running each call of a function in a span; for generator
+        functions the span lasts until the generator is exhausted or closed
+        :param name: Stage name
+        """
+        def decorator(func):
+            if inspect.isgeneratorfunction(func):
+                @functools.wraps(func)
+                def generator_wrapper(*args, **kwargs):
+                    span = self.start_span(name)
+                    generator = func(*args, **kwargs)
+                    resume, value = generator.send, None
+                    try:
+                        while True:
+                            # Current only while the generator body runs, so spans it
+                            # opens nest under this one and the caller's do not
+                            token = _current_span.set(span) if isinstance(span, Span) else None
+                            try:
+                                item = resume(value)
+                            finally:
+                                if token is not None:
+                                    _current_span.reset(token)
+                            try:
+                                resume, value = generator.send, (yield item)
+                            except GeneratorExit:
+                                raise
+                            except BaseException as e:
+                                # Thrown in by the consumer, passed on to the generator
+                                resume, value = generator.throw, e
+                    except StopIteration as stop:
+                        span.end()
+                        return stop.value
+                    except GeneratorExit:
+                        # The consumer stopped early, not a failure of the stage
+                        span.set_attribute('abandoned', True)
+                        span.end()
+                        token = _current_span.set(span) if isinstance(span, Span) else None
+                        try:
+                            generator.close()
+                        finally:
+                            if token is not None:
+                                _current_span.reset(token)
+                        raise
+                    except BaseException as e:
+                        span.end(e)
+                        raise
+                return generator_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, name: str, seconds: float):
+        """
+        Add a duration measured elsewhere to a stage histogram
+        :param name: Stage name
+        :param seconds: Duration in seconds
+        """
+        if self.enabled:
+            self._observe(name, seconds * 1000, False)
+
+    def _observe(self, name: str, duration_ms: float, failed: bool):
+        index = bisect.bisect_left(self.buckets_ms, duration_ms)
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = _Histogram(len(self.buckets_ms) + 1)
+            histogram.counts[index] += 1
+            histogram.count += 1
+            histogram.total += duration_ms
+            if duration_ms > histogram.max:
+                histogram.max = duration_ms
+            if failed:
+                histogram.errors += 1
+
+    def _finish(self, span: Span):
+        self._observe(span.name, span.duration_ms, span.error is not None)
+        exporter = self.exporter
+        if exporter is not None:
+            exporter.export(span)
+
+    def _quantile(self, histogram: _Histogram, q: float) -> float:
+        # Upper bound of the bucket holding the quantile, the maximum for the overflow bucket
+        rank = q * histogram.count
+        seen = 0
+        for index, count in enumerate(histogram.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.buckets_ms[index] if index < len(self.buckets_ms) else histogram.max
+        return histogram.max
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get latency statistics per stage
+        :return: Count, errors, mean, max, estimated p50/p95/p99 and cumulative buckets, in milliseconds
+        """
+        with self._lock:
+            stats = {}
+            for name, histogram in self._histograms.items():
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(self.buckets_ms, histogram.counts):
+                    cumulative += count
+                    buckets[bound] = cumulative
+                stats[name] = {
+                    'count': histogram.count,
+                    'errors': histogram.errors,
+                    'sum_ms': histogram.total,
+                    'mean_ms': histogram.total / histogram.count if histogram.count else 0.0,
+                    'max_ms': histogram.max,
+                    'p50_ms': self._quantile(histogram, 0.5),
+                    'p95_ms': self._quantile(histogram, 0.95),
+                    'p99_ms': self._quantile(histogram, 0.99),
+                    'buckets': buckets
+                }
+            return stats
+
+    def set_exporter(self, exporter):
+        """
+        Replace the exporter, closing the previous one
+        :param exporter: Exporter, or None to stop exporting
+        """
+        previous, self.exporter = self.exporter, exporter
+        if previous is not None:
+            previous.close()
+
+
+class JsonFileExporter:
+    """
+    Append finished spans to a file in the OpenTelemetry OTLP/JSON format.
+
+    Spans are buffered and written by a background thread, one
+    ``resourceSpans`` document per line, so tracing adds no file I/O to
+    the traced code. The output can be replayed into an OpenTelemetry
+    collector with its file receiver.
+    """
+
+    def __init__(self, path: str, service_name: str = 'chatbot', flush_interval: float = 1.0, max_buffer: int = 10000):
+        """
+        Initialize the exporter and start the writer thread
+        :param path: File to append to
+        :param service_name: service.name resource attribute
+        :param flush_interval: Seconds between writes
+        :param max_buffer: Spans kept while the writer is behind, newer spans are dropped beyond it
+        """
+        self.path = path
+        self.service_name = service_name
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        # Offset turning monotonic timestamps into Unix time
+        self._epoch_offset_ns = time.time_ns() - time.monotonic_ns()
+        self._buffer: List[Span] = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                return
+            self._buffer.append(span)
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self._write()
+        self._write()
+
+    def _to_otlp(self, span: Span) -> Dict[str, Any]:
+        otlp = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': 1,  # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': str(span.start_ns + self._epoch_offset_ns),
+            'endTimeUnixNano': str(span.end_ns + self._epoch_offset_ns),
+            'attributes': [_otlp_attribute(key, value) for key, value in span.attributes.items()],
+            'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+        }
+        if span.parent_id:
+            otlp['parentSpanId'] = span.parent_id
+        return otlp
+
+    def _write(self):
+        with self._lock:
+            spans, self._buffer = self._buffer, []
+        if not spans:
+            return
+
+        document = {'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', self.service_name),
+                                        _otlp_attribute('process.pid', os.getpid())]},
+            'scopeSpans': [{'scope': {'name': 'chatbot.tracing'},
+                            'spans': [self._to_otlp(span) for span in spans]}]
+        }]}
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(document, ensure_ascii=False) + '\n')
+        except OSError as e:
+            logger.error("Error writing traces to %s: %s", self.path, e)
+
+    def close(self):
+        """
+        Write the remaining spans and stop the writer thread
+        """
+        self._stopping.set()
+        self._thread.join(timeout=5)
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+# Shared tracer used by all instrumented modules
+TRACER = Tracer()
+
+
+def configure_tracing(enabled: bool = True, export_file: Optional[str] = None, service_name: str = 'chatbot'):
+    """
+    Configure the shared tracer
+    :param enabled: Whether spans are recorded
+    :param export_file: File to export spans to in OTLP/JSON, None for histograms only
+    :param service_name: service.name of exported spans
+    """
+    TRACER.enabled = enabled
+    TRACER.set_exporter(JsonFileExporter(export_file, service_name) if enabled and export_file else None)
@@ -1,7 +1,9 @@
 import json
-from typing import Dict, List, Any, Optional
-import firebase_admin
-from firebase_admin import firestore
+from typing import TYPE_CHECKING, Dict, List, Any, Optional
+
+if TYPE_CHECKING:
+    # Only for annotations, firebase_admin is imported when Firestore is first connected
+    from firebase_admin import firestore
 import re
 
 def is_recommendation_request(message: str) -> bool:
@@ -82,7 +84,7 @@ def format_activity_for_db(activity: Dict[str, Any]) -> Dict[str, Any]:
     
     return activity
 
-def save_activity_to_db(db: firestore.Client, activity: Dict[str, Any]) -> bool:
+def save_activity_to_db(db: 'firestore.Client', activity: Dict[str, Any]) -> bool:
     """
     Save activity to Firestore database
     :param db: Firestore database instance
@@ -98,7 +100,7 @@ def save_activity_to_db(db: firestore.Client, activity: Dict[str, Any]) -> bool:
         print(f"Error saving activity to database: {str(e)}")
         return False
 
-def search_activities_in_db(db: firestore.Client, 
+def search_activities_in_db(db: 'firestore.Client', 
                           interests: List[str], 
                           categories: List[str] = None) -> List[Dict[str, Any]]:
     """
@@ -119,6 +121,7 @@ def search_activities_in_db(db: firestore.Client,
         
         # Add category filter if provided
         if categories:
+            from firebase_admin import firestore
             query = query.where(filter=firestore.FieldFilter('category', 'in', categories))
         
         # Get all activities
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Largest request body accepted; Telegram updates are far smaller
+MAX_BODY_BYTES = 1024 * 1024
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+
+
+class WebhookServer:
+    """
+    Minimal asyncio HTTP server for Telegram webhooks, health checks and metrics.
+
+    Runs its own event loop in a background thread. POSTs to the webhook path
+    are parsed and handed to ``on_update`` and acknowledged right away, so
+    Telegram never waits for the reply to be generated. ``/health`` and
+    ``/metrics`` are served in every mode, so the container health check
+    also works while the bot is long polling.
+    """
+
+    def __init__(self,
+                 host: str = '0.0.0.0',
+                 port: int = 8080,
+                 webhook_path: Optional[str] = None,
+                 on_update: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 health: Optional[Callable[[], Dict[str, Any]]] = None,
+                 metrics: Optional[Callable[[], Tuple[str, str]]] = None,
+                 idle_timeout: float = 75.0):
+        """
+        Initialize the server
+        :param host: Address to listen on
+        :param port: Port to listen on
+        :param webhook_path: Path Telegram posts updates to, None to disable the webhook
+        :param on_update: Called on the event loop with each decoded update, must not block
+        :param health: Returns health details; a 'status' other than 'ok' answers 503
+        :param metrics: Returns (content type, body) for /metrics
+        :param idle_timeout: Seconds an idle keep-alive connection stays open
+        """
+        self.host = host
+        self.port = port
+        self.webhook_path = webhook_path
+        self.on_update = on_update
+        self.health = health
+        self.metrics = metrics
+        self.idle_timeout = idle_timeout
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
+        self._start_error: Optional[BaseException] = None
+
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'updates': 0, 'bad_requests': 0, 'errors': 0}
+
+    def start(self):
+        """
+        Start serving in a background thread
+        :raises OSError: The port could not be bound
+        """
+        self._thread = threading.Thread(target=self._run, name='webhook-server', daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if self._start_error is not None:
+            raise self._start_error
+        logging.info("HTTP server listening on %s:%d%s", self.host, self.port,
+                     f", webhook at {self.webhook_path}" if self.webhook_path else "")
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle_connection, self.host, self.port))
+        except BaseException as e:
+            self._start_error = e
+            self._started.set()
+            self._loop.close()
+            return
+
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            # Close idle keep-alive connections, then wait for the server to finish
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+    def stop(self):
+        """
+        Stop the server and its event loop
+        """
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get request statistics
+        :return: Request, update, bad request and error counts
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    await self._respond(writer, 400, keep_alive=False)
+                    break
+                method, target, version = parts
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' and (version == 'HTTP/1.1' or connection == 'keep-alive')
+
+                self._count('requests')
+                status, content_type, payload = self._route(method, target.split('?')[0], body)
+                await self._respond(writer, status, content_type, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Client went away, or the server is shutting down
+            pass
+        except Exception:
+            logging.exception("Error handling HTTP request")
+            self._count('errors')
+        finally:
+            writer.close()
+
+    def _route(self, method: str, path: str, body: bytes) -> Tuple[int, str, bytes]:
+        if self.webhook_path and path == self.webhook_path:
+            if method != 'POST':
+                return 405, 'text/plain', b'Method Not Allowed'
+            try:
+                update = json.loads(body)
+            except ValueError:
+                self._count('bad_requests')
+                return 400, 'text/plain', b'Invalid JSON'
+            try:
+                self.on_update(update)
+            except Exception:
+                logging.exception("Error queueing Telegram update")
+                self._count('errors')
+                return 500, 'text/plain', b'Error'
+            self._count('updates')
+            return 200, 'text/plain', b'OK'
+
+        if method != 'GET':
+            return 405, 'text/plain', b'Method Not Allowed'
+
+        if path == '/health':
+            details = self.health() if self.health else {'status': 'ok'}
+            status = 200 if details.get('status') == 'ok' else 503
+            return status, 'application/json', json.dumps(details).encode('utf-8')
+
+        if path == '/metrics' and self.metrics:
+            content_type, payload = self.metrics()
+            return 200, content_type, payload.encode('utf-8')
+
+        return 404, 'text/plain', b'Not Found'
+
+    async def _respond(self,
+                       writer: asyncio.StreamWriter,
+                       status: int,
+                       content_type: str = 'text/plain',
+                       payload: bytes = b'',
+                       keep_alive: bool = True):
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + payload)
+        await writer.drain()
@@ -0,0 +1,262 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Maximum operations in one Firestore WriteBatch
+FIRESTORE_BATCH_LIMIT = 500
+
+
+class WriteBehindQueue:
+    """
+    Background, batched writer for one Firestore collection.
+
+    ``put`` only queues the document and returns, so callers never wait on
+    Firestore. A flusher thread commits queued documents in WriteBatches of
+    up to ``batch_size``. A document queued again before it was written
+    replaces the older version, so each id is written once per flush.
+    Failed batches are queued again unless a newer version arrived, and
+    dropped after ``max_attempts`` tries.
+    """
+
+    def __init__(self,
+                 db,
+                 collection: str = 'Activities',
+                 flush_interval: float = 0.5,
+                 batch_size: int = FIRESTORE_BATCH_LIMIT,
+                 max_attempts: int = 3,
+                 on_persisted: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 on_error: Optional[Callable[[Exception], None]] = None):
+        """
+        Initialize the queue and start the flusher thread
+        :param db: Firestore database instance
+        :param collection: Collection the documents are written to
+        :param flush_interval: Seconds to wait for more documents before flushing
+        :param batch_size: Maximum documents per WriteBatch, at most 500
+        :param max_attempts: Tries per document before it is dropped
+        :param on_persisted: Called with (document id, data) after each document is committed
+        :param on_error: Called with the exception when a batch fails, e.g. to reconnect on auth errors
+        """
+        self.db = db
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.batch_size = min(batch_size, FIRESTORE_BATCH_LIMIT)
+        self.max_attempts = max_attempts
+        self.on_persisted = on_persisted
+        self.on_error = on_error
+
+        self._pending: 'OrderedDict[str, Tuple[Dict[str, Any], int]]' = OrderedDict()  # id -> (data, attempts)
+        self._condition = threading.Condition()
+        self._flushing = 0
+        self._flush_waiters = 0
+        self._closed = False
+        self._stats = {
+            'queued': 0, 'deduplicated': 0, 'written': 0, 'batches': 0,
+            'failed_batches': 0, 'dropped': 0,
+            'last_flush_latency': None, 'avg_flush_latency': None
+        }
+        self._thread = threading.Thread(target=self._run, name=f'write-behind-{collection}', daemon=True)
+        self._thread.start()
+
+    def put(self, doc_id: str, data: Dict[str, Any]):
+        """
+        Queue a document for writing
+        :param doc_id: Document id
+        :param data: Document data
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Write-behind queue is closed")
+            if doc_id in self._pending:
+                del self._pending[doc_id]
+                self._stats['deduplicated'] += 1
+            self._pending[doc_id] = (data, 0)
+            self._stats['queued'] += 1
+            self._condition.notify()
+
+    def _take_batch(self) -> List[Tuple[str, Dict[str, Any], int]]:
+        # Caller holds the condition lock
+        batch = []
+        while self._pending and len(batch) < self.batch_size:
+            doc_id, (data, attempts) = self._pending.popitem(last=False)
+            batch.append((doc_id, data, attempts))
+        self._flushing += len(batch)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending and self._closed:
+                    return
+                # Give related writes a moment to join the batch
+                deadline = time.monotonic() + self.flush_interval
+                while not self._closed and not self._flush_waiters and len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._take_batch()
+
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, batch: List[Tuple[str, Dict[str, Any], int]]):
+        start = time.monotonic()
+        try:
+            write_batch = self.db.batch()
+            collection_ref = self.db.collection(self.collection)
+            for doc_id, data, _ in batch:
+                write_batch.set(collection_ref.document(doc_id), data)
+            write_batch.commit()
+        except Exception as e:
+            logger.error("Error writing %d documents to %s: %s", len(batch), self.collection, e)
+            if self.on_error is not None:
+                self.on_error(e)
+            with self._condition:
+                self._stats['failed_batches'] += 1
+                for doc_id, data, attempts in batch:
+                    if doc_id in self._pending:
+                        # A newer version is already queued
+                        continue
+                    if attempts + 1 >= self.max_attempts:
+                        self._stats['dropped'] += 1
+                        continue
+                    self._pending[doc_id] = (data, attempts + 1)
+                self._flushing -= len(batch)
+                self._condition.notify_all()
+            if not self._closed:
+                # Do not hammer a failing backend
+                time.sleep(self.flush_interval)
+            return
+
+        latency = time.monotonic() - start
+        if self.on_persisted is not None:
+            for doc_id, data, _ in batch:
+                try:
+                    self.on_persisted(doc_id, data)
+                except Exception as e:
+                    logger.error("Error after writing %s: %s", doc_id, e)
+
+        with self._condition:
+            self._stats['written'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['last_flush_latency'] = latency
+            average = self._stats['avg_flush_latency']
+            self._stats['avg_flush_latency'] = latency if average is None else average + 0.1 * (latency - average)
+            self._flushing -= len(batch)
+            self._condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until everything queued so far is written or dropped
+        :param timeout: Maximum seconds to wait, None to wait indefinitely
+        :return: True if the queue drained in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._flush_waiters += 1
+            self._condition.notify_all()
+            try:
+                while self._pending or self._flushing:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                return True
+            finally:
+                self._flush_waiters -= 1
+
+    def close(self, timeout: Optional[float] = 30.0) -> bool:
+        """
+        Stop accepting documents and write out the queued ones
+        :param timeout: Maximum seconds to wait for the final flush
+        :return: True if everything queued was written or dropped in time
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        with self._condition:
+            left = len(self._pending) + self._flushing
+        if left:
+            logger.warning("Write-behind queue closed with %d unwritten documents", left)
+        return not left
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get queue statistics
+        :return: Queue depth, write and failure counters and flush latency in seconds
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            stats['queue_depth'] = len(self._pending)
+            stats['in_flight'] = self._flushing
+        return stats
+
+
+_queues: Dict[Tuple[int, str], WriteBehindQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_write_behind(db,
+                     collection: str = 'Activities',
+                     on_persisted: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                     on_error: Optional[Callable[[Exception], None]] = None,
+                     **settings) -> WriteBehindQueue:
+    """
+    Get the write-behind queue for a Firestore client and collection, starting it on first use
+    :param db: Firestore database instance
+    :param collection: Collection the documents are written to
+    :param on_persisted: Called after each document is committed, only used on first call
+    :param on_error: Called when a batch fails, only used on first call
+    :param settings: WriteBehindQueue arguments, only used on first call
+    :return: WriteBehindQueue instance
+    """
+    with _queues_lock:
+        key = (id(db), collection)
+        writer = _queues.get(key)
+        if writer is None:
+            writer = _queues[key] = WriteBehindQueue(db, collection, on_persisted=on_persisted,
+                                                            on_error=on_error, **settings)
+        return writer
+
+
+def retarget_write_behind(old_db, new_db):
+    """
+    Move the queues of a replaced Firestore client to its successor, keeping what they hold
+    :param old_db: Firestore database instance being replaced
+    :param new_db: Firestore database instance taking over
+    """
+    with _queues_lock:
+        for (db_id, collection), writer in list(_queues.items()):
+            if db_id == id(old_db):
+                del _queues[(db_id, collection)]
+                # Read by the flusher on every commit
+                writer.db = new_db
+                _queues[(id(new_db), collection)] = writer
+
+
+def write_behind_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Get statistics of all running queues
+    :return: Statistics per collection
+    """
+    with _queues_lock:
+        return {writer.collection: writer.stats() for writer in _queues.values()}
+
+
+def close_write_behind(timeout: Optional[float] = 30.0):
+    """
+    Flush and stop all queues
+    :param timeout: Maximum seconds to wait for each queue
+    """
+    with _queues_lock:
+        writers = list(_queues.values())
+        _queues.clear()
+    for writer in writers:
+        writer.close(timeout)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The bot modules are flat files in codebase/, imported by name as in the Docker image
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'codebase'))
@@ -0,0 +1,136 @@
+import threading
+import time
+
+import pytest
+
+import activity_cache
+from activity_cache import ActivityReplica, FirestoreChangeSource, LocalChangeSource
+
+
+def activity(name, category='Sports', keywords=('football',)):
+    return {'name': name, 'category': category, 'description': f'{name} for everyone', 'keywords': list(keywords)}
+
+
+class FakeWatch:
+    def __init__(self):
+        self.is_active = True
+        self.unsubscribed = False
+
+    def unsubscribe(self):
+        self.unsubscribed = True
+        self.is_active = False
+
+
+class FakeCollection:
+    """
+    Collection whose snapshot listeners are driven by the test
+    """
+
+    def __init__(self):
+        self.callbacks = []
+        self.watches = []
+
+    def on_snapshot(self, callback):
+        self.callbacks.append(callback)
+        self.watches.append(FakeWatch())
+        return self.watches[-1]
+
+
+class FakeDb:
+    def __init__(self):
+        self.activities = FakeCollection()
+
+    def collection(self, name):
+        return self.activities
+
+
+class FakeChange:
+    def __init__(self, type_name, doc_id, data):
+        self.type = type('ChangeType', (), {'name': type_name})
+        self.document = type('Document', (), {'id': doc_id, 'to_dict': lambda self: dict(data)})()
+
+
+def test_replica_applies_changes():
+    source = LocalChangeSource([('a', activity('a')), ('b', activity('b'))])
+    replica = ActivityReplica(source)
+    assert replica.start(timeout=0)
+    assert len(replica.index) == 2
+
+    source.modify('a', activity('a', keywords=('chess',)))
+    source.remove('b')
+    assert [a['name'] for a in replica.search(['chess'])] == ['a']
+    assert replica.index.get('b') is None
+    assert replica.stats()['modified'] == 1 and replica.stats()['removed'] == 1
+
+
+def test_resync_drops_documents_deleted_while_disconnected():
+    source = LocalChangeSource([('a', activity('a')), ('b', activity('b'))])
+    replica = ActivityReplica(source)
+    replica.start(timeout=0)
+
+    source.resync([('a', activity('a')), ('c', activity('c'))])
+    assert sorted(replica.index.ids()) == ['a', 'c']
+    assert replica.stats()['resyncs'] == 1
+
+
+def test_listener_restarts_after_stream_failure():
+    db = FakeDb()
+    source = FirestoreChangeSource(db, check_interval=0.01)
+    replica = ActivityReplica(source)
+    source.start(replica._apply)
+    db.activities.callbacks[0](None, [FakeChange('ADDED', 'a', activity('a')),
+                                      FakeChange('ADDED', 'b', activity('b'))], None)
+
+    # The stream fails for good, the supervisor opens a new listener
+    db.activities.watches[0].is_active = False
+    deadline = time.monotonic() + 2
+    while len(db.activities.callbacks) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(db.activities.callbacks) == 2
+    assert source.restarts == 1
+
+    # Its first snapshot is the whole collection, b was deleted meanwhile
+    db.activities.callbacks[1](None, [FakeChange('ADDED', 'a', activity('a'))], None)
+    assert replica.index.ids() == ['a']
+    source.stop()
+    assert db.activities.watches[1].unsubscribed
+
+
+def test_seed_wait_does_not_block_other_callers():
+    db = FakeDb()
+    started = threading.Event()
+
+    def first_caller():
+        started.set()
+        activity_cache.get_activity_replica(db, timeout=1.0)
+
+    thread = threading.Thread(target=first_caller)
+    thread.start()
+    started.wait()
+    time.sleep(0.05)
+    try:
+        # The seed never arrives, the first caller is still waiting
+        begin = time.monotonic()
+        activity_cache.activity_replica_stats()
+        activity_cache.get_activity_replica(db, timeout=0).upsert('a', activity('a'))
+        assert time.monotonic() - begin < 0.5
+    finally:
+        thread.join()
+        activity_cache.stop_activity_replicas()
+
+
+class UnreachableDb:
+    def collection(self, name):
+        raise RuntimeError('unavailable')
+
+
+def test_failed_replicas_are_not_kept():
+    db = UnreachableDb()
+    for _ in range(2):
+        begin = time.monotonic()
+        with pytest.raises(RuntimeError):
+            activity_cache.get_activity_replica(db, timeout=5.0)
+        assert time.monotonic() - begin < 1.0
+    assert activity_cache.activity_replica_stats() == {}
+    with pytest.raises(RuntimeError):
+        activity_cache.get_activity_replica(None)
@@ -0,0 +1,68 @@
+import threading
+
+from ChatGPT_HKBU import HKBU_ChatGPT
+from conversation import ConversationStore
+from response_cache import MemoryCacheBackend, ResponseCache
+from singleflight import SingleFlight
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.timing = {'connect': 0.0, 'ttfb': len(reply)}
+
+    def json(self):
+        return {'choices': [{'message': {'content': self.reply}}]}
+
+
+def chatgpt_without_config():
+    chatgpt = HKBU_ChatGPT.__new__(HKBU_ChatGPT)
+    chatgpt.basic_url = chatgpt.model_name = chatgpt.api_version = chatgpt.access_token = ''
+    chatgpt._timing = threading.local()
+    return chatgpt
+
+
+def test_timing_belongs_to_the_calling_threads_request():
+    chatgpt = chatgpt_without_config()
+    both_sent = threading.Barrier(2)
+
+    def post_upstream(url, payload, headers, stream=False):
+        both_sent.wait(5)
+        return Response(payload['messages'][-1]['content']), None
+
+    chatgpt._post_upstream = post_upstream
+    timings = {}
+
+    def ask(message):
+        chatgpt._get_chatgpt_response(message)
+        both_sent.wait(5)
+        timings[message] = chatgpt.last_timing
+
+    threads = [threading.Thread(target=ask, args=(message,)) for message in ('hi', 'hello there')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert timings == {'hi': {'connect': 0.0, 'ttfb': 2}, 'hello there': {'connect': 0.0, 'ttfb': 11}}
+    assert chatgpt.last_timing is None
+
+
+def test_follow_ups_are_not_cached_or_coalesced():
+    chatgpt = chatgpt_without_config()
+    chatgpt.conversations = ConversationStore(background=False)
+    chatgpt.response_cache = ResponseCache(MemoryCacheBackend())
+    chatgpt.single_flight = SingleFlight()
+    sent = []
+
+    def post_upstream(url, payload, headers, stream=False):
+        sent.append(len(payload['messages']))
+        return Response(f"reply {len(sent)}"), None
+
+    chatgpt._post_upstream = post_upstream
+    assert chatgpt.submit('tell me a joke', 'u1') == 'reply 1'
+    assert chatgpt.submit('tell me a joke', 'u2') == 'reply 1'  # First messages share the cache
+    assert chatgpt.submit('another one', 'u1') == 'reply 2'
+    assert chatgpt.submit('another one', 'u2') == 'reply 3'
+    assert sent == [1, 3, 3]
@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+
+import clients
+from clients import ClientRegistry, is_auth_error
+from lazy_firestore import FAILED, PENDING, READY
+
+
+class FakeClient:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeFirestore:
+    """
+    LazyFirestore stand-in whose reconnects never finish on their own
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.status = READY
+        self.reconnects = 0
+        self._lock = threading.Lock()
+
+    def reconnect(self):
+        with self._lock:
+            if self.status not in (READY, FAILED):
+                return None
+            previous, self.client = self.client, None
+            self.status = PENDING
+            self.reconnects += 1
+        return previous
+
+    def stats(self):
+        return {'status': self.status, 'reconnects': self.reconnects}
+
+
+class RefreshError(Exception):
+    pass
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    retargeted = []
+    monkeypatch.setattr(clients, 'retarget_write_behind', lambda old, new: retargeted.append((old, new)))
+    monkeypatch.setattr(clients, 'stop_activity_replicas', lambda: None)
+    registry = ClientRegistry()
+    registry.retargeted = retargeted
+    return registry
+
+
+def test_auth_errors_are_recognized():
+    assert is_auth_error(RefreshError('token expired'))
+    assert is_auth_error(Exception("('invalid_grant: Invalid JWT Signature.', {})"))
+    assert not is_auth_error(TimeoutError('deadline exceeded'))
+
+
+def test_concurrent_reconnects_retarget_the_old_client_once(registry):
+    old, new = FakeClient('old'), FakeClient('new')
+    registry._firestore = FakeFirestore(old)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def reconnect(i):
+        barrier.wait()
+        if i % 2:
+            results.append(registry.reconnect_firestore(force=True))
+        else:
+            results.append(registry.report_error(RefreshError('invalid_grant')))
+
+    threads = [threading.Thread(target=reconnect, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 1
+    registry._connected(new)
+    assert registry.retargeted == [(old, new)]
+    assert old.closed and not new.closed
+
+
+def test_reconnect_after_a_failed_connection_keeps_the_client_to_retarget(registry):
+    old, new = FakeClient('old'), FakeClient('new')
+    firestore = registry._firestore = FakeFirestore(old)
+    assert registry.reconnect_firestore(force=True)
+
+    # The new connection fails; the next reconnect has no client of its own to drop
+    firestore.status = FAILED
+    assert registry.reconnect_firestore(force=True)
+    registry._connected(new)
+    assert registry.retargeted == [(old, new)]
+
+
+def test_reconnects_are_rate_limited(registry):
+    firestore = registry._firestore = FakeFirestore(FakeClient('old'))
+    assert registry.report_error(RefreshError('invalid_grant'))
+    firestore.status = READY
+    assert not registry.report_error(RefreshError('invalid_grant'))
+    assert not registry.report_error(TimeoutError('deadline exceeded'))
+    assert registry.health()['firestore']['auth_errors'] == 2
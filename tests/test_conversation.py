@@ -0,0 +1,61 @@
+import threading
+
+from conversation import ConversationStore, estimate_tokens
+
+
+def totals(store):
+    conversations = store._conversations.values()
+    return sum(len(c.turns) for c in conversations), sum(c.tokens + c.summary_tokens for c in conversations)
+
+
+def test_history_stays_within_token_budget():
+    store = ConversationStore(max_turns=20, token_budget=60)
+    for i in range(10):
+        store.record_exchange('u1', f"message number {i} " * 3, f"reply number {i} " * 3)
+
+    history = store.history('u1')
+    assert sum(estimate_tokens(m['content']) for m in history) <= 60
+    assert history[-1]['content'].startswith('reply number 9')
+    assert store.stats()['truncated_turns'] > 0
+
+
+def test_running_totals_match_the_conversations():
+    store = ConversationStore(max_turns=4, token_budget=50, max_users=3,
+                              summarizer=lambda previous, turns: 'short summary', background=False)
+    for i in range(12):
+        store.record_exchange(f'u{i % 5}', 'hello ' * i, 'hi there ' * i)
+    store.clear('u1')
+
+    stats = store.stats()
+    assert stats['conversations'] == 2
+    assert (stats['turns'], stats['tokens']) == totals(store)
+
+
+def test_summaries_are_written_off_the_reply_path():
+    release = threading.Event()
+    calls = []
+
+    def summarizer(previous, turns):
+        calls.append((previous, turns))
+        release.wait(5)
+        return f"summary {len(calls)}"
+
+    store = ConversationStore(max_turns=2, token_budget=1000, summarizer=summarizer)
+    store.record_exchange('u1', 'first', 'one')
+    # Pushes the first exchange out of the ring buffer; returns while the summarizer is still blocked
+    store.record_exchange('u1', 'second', 'two')
+    assert store.history('u1')[0]['content'] == 'second'
+
+    release.set()
+    store._executor.shutdown(wait=True)
+    assert calls == [('', [('user', 'first'), ('assistant', 'one')])]
+    assert store.history('u1')[0] == {'role': 'system', 'content': 'Summary of the earlier conversation: summary 1'}
+    assert (store.stats()['turns'], store.stats()['tokens']) == totals(store)
+
+
+def test_idle_conversations_are_evicted():
+    store = ConversationStore(idle_ttl=0)
+    store.record_exchange('u1', 'hello', 'hi')
+    assert store.history('u1') == []
+    assert store.stats() == {'conversations': 0, 'turns': 0, 'tokens': 0, 'evictions': 1,
+                             'truncated_turns': 0, 'summaries': 0}
@@ -0,0 +1,95 @@
+import db_manager
+from db_manager import DatabaseManager
+from storage import FirestoreActivityStore
+
+
+class FakeRef:
+    def __init__(self, db, doc_id):
+        self.db = db
+        self.id = doc_id
+
+    def set(self, data):
+        self.db.documents[self.id] = dict(data)
+
+    def update(self, data):
+        self.db.documents[self.id].update(data)
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, exists):
+        self.id = doc_id
+        self.exists = exists
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.operations = []
+
+    def set(self, ref, data):
+        self.operations.append((ref.set, data))
+
+    def update(self, ref, data):
+        self.operations.append((ref.update, data))
+
+    def commit(self):
+        for write, data in self.operations:
+            write(data)
+
+
+class FakeCollection:
+    def __init__(self, db):
+        self.db = db
+
+    def document(self, doc_id):
+        return FakeRef(self.db, doc_id)
+
+
+class FakeDb:
+    def __init__(self, documents=None, get_all_failures=0):
+        self.documents = dict(documents or {})
+        self.get_all_failures = get_all_failures
+
+    def collection(self, name):
+        return FakeCollection(self)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, refs):
+        if self.get_all_failures:
+            self.get_all_failures -= 1
+            raise RuntimeError('deadline exceeded')
+        return [FakeSnapshot(ref.id, ref.id in self.documents) for ref in refs]
+
+
+class FakeDatabase:
+    def __init__(self, db):
+        self.db = db
+
+    def get(self, timeout=None):
+        return self.db
+
+
+def manager_for(db, monkeypatch):
+    monkeypatch.setattr(db_manager.time, 'sleep', lambda seconds: None)
+    manager = DatabaseManager(store=FirestoreActivityStore(lambda: db))
+    manager.database = FakeDatabase(db)
+    return manager
+
+
+ACTIVITIES = [{'name': 'Chess Club', 'description': 'new'}, {'name': 'Go Club', 'description': 'new'}]
+
+
+def test_existence_check_is_retried(monkeypatch):
+    db = FakeDb({'Chess Club': {'name': 'Chess Club', 'description': 'old', 'link': 'kept'}}, get_all_failures=2)
+    stats = manager_for(db, monkeypatch).merge_activities(ACTIVITIES, max_retries=3)
+    assert stats == {'created': 1, 'updated': 1, 'skipped': 0, 'failed': 0}
+    assert db.documents['Chess Club']['description'] == 'new'
+
+
+def test_chunk_fails_without_writing_when_existence_is_unknown(monkeypatch):
+    db = FakeDb({'Chess Club': {'name': 'Chess Club', 'description': 'old'}}, get_all_failures=10)
+    stats = manager_for(db, monkeypatch).merge_activities(ACTIVITIES, merge_strategy='skip', max_retries=2)
+    assert stats == {'created': 0, 'updated': 0, 'skipped': 0, 'failed': 2}
+    assert db.documents == {'Chess Club': {'name': 'Chess Club', 'description': 'old'}}
@@ -0,0 +1,166 @@
+import time
+
+import pytest
+import requests
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, ResilientClient, TokenBucket, parse_retry_after
+
+
+class FakeTime:
+    """
+    Stand-in for the time module, sleeping advances the clock
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(resilience, 'time', fake)
+    return fake
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeHTTP:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def post(self, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return Response(*outcome) if isinstance(outcome, tuple) else Response(outcome)
+
+
+def test_bucket_halves_on_throttling_and_recovers_additively(clock):
+    bucket = TokenBucket(rate=10, capacity=2)
+    bucket.throttled()
+    assert bucket.rate == 5
+    bucket.throttled()
+    assert bucket.rate == 2.5
+
+    for _ in range(15):
+        bucket.succeeded()
+    assert bucket.rate == 10  # Capped at the quota
+
+    for _ in range(10):
+        bucket.throttled()
+    assert bucket.rate == bucket.min_rate == 1
+
+
+def test_bucket_waits_for_refill(clock):
+    bucket = TokenBucket(rate=4, capacity=2)
+    assert bucket.acquire() and bucket.acquire()
+    assert not bucket.acquire(timeout=0)
+    assert bucket.acquire(timeout=1)
+    assert clock.now == pytest.approx(1000.25)
+
+
+def test_breaker_opens_probes_and_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+    assert breaker.retry_in() == 30
+
+    clock.now += 30
+    assert breaker.allow()  # The probe
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # Only one probe at a time
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+
+def test_cancelled_probe_lets_the_next_call_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=1)
+    breaker.record_failure()
+    clock.now += 1
+    assert breaker.allow()
+    breaker.cancel()
+    assert breaker.allow()
+
+
+def test_retries_server_errors_with_backoff(clock, monkeypatch):
+    monkeypatch.setattr(resilience.random, 'uniform', lambda low, high: high)
+    http = FakeHTTP([503, requests.ConnectionError('reset'), 200])
+    client = ResilientClient(http, backoff_base=0.5)
+
+    assert client.post('https://api').status_code == 200
+    assert clock.sleeps == [0.5, 1.0]
+    stats = client.stats()
+    assert (stats['attempts'], stats['retries'], stats['server_errors'], stats['network_errors']) == (3, 2, 1, 1)
+    assert stats['circuit'] == 'closed'
+
+
+def test_throttling_honours_retry_after_and_slows_down(clock):
+    http = FakeHTTP([(429, {'Retry-After': '3'}), 200])
+    client = ResilientClient(http, rate=10)
+
+    assert client.post('https://api').status_code == 200
+    assert 3 in clock.sleeps
+    assert client.stats()['throttled'] == 1
+    assert client.bucket.rate < 10
+
+
+def test_gives_up_on_long_retry_after(clock):
+    http = FakeHTTP([(429, {'Retry-After': '120'})])
+    client = ResilientClient(http, max_retry_after=30)
+    assert client.post('https://api').status_code == 429
+    assert http.calls == 1 and client.stats()['gave_up'] == 1
+
+
+def test_open_circuit_rejects_without_calling(clock):
+    http = FakeHTTP([500, 500])
+    client = ResilientClient(http, max_retries=1, failure_threshold=2)
+    assert client.post('https://api').status_code == 500
+    with pytest.raises(CircuitOpenError):
+        client.post('https://api')
+    assert http.calls == 2
+    assert client.stats()['circuit_rejected'] == 1
+
+
+def test_client_errors_do_not_count_against_the_circuit(clock):
+    http = FakeHTTP([400] * 6)
+    client = ResilientClient(http, failure_threshold=2)
+    for _ in range(6):
+        assert client.post('https://api').status_code == 400
+    assert client.stats()['circuit'] == 'closed'
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('2.5') == 2.5
+    assert parse_retry_after('-1') == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
@@ -0,0 +1,22 @@
+from response_cache import RecommendationCache, make_cache_key, make_recommendation_key
+
+
+def test_persisting_an_activity_drops_the_entries_holding_it():
+    cache = RecommendationCache()
+    chess = {'name': 'Chess Club', 'category': 'Games'}
+    cache.set(make_recommendation_key(['chess'], []), [chess])
+    cache.set(make_recommendation_key(['hiking'], []), [{'name': 'Hiking Group'}])
+    cache.set(make_recommendation_key(['knitting'], []), [])
+
+    # The same version as cached, entries holding it still go
+    cache.invalidate_activity(dict(chess))
+    assert cache.get(make_recommendation_key(['chess'], [])) is None
+    assert cache.get(make_recommendation_key(['knitting'], [])) is None
+    assert cache.get(make_recommendation_key(['hiking'], [])) == [{'name': 'Hiking Group'}]
+    assert cache.stats()['invalidations'] == 2
+
+
+def test_only_prompts_without_history_get_a_cache_key():
+    key = make_cache_key('  Hello ', 'gpt', 'v1')
+    assert key == make_cache_key('hello', 'gpt', 'v1', [])
+    assert make_cache_key('hello', 'gpt', 'v1', [{'role': 'user', 'content': 'hi'}]) is None
@@ -0,0 +1,131 @@
+import threading
+import time
+
+from scheduler import FAST_LANE, SLOW_LANE, FairScheduler
+
+
+class Recorder:
+    """
+    Jobs that record when they start and block until released
+    """
+
+    def __init__(self):
+        self.started = []
+        self.events = {}
+        self._lock = threading.Lock()
+
+    def job(self, name, block=False):
+        release = self.events[name] = threading.Event()
+        if not block:
+            release.set()
+
+        def run():
+            with self._lock:
+                self.started.append(name)
+            release.wait(5)
+
+        return run
+
+    def wait_started(self, name, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while name not in self.started and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return name in self.started
+
+
+def test_expensive_job_starts_while_another_user_is_busy():
+    # Stall reported in review: a busy user in the rotation made pop give up
+    # before the expensive head job of an idle user had enough credit
+    scheduler = FairScheduler(workers=2, quantum=200)
+    jobs = Recorder()
+    try:
+        scheduler.submit('B', jobs.job('b1', block=True), SLOW_LANE, cost=10)
+        assert jobs.wait_started('b1')
+        scheduler.submit('B', jobs.job('b2'), SLOW_LANE, cost=10)
+        scheduler.submit('N', jobs.job('n1'), SLOW_LANE, cost=250)
+
+        assert jobs.wait_started('n1')
+        assert 'b2' not in jobs.started
+    finally:
+        jobs.events['b1'].set()
+        scheduler.shutdown(wait=True)
+    assert jobs.started == ['b1', 'n1', 'b2']
+
+
+def test_users_take_turns():
+    scheduler = FairScheduler(workers=1, quantum=1)
+    jobs = Recorder()
+    try:
+        scheduler.submit('X', jobs.job('blocker', block=True))
+        assert jobs.wait_started('blocker')
+        for i in range(4):
+            scheduler.submit('A', jobs.job(f'a{i}'))
+        scheduler.submit('B', jobs.job('b0'))
+        scheduler.submit('C', jobs.job('c0'))
+    finally:
+        jobs.events['blocker'].set()
+        scheduler.shutdown(wait=True)
+    assert jobs.started == ['blocker', 'a0', 'b0', 'c0', 'a1', 'a2', 'a3']
+
+
+def test_costly_jobs_get_fewer_turns():
+    scheduler = FairScheduler(workers=1, quantum=100)
+    jobs = Recorder()
+    try:
+        scheduler.submit('X', jobs.job('blocker', block=True))
+        assert jobs.wait_started('blocker')
+        for i in range(2):
+            scheduler.submit('big', jobs.job(f'big{i}'), cost=300)
+        for i in range(4):
+            scheduler.submit('small', jobs.job(f'small{i}'), cost=100)
+    finally:
+        jobs.events['blocker'].set()
+        scheduler.shutdown(wait=True)
+    # The big user needs three rounds of credit per job
+    assert jobs.started.index('big0') > jobs.started.index('small1')
+
+
+def test_fast_lane_goes_first_between_users():
+    scheduler = FairScheduler(workers=1)
+    jobs = Recorder()
+    try:
+        scheduler.submit('X', jobs.job('blocker', block=True))
+        assert jobs.wait_started('blocker')
+        scheduler.submit('A', jobs.job('slow'), SLOW_LANE)
+        scheduler.submit('B', jobs.job('fast'), FAST_LANE)
+    finally:
+        jobs.events['blocker'].set()
+        scheduler.shutdown(wait=True)
+    assert jobs.started == ['blocker', 'fast', 'slow']
+
+
+def test_a_users_jobs_keep_their_order_across_lanes():
+    scheduler = FairScheduler(workers=2)
+    jobs = Recorder()
+    try:
+        scheduler.submit('X', jobs.job('blocker', block=True))
+        scheduler.submit('Y', jobs.job('blocker2', block=True))
+        assert jobs.wait_started('blocker') and jobs.wait_started('blocker2')
+        scheduler.submit('U', jobs.job('chat'), SLOW_LANE)
+        scheduler.submit('U', jobs.job('recommendation'), FAST_LANE)
+    finally:
+        jobs.events['blocker'].set()
+        jobs.events['blocker2'].set()
+        scheduler.shutdown(wait=True)
+    assert jobs.started.index('chat') < jobs.started.index('recommendation')
+
+
+def test_jobs_past_their_deadline_are_shed():
+    scheduler = FairScheduler(workers=1, fast_deadline=0.01)
+    jobs = Recorder()
+    shed = []
+    try:
+        scheduler.submit('X', jobs.job('blocker', block=True))
+        assert jobs.wait_started('blocker')
+        scheduler.submit('A', jobs.job('late'), FAST_LANE, on_shed=lambda: shed.append('late'))
+        time.sleep(0.05)
+    finally:
+        jobs.events['blocker'].set()
+        scheduler.shutdown(wait=True)
+    assert shed == ['late'] and 'late' not in jobs.started
+    assert scheduler.stats()['lanes'][FAST_LANE]['shed'] == 1
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def run_together(flight, key, func, callers):
+    """
+    Start callers that join the same in-flight call, return their results or exceptions
+    """
+    results = [None] * callers
+    leader_started = threading.Event()
+
+    def leader():
+        leader_started.set()
+        return func()
+
+    def caller(i):
+        try:
+            results[i] = flight.do(key, leader if i == 0 else func)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=caller, args=(0,))]
+    threads[0].start()
+    leader_started.wait()
+    threads += [threading.Thread(target=caller, args=(i,)) for i in range(1, callers)]
+    for thread in threads[1:]:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    executions = []
+
+    def func():
+        executions.append(1)
+        release.wait(5)
+        return 'reply'
+
+    threads, results = run_together(flight, 'prompt', func, 5)
+    while flight.stats()['coalesced'] < 4:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == ['reply'] * 5
+    assert len(executions) == 1
+    stats = flight.stats()
+    assert (stats['executions'], stats['coalesced'], stats['in_flight']) == (1, 4, 0)
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def func():
+        release.wait(5)
+        raise RuntimeError('upstream failed')
+
+    threads, results = run_together(flight, 'prompt', func, 3)
+    while flight.stats()['coalesced'] < 2:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flight.stats()['errors'] == 1
+
+
+def test_finished_calls_are_not_reused():
+    flight = SingleFlight()
+    assert flight.do('key', lambda: 1) == 1
+    assert flight.do('key', lambda: 2) == 2
+    assert flight.stats()['executions'] == 2
+
+
+def test_wait_times_out():
+    flight = SingleFlight()
+    call, leader = flight.acquire('key')
+    assert leader
+    joined, leader = flight.acquire('key')
+    assert joined is call and not leader
+    with pytest.raises(TimeoutError):
+        flight.wait(joined, timeout=0.01)
+    flight.release('key', call, 'done')
+    assert flight.wait(joined) == 'done'
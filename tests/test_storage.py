@@ -0,0 +1,144 @@
+import threading
+
+from activity_cache import RESET, ActivityReplica, LocalChangeSource
+from activity_index import ActivityIndex
+from lazy_firestore import CONNECTING, DISABLED, LazyFirestore
+from storage import FirestoreActivityStore, SQLiteActivityStore
+
+CATALOG = [
+    {'name': 'Football League', 'category': 'Sports', 'description': 'Weekly football games in the park',
+     'keywords': ['football', 'team', 'outdoor']},
+    {'name': 'Five-a-side', 'category': 'Sports', 'description': 'Small football matches',
+     'keywords': ['football']},
+    {'name': 'Chess Club', 'category': 'Games', 'description': 'Chess and board games every Friday',
+     'keywords': ['chess', 'board games', 'strategy']},
+    {'name': 'Football Quiz Night', 'category': 'Social', 'description': 'Quiz about football history',
+     'keywords': ['quiz', 'football', 'pub']},
+    {'name': 'Hiking Group', 'category': 'Outdoor', 'description': 'Weekend hikes on the trails',
+     'keywords': ['hiking', 'outdoor', 'nature']},
+    {'name': 'Painting Workshop', 'category': 'Art', 'description': 'Watercolour painting for beginners',
+     'keywords': ['painting', 'art', 'watercolour']},
+]
+
+
+def stores():
+    sqlite_store = SQLiteActivityStore()
+    index = ActivityIndex()
+    for activity in CATALOG:
+        sqlite_store.put(activity)
+        index.upsert(activity['name'], activity)
+    return sqlite_store, index
+
+
+def names(activities):
+    return [activity['name'] for activity in activities]
+
+
+def test_single_term_searches_rank_like_the_in_memory_index():
+    sqlite_store, index = stores()
+    for interests, categories in [(['football'], None), (['games'], None), (['outdoor'], None),
+                                  (['football'], ['social']), (['football'], ['sport'])]:
+        assert names(sqlite_store.search(interests, categories, limit=10)) == \
+            names(index.rank(interests, categories, limit=10)), (interests, categories)
+
+
+def test_multi_term_searches_find_the_same_activities():
+    sqlite_store, index = stores()
+    for interests in (['football', 'chess'], ['outdoor hiking'], ['board games', 'painting']):
+        assert set(names(sqlite_store.search(interests, limit=10))) == set(names(index.rank(interests, limit=10)))
+
+
+def test_category_boost_puts_the_category_first():
+    sqlite_store, _ = stores()
+    assert names(sqlite_store.search(['football'], ['Social']))[0] == 'Football Quiz Night'
+    # User text is quoted, never read as FTS5 syntax
+    assert sqlite_store.search(['"football" OR'], None) != []
+
+
+def test_apply_changes_mirrors_a_replica():
+    sqlite_store, _ = stores()
+    sqlite_store.apply_changes([('MODIFIED', 'Chess Club', {'category': 'Games', 'keywords': ['go']}),
+                                ('REMOVED', 'Hiking Group', None),
+                                ('ADDED', 'Yoga', {'category': 'Fitness', 'keywords': ['yoga']})])
+    assert names(sqlite_store.search(['go'])) == ['Chess Club']
+    assert sqlite_store.search(['strategy']) == []
+    assert sqlite_store.get('Hiking Group') is None
+    assert sqlite_store.get('Yoga')['name'] == 'Yoga'
+
+    # A full snapshot drops what is not in it
+    sqlite_store.apply_changes([(RESET, '', None), ('ADDED', 'Yoga', {'category': 'Fitness', 'keywords': ['yoga']})])
+    assert names(sqlite_store.iter_all()) == ['Yoga']
+    assert sqlite_store.search(['football']) == []
+
+
+def test_replica_keeps_a_mirror_in_sync():
+    source = LocalChangeSource([(activity['name'], activity) for activity in CATALOG[:2]])
+    replica = ActivityReplica(source)
+    assert replica.start(timeout=0)
+
+    mirror = SQLiteActivityStore()
+    mirror.put({'name': 'Stale', 'keywords': ['football']})
+    replica.add_mirror(mirror)
+    assert names(mirror.iter_all()) == ['Five-a-side', 'Football League']
+
+    source.add('Chess Club', CATALOG[2])
+    source.remove('Five-a-side')
+    assert names(mirror.iter_all()) == ['Chess Club', 'Football League']
+    assert names(mirror.search(['football'])) == names(replica.rank(['football']))
+
+
+def test_schema_version_is_recorded(tmp_path):
+    path = str(tmp_path / 'activities.db')
+    SQLiteActivityStore(path).put({'name': 'Go Club', 'keywords': ['go']})
+    store = SQLiteActivityStore(path)
+    assert store._conn.execute('PRAGMA user_version').fetchone()[0] == 1
+    assert names(store.search(['go'])) == ['Go Club']
+
+
+class FakeWriter:
+    def __init__(self):
+        self.documents = {}
+
+    def put(self, doc_id, data):
+        self.documents[doc_id] = data
+
+
+def test_firestore_store_queues_while_connecting(monkeypatch):
+    database = LazyFirestore({})
+    database.status = CONNECTING
+    connected = threading.Event()
+    writer = FakeWriter()
+    monkeypatch.setattr(FirestoreActivityStore, '_writer', staticmethod(lambda db: writer))
+
+    def get_db():
+        connected.wait(5)
+        return database.client
+
+    store = FirestoreActivityStore(get_db, database=database)
+    # Answers at once, the connection is still being made
+    assert store.available
+    store.queue({'name': 'Chess Club'})
+    store.queue({'name': 'Chess Club', 'keywords': ['chess']})
+    assert writer.documents == {}
+
+    drainer = store._drainer
+    database._client = object()
+    connected.set()
+    drainer.join(5)
+    assert writer.documents == {'Chess Club': {'name': 'Chess Club', 'keywords': ['chess']}}
+
+    store.queue({'name': 'Go Club'})
+    assert 'Go Club' in writer.documents
+
+
+def test_firestore_store_without_a_database_is_unavailable():
+    store = FirestoreActivityStore(lambda: None, database=LazyFirestore(None, enabled=False))
+    assert store.database.status == DISABLED
+    assert not store.available
+
+
+def test_firestore_store_finds_nothing_without_a_client():
+    store = FirestoreActivityStore(lambda: None)
+    assert store.search(['chess']) == []
+    assert store.similar('chess') == []
+    assert store.in_categories(['Games']) == []
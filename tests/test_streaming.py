@@ -0,0 +1,114 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+import requests
+
+import sse_stub
+from streaming import TELEGRAM_MAX_MESSAGE_LENGTH, ProgressiveMessage, iter_completion_deltas, iter_sse_data
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class Message:
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+class RetryAfter(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Flood control exceeded. Retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.edited = []
+        self.fail_next = None
+
+    def send_message(self, chat_id, text):
+        self.sent.append(text)
+        return Message(len(self.sent))
+
+    def edit_message_text(self, text, chat_id, message_id):
+        if self.fail_next is not None:
+            error, self.fail_next = self.fail_next, None
+            raise error
+        self.edited.append((message_id, text))
+
+
+def test_sse_events_and_deltas():
+    lines = [b': keep-alive', b'data: {"choices": [{"delta": {"role": "assistant"}}]}', b'',
+             b'data: {"choices": [{"delta": {"content": "Hel"}}]}', b'',
+             b'data: {"choices": [{"delta": {"content": "lo"}}]}', b'', b'data: [DONE]', b'',
+             b'data: {"choices": [{"delta": {"content": "ignored"}}]}', b'']
+    assert list(iter_sse_data([b'data: a', b'data: b', b''])) == ['a\nb']
+    assert ''.join(iter_completion_deltas(lines)) == 'Hello'
+
+
+def test_edits_are_rate_limited():
+    bot, clock = FakeBot(), FakeClock()
+    message = ProgressiveMessage(bot, 1, min_interval=1.0, clock=clock, sleep=clock.sleep)
+
+    message.append('Hello')
+    message.append(' there')  # Within the interval, not shown yet
+    assert bot.sent == ['Hello'] and bot.edited == []
+
+    clock.now = 1.5
+    message.append(' and')
+    assert bot.edited == [(1, 'Hello there and')]
+
+    message.append(' goodbye')
+    assert message.finish() == 'Hello there and goodbye'
+    # The final edit waited out the interval instead of being dropped
+    assert bot.edited[-1] == (1, 'Hello there and goodbye')
+    assert clock.now == 2.5
+
+
+def test_long_text_continues_in_a_new_message():
+    bot, clock = FakeBot(), FakeClock()
+    message = ProgressiveMessage(bot, 1, clock=clock, sleep=clock.sleep)
+    message.append('a' * 10)
+    message.append('b' * TELEGRAM_MAX_MESSAGE_LENGTH)
+    message.finish()
+
+    assert len(bot.sent) == 2
+    assert bot.edited == [(1, 'a' * 10 + 'b' * (TELEGRAM_MAX_MESSAGE_LENGTH - 10))]
+    assert bot.sent[1] == 'b' * 10
+
+
+def test_flood_control_postpones_edits():
+    bot, clock = FakeBot(), FakeClock()
+    message = ProgressiveMessage(bot, 1, min_interval=1.0, clock=clock, sleep=clock.sleep)
+    message.append('Hello')
+    clock.now = 1.0
+    bot.fail_next = RetryAfter(5)
+    message.append(' world')
+    assert bot.edited == []
+
+    message.finish()
+    assert bot.edited == [(1, 'Hello world')]
+    assert clock.now == 6.0
+
+
+def test_stub_server_streams_the_reply():
+    handler = type('Handler', (sse_stub.StubHandler,), {'reply': 'one two three', 'token_delay': 0,
+                                                        'first_token_delay': 0})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/deployments/gpt/chat/completions'
+        with requests.post(url, json={'stream': True}, stream=True, timeout=5) as response:
+            assert ''.join(iter_completion_deltas(response.iter_lines())) == 'one two three'
+    finally:
+        server.shutdown()
+        server.server_close()
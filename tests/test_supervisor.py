@@ -0,0 +1,30 @@
+from collections import Counter
+
+from supervisor import HashRing, update_chat_id
+
+
+def test_ring_is_deterministic_and_spreads_keys():
+    ring = HashRing(list(range(4)))
+    owners = [ring.node_for(chat_id) for chat_id in range(10000)]
+    assert owners == [HashRing(list(range(4))).node_for(chat_id) for chat_id in range(10000)]
+
+    counts = Counter(owners)
+    assert set(counts) == {0, 1, 2, 3}
+    assert max(counts.values()) < 2 * min(counts.values())
+
+
+def test_adding_a_worker_moves_few_keys():
+    before = HashRing(list(range(4)))
+    after = HashRing(list(range(5)))
+    moved = sum(before.node_for(chat_id) != after.node_for(chat_id) for chat_id in range(10000))
+    # About 1/5 of the keys move, all of them to the new worker
+    assert moved < 0.3 * 10000
+    assert all(after.node_for(chat_id) == 4 for chat_id in range(10000)
+               if before.node_for(chat_id) != after.node_for(chat_id))
+
+
+def test_update_chat_id():
+    assert update_chat_id({'update_id': 1, 'message': {'chat': {'id': 42}, 'from': {'id': 7}}}) == 42
+    assert update_chat_id({'update_id': 2, 'callback_query': {'from': {'id': 7}, 'message': {'chat': {'id': 43}}}}) == 43
+    assert update_chat_id({'update_id': 3, 'inline_query': {'from': {'id': 7}}}) == 7
+    assert update_chat_id({'update_id': 4}) is None
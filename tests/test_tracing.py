@@ -0,0 +1,127 @@
+import json
+
+import pytest
+
+from tracing import JsonFileExporter, Tracer
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def tracer():
+    return Tracer(exporter=ListExporter())
+
+
+def by_name(tracer):
+    return {span.name: span for span in tracer.exporter.spans}
+
+
+def test_spans_nest(tracer):
+    with tracer.span('outer'):
+        with tracer.span('inner'):
+            pass
+    spans = by_name(tracer)
+    assert spans['inner'].parent_id == spans['outer'].span_id
+    assert spans['inner'].trace_id == spans['outer'].trace_id
+
+
+def test_spans_opened_by_a_traced_generator_nest_under_it(tracer):
+    @tracer.traced('stream')
+    def stream():
+        with tracer.span('upstream.request'):
+            yield 'a'
+        with tracer.span('upstream.read'):
+            yield 'b'
+
+    with tracer.span('message'):
+        for _ in stream():
+            # Runs between resumes, belongs to the caller
+            with tracer.span('telegram.edit'):
+                pass
+
+    spans = [span for span in tracer.exporter.spans]
+    names = {span.span_id: span.name for span in spans}
+    parents = {span.name: names.get(span.parent_id) for span in spans}
+    assert parents['stream'] == 'message'
+    assert parents['upstream.request'] == 'stream'
+    assert parents['upstream.read'] == 'stream'
+    assert parents['telegram.edit'] == 'message'
+
+
+def test_traced_generator_records_errors_and_early_close(tracer):
+    @tracer.traced('stream')
+    def stream():
+        yield 1
+        raise ValueError('broken')
+
+    with pytest.raises(ValueError):
+        list(stream())
+    assert tracer.exporter.spans[-1].error == 'ValueError: broken'
+
+    generator = stream()
+    next(generator)
+    generator.close()
+    assert tracer.exporter.spans[-1].attributes == {'abandoned': True}
+    assert tracer.exporter.spans[-1].error is None
+    assert tracer.stats()['stream']['count'] == 2
+
+
+def test_traced_generator_passes_sent_values_and_return_value(tracer):
+    @tracer.traced('echo')
+    def echo():
+        received = yield 'ready'
+        yield received
+        return 'done'
+
+    generator = echo()
+    assert next(generator) == 'ready'
+    assert generator.send('hello') == 'hello'
+    with pytest.raises(StopIteration) as stop:
+        next(generator)
+    assert stop.value.value == 'done'
+
+
+def test_histogram_quantiles():
+    tracer = Tracer(buckets_ms=(10, 100, 1000))
+    for seconds in (0.005,) * 90 + (0.05,) * 9 + (2.0,):
+        tracer.record('stage', seconds)
+    stats = tracer.stats()['stage']
+    assert stats['count'] == 100
+    assert (stats['p50_ms'], stats['p95_ms'], stats['p99_ms']) == (10, 100, 100)
+    assert stats['max_ms'] == 2000
+    assert stats['buckets'] == {10: 90, 100: 99, 1000: 99}
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer(enabled=False)
+
+    @tracer.traced('stream')
+    def stream():
+        yield 1
+
+    assert list(stream()) == [1]
+    assert tracer.stats() == {}
+
+
+def test_json_exporter_writes_otlp(tmp_path):
+    path = tmp_path / 'traces.jsonl'
+    tracer = Tracer(exporter=JsonFileExporter(str(path), flush_interval=10))
+    with tracer.span('outer', chat='1'):
+        with tracer.span('inner'):
+            pass
+    tracer.set_exporter(None)
+
+    document = json.loads(path.read_text().splitlines()[0])
+    spans = document['resourceSpans'][0]['scopeSpans'][0]['spans']
+    assert [span['name'] for span in spans] == ['inner', 'outer']
+    assert spans[0]['parentSpanId'] == spans[1]['spanId']
+    assert spans[1]['attributes'] == [{'key': 'chat', 'value': {'stringValue': '1'}}]
@@ -0,0 +1,126 @@
+import threading
+
+import write_behind
+from write_behind import WriteBehindQueue, get_write_behind, retarget_write_behind
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data):
+        self.writes.append((ref, data))
+
+    def commit(self):
+        with self.db.lock:
+            if self.db.failures:
+                self.db.failures -= 1
+                raise RuntimeError('unavailable')
+            self.db.commits.append(list(self.writes))
+            for ref, data in self.writes:
+                self.db.documents[ref] = data
+
+
+class FakeCollection:
+    def document(self, doc_id):
+        return doc_id
+
+
+class FakeDb:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.commits = []
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def collection(self, name):
+        return FakeCollection()
+
+
+def test_newer_versions_replace_queued_ones():
+    db = FakeDb()
+    writer = WriteBehindQueue(db, flush_interval=0.2)
+    try:
+        writer.put('a', {'v': 1})
+        writer.put('b', {'v': 1})
+        writer.put('a', {'v': 2})
+        assert writer.flush(5)
+    finally:
+        writer.close()
+
+    assert db.documents == {'a': {'v': 2}, 'b': {'v': 1}}
+    assert sum(len(commit) for commit in db.commits) == 2
+    stats = writer.stats()
+    assert (stats['queued'], stats['deduplicated'], stats['written']) == (3, 1, 2)
+
+
+def test_batches_are_split_at_batch_size():
+    db = FakeDb()
+    writer = WriteBehindQueue(db, flush_interval=0.05, batch_size=3)
+    try:
+        for i in range(7):
+            writer.put(f'doc{i}', {'i': i})
+        assert writer.flush(5)
+    finally:
+        writer.close()
+    assert all(len(commit) <= 3 for commit in db.commits)
+    assert len(db.documents) == 7
+
+
+def test_failed_batches_are_retried_then_dropped():
+    errors = []
+    db = FakeDb(failures=1)
+    writer = WriteBehindQueue(db, flush_interval=0.01, on_error=errors.append)
+    try:
+        writer.put('a', {'v': 1})
+        assert writer.flush(5)
+    finally:
+        writer.close()
+    assert db.documents == {'a': {'v': 1}}
+    assert len(errors) == 1 and writer.stats()['failed_batches'] == 1
+
+    db = FakeDb(failures=10)
+    writer = WriteBehindQueue(db, flush_interval=0.01, max_attempts=2)
+    try:
+        writer.put('a', {'v': 1})
+        assert writer.flush(5)
+    finally:
+        writer.close()
+    assert db.documents == {}
+    assert writer.stats()['dropped'] == 1
+
+
+def test_persisted_callback_runs_after_commit():
+    db = FakeDb()
+    persisted = []
+    writer = WriteBehindQueue(db, flush_interval=0.01,
+                              on_persisted=lambda doc_id, data: persisted.append((doc_id, doc_id in db.documents)))
+    writer.put('a', {'v': 1})
+    assert writer.close(5)
+    assert persisted == [('a', True)]
+
+
+def test_close_writes_out_queued_documents():
+    db = FakeDb()
+    writer = WriteBehindQueue(db, flush_interval=10)
+    for i in range(5):
+        writer.put(f'doc{i}', {'i': i})
+    assert writer.close(5)
+    assert len(db.documents) == 5
+
+
+def test_retarget_moves_queued_writes_to_the_new_client():
+    old, new = FakeDb(), FakeDb()
+    try:
+        writer = get_write_behind(old, 'Activities', flush_interval=10)
+        writer.put('a', {'v': 1})
+        retarget_write_behind(old, new)
+        assert get_write_behind(new, 'Activities') is writer
+        assert writer.flush(5)
+    finally:
+        write_behind.close_write_behind(5)
+    assert new.documents == {'a': {'v': 1}} and old.documents == {}